@@ -0,0 +1,221 @@
+"""
+Shared benchmark harness: HDR-style latency histograms, open/closed-loop load
+drivers and JSON results that can be diffed against a saved baseline.
+"""
+import asyncio
+import json
+import math
+import platform
+import sys
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram in the spirit of HdrHistogram.
+
+    Values are recorded as integer microseconds. Every power-of-two range is
+    split into 2^sub_bucket_bits linear sub-buckets, so any recorded value is
+    reproduced within the requested number of significant figures while
+    memory stays proportional to the number of distinct buckets hit.
+    """
+
+    def __init__(self, significant_figures: int = 3):
+        self.significant_figures = significant_figures
+        # Relative bucket width 2^-(bits-1) must be below 10^-figures
+        self.sub_bucket_bits = math.ceil(math.log2(2 * 10 ** significant_figures))
+        self.counts: Dict[int, int] = defaultdict(int)
+        self.total = 0
+        self.sum_us = 0
+        self.min_us: Optional[int] = None
+        self.max_us = 0
+
+    def _index(self, value: int) -> int:
+        exponent = max(0, value.bit_length() - self.sub_bucket_bits)
+        return (exponent << self.sub_bucket_bits) + (value >> exponent)
+
+    def _highest_equivalent(self, index: int) -> int:
+        exponent = index >> self.sub_bucket_bits
+        mantissa = index & ((1 << self.sub_bucket_bits) - 1)
+        if exponent == 0:
+            return mantissa
+        return ((mantissa + 1) << exponent) - 1
+
+    def record(self, seconds: float, count: int = 1):
+        value = max(0, int(round(seconds * 1e6)))
+        self.counts[self._index(value)] += count
+        self.total += count
+        self.sum_us += value * count
+        self.min_us = value if self.min_us is None else min(self.min_us, value)
+        self.max_us = max(self.max_us, value)
+
+    def merge(self, other: "LatencyHistogram"):
+        for index, count in other.counts.items():
+            self.counts[index] += count
+        self.total += other.total
+        self.sum_us += other.sum_us
+        if other.min_us is not None:
+            self.min_us = other.min_us if self.min_us is None else min(self.min_us, other.min_us)
+        self.max_us = max(self.max_us, other.max_us)
+
+    def percentile_ms(self, percentile: float) -> float:
+        if not self.total:
+            return 0.0
+        target = max(1, math.ceil(self.total * percentile / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._highest_equivalent(index), self.max_us) / 1000
+        return self.max_us / 1000
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.total,
+            "mean": self.sum_us / self.total / 1000 if self.total else 0.0,
+            "min": (self.min_us or 0) / 1000,
+            "p50": self.percentile_ms(50),
+            "p90": self.percentile_ms(90),
+            "p99": self.percentile_ms(99),
+            "p99_9": self.percentile_ms(99.9),
+            "max": self.max_us / 1000
+        }
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "significant_figures": self.significant_figures,
+            "counts": {str(k): v for k, v in sorted(self.counts.items())}
+        }
+
+
+@dataclass
+class LoadResult:
+    requests: int
+    successful: int
+    failed: int
+    duration: float
+    histogram: LatencyHistogram = field(default_factory=LatencyHistogram)
+    errors: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+
+    @property
+    def throughput(self) -> float:
+        return self.successful / self.duration if self.duration > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "requests": self.requests,
+            "successful": self.successful,
+            "failed": self.failed,
+            "duration_sec": self.duration,
+            "throughput": self.throughput,
+            "latency_ms": self.histogram.summary(),
+            "errors": dict(self.errors),
+            "histogram": self.histogram.to_dict()
+        }
+
+
+# A send function performs request #i and returns None on success or an error label
+SendFn = Callable[[int], Awaitable[Optional[str]]]
+
+
+async def _timed(send: SendFn, i: int, intended_start: float, result: LoadResult):
+    try:
+        error = await send(i)
+    except Exception as e:
+        error = type(e).__name__
+    # Measured from the *intended* start: a stalled server delays later sends,
+    # and that queueing time must show up in the latency (coordinated omission)
+    latency = time.perf_counter() - intended_start
+    if error is None:
+        result.successful += 1
+        result.histogram.record(latency)
+    else:
+        result.failed += 1
+        result.errors[error] += 1
+
+
+async def run_open_loop(send: SendFn, rate: float, total: int) -> LoadResult:
+    """Fire requests at a fixed arrival rate regardless of how fast responses come back"""
+    result = LoadResult(requests=total, successful=0, failed=0, duration=0.0)
+    tasks: List[asyncio.Task] = []
+    start = time.perf_counter()
+    for i in range(total):
+        intended = start + i / rate
+        delay = intended - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(_timed(send, i, intended, result)))
+    await asyncio.gather(*tasks)
+    result.duration = time.perf_counter() - start
+    return result
+
+
+async def run_closed_loop(send: SendFn, concurrency: int, total: int) -> LoadResult:
+    """N clients each sending the next request only after the previous answer"""
+    result = LoadResult(requests=total, successful=0, failed=0, duration=0.0)
+    counter = iter(range(total))
+
+    async def client():
+        for i in counter:
+            await _timed(send, i, time.perf_counter(), result)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    result.duration = time.perf_counter() - start
+    return result
+
+
+def environment() -> Dict[str, str]:
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine()
+    }
+
+
+def write_results(path: str, benchmark: str, config: Dict[str, object], results: Dict[str, object]):
+    with open(path, "w") as f:
+        json.dump({
+            "benchmark": benchmark,
+            "timestamp": time.time(),
+            "environment": environment(),
+            "config": config,
+            "results": results
+        }, f, indent=2, sort_keys=True)
+
+
+def _lookup(results: Dict[str, object], path: str) -> Optional[float]:
+    node = results
+    for key in path.split("."):
+        if not isinstance(node, dict) or key not in node:
+            return None
+        node = node[key]
+    return node if isinstance(node, (int, float)) else None
+
+
+def compare_to_baseline(
+    results: Dict[str, object],
+    baseline: Dict[str, object],
+    lower_is_better: List[str],
+    higher_is_better: List[str],
+    max_regression: float = 0.10
+) -> List[str]:
+    """Return a human-readable line per metric that regressed by more than max_regression"""
+    regressions = []
+    for path in lower_is_better + higher_is_better:
+        current, previous = _lookup(results, path), _lookup(baseline, path)
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        worse = change > max_regression if path in lower_is_better else -change > max_regression
+        if worse:
+            regressions.append(f"{path}: {previous:.4g} -> {current:.4g} ({change:+.1%})")
+    return regressions
+
+
+def load_baseline(path: str) -> Dict[str, object]:
+    with open(path) as f:
+        return json.load(f)["results"]
@@ -1,99 +1,194 @@
 """
-Load test script for AI Job Orchestrator
-Usage: python load_test.py --jobs 1000 --concurrency 50
+Load test for the AI Job Orchestrator job API
+Usage:
+    # Self-contained: app runs in process against SQLite + fakeredis
+    # (set DATABASE_URL to point it at an async test Postgres instead)
+    python load_test.py --in-process --rate 200 --jobs 2000 --output results.json
+
+    # Against a running deployment
+    python load_test.py --url http://localhost:8000 --rate 500 --jobs 10000
+
+    # Fail (exit 1) if p50/p99/throughput regressed more than 10% vs a saved run
+    python load_test.py --in-process --baseline baseline.json --max-regression 0.1
+
+--rate drives an open-loop, fixed-arrival-rate load (latency is measured from
+the scheduled send time, so server stalls are not hidden). --concurrency
+switches to the old closed-loop mode.
 """
-import asyncio
-import aiohttp
-import time
-import statistics
 import argparse
-from dataclasses import dataclass
+import asyncio
+import os
+import sys
+import tempfile
+import uuid
+from contextlib import asynccontextmanager
+
+import httpx
+
+from harness import (
+    run_open_loop, run_closed_loop, write_results, load_baseline, compare_to_baseline
+)
 
 TOKEN = "fake-super-secret-token"
-API_URL = "http://localhost:8000/api/v1/jobs/"
-
-@dataclass
-class BenchmarkResult:
-    total_jobs: int
-    successful: int
-    failed: int
-    duration: float
-    throughput: float
-    latencies: list
-
-async def submit_job(session, url):
-    start = time.perf_counter()
-    json_data = {
+JOBS_PATH = "/api/v1/jobs/"
+JOB_SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "job-service")
+
+LOWER_IS_BETTER = ["latency_ms.p50", "latency_ms.p99"]
+HIGHER_IS_BETTER = ["throughput"]
+
+
+def job_payload(run_id: str, i: int) -> dict:
+    return {
+        "external_id": f"bench-{run_id}-{i}",
         "job_type": "inference",
         "priority": 50,
-        "image": "pytorch-inference:latest"
+        "image": "pytorch-inference:latest",
+        "command": ["python", "main.py"],
+        "input_config": {"source": "s3://bench/input"}
     }
-    headers = {"Authorization": f"Bearer {TOKEN}"}
-    
+
+
+@asynccontextmanager
+async def in_process_client(redis_url: str = None):
+    """ASGI client for the app wired to a throwaway SQLite DB and fakeredis (or a local redis-server)"""
+    # Must be set before the app (and its settings/engine) is imported
+    tmpdir = tempfile.TemporaryDirectory()
+    os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{tmpdir.name}/bench.db")
+    os.environ.setdefault("OTLP_ENDPOINT", "")
+    sys.path.insert(0, os.path.abspath(JOB_SERVICE_DIR))
+
+    import redis.asyncio as redis
+    from sqlalchemy import event
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    from app.main import app
+    from app.api import dependencies
+    from app.db.models import Base
+
+    database_url = os.environ["DATABASE_URL"]
+    is_sqlite = database_url.startswith("sqlite")
+    engine = create_async_engine(database_url, connect_args={"timeout": 30} if is_sqlite else {})
+
+    if is_sqlite:
+        @event.listens_for(engine.sync_engine, "connect")
+        def _sqlite_wal(dbapi_connection, _):
+            # WAL lets readers proceed while the single writer commits
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+
+    if redis_url:
+        redis_client = redis.from_url(redis_url)
+    else:
+        import fakeredis
+        redis_client = fakeredis.aioredis.FakeRedis()
+
+    async def get_db():
+        async with sessions() as session:
+            yield session
+
+    async def get_redis():
+        yield redis_client
+
+    app.dependency_overrides[dependencies.get_db] = get_db
+    app.dependency_overrides[dependencies.get_redis] = get_redis
     try:
-        async with session.post(url, json=json_data, headers=headers) as resp:
-            latency = (time.perf_counter() - start) * 1000
-            return resp.status == 200, latency
-    except Exception:
-        return False, 0
-
-async def run_benchmark(num_jobs, concurrency):
-    print(f"Starting benchmark: {num_jobs} jobs, {concurrency} concurrency")
-    
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        latencies = []
-        success = 0
-        failed = 0
-        
-        start_time = time.perf_counter()
-        
-        # Batch creation for simplicity in this script
-        # Real load test uses a semaphore or worker queue
-        semaphore = asyncio.Semaphore(concurrency)
-        
-        async def bounded_submit():
-            async with semaphore:
-                ok, lat = await submit_job(session, API_URL)
-                return ok, lat
-
-        tasks = [bounded_submit() for _ in range(num_jobs)]
-        results = await asyncio.gather(*tasks)
-        
-        total_time = time.perf_counter() - start_time
-        
-        for ok, lat in results:
-            if ok:
-                success += 1
-                latencies.append(lat)
-            else:
-                failed += 1
-                
-        return BenchmarkResult(
-            total_jobs=num_jobs,
-            successful=success,
-            failed=failed,
-            duration=total_time,
-            throughput=success / total_time if total_time > 0 else 0,
-            latencies=latencies
-        )
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            yield client
+    finally:
+        app.dependency_overrides.clear()
+        await redis_client.aclose()
+        await engine.dispose()
+        tmpdir.cleanup()
+
+
+@asynccontextmanager
+async def live_client(url: str, max_connections: int):
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        yield client
+
+
+async def run_benchmark(args) -> dict:
+    run_id = uuid.uuid4().hex[:8]
+    headers = {"Authorization": f"Bearer {TOKEN}"}
+    if args.in_process:
+        client_cm = in_process_client(args.redis_url)
+    else:
+        client_cm = live_client(args.url, args.max_connections)
+
+    async with client_cm as client:
+        async def send(i: int):
+            resp = await client.post(JOBS_PATH, json=job_payload(run_id, i), headers=headers)
+            return None if resp.status_code == 200 else f"http_{resp.status_code}"
+
+        # Warm connection pools, DB and import paths outside the measured window
+        for i in range(args.warmup):
+            await client.post(JOBS_PATH, json=job_payload(run_id + "-warmup", i), headers=headers)
+
+        if args.concurrency:
+            result = await run_closed_loop(send, args.concurrency, args.jobs)
+        else:
+            result = await run_open_loop(send, args.rate, args.jobs)
+    return result.to_dict()
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--jobs", type=int, default=100)
-    parser.add_argument("--concurrency", type=int, default=10)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", default="http://localhost:8000")
+    target.add_argument("--in-process", action="store_true", help="Run the app in process (SQLite + fakeredis)")
+    parser.add_argument("--redis-url", help="Use a local redis-server instead of fakeredis (in-process mode)")
+    parser.add_argument("--jobs", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=100.0, help="Open-loop arrival rate (jobs/sec)")
+    parser.add_argument("--concurrency", type=int, help="Closed-loop mode with N concurrent clients")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--output", help="Write machine-readable results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against results JSON from a previous run")
+    parser.add_argument("--max-regression", type=float, default=0.10)
     args = parser.parse_args()
-    
-    res = asyncio.run(run_benchmark(args.jobs, args.concurrency))
-    
+
+    mode = f"closed-loop, concurrency {args.concurrency}" if args.concurrency else f"open-loop, {args.rate:g} jobs/s"
+    print(f"Starting benchmark: {args.jobs} jobs ({mode}, {'in-process' if args.in_process else args.url})")
+    res = asyncio.run(run_benchmark(args))
+
+    latency = res["latency_ms"]
     print("\nBenchmark Results")
     print("=================")
-    print(f"Total Jobs: {res.total_jobs}")
-    print(f"Successful: {res.successful}")
-    print(f"Failed:     {res.failed}")
-    print(f"Duration:   {res.duration:.2f}s")
-    print(f"Throughput: {res.throughput:.2f} jobs/sec")
-    if res.latencies:
-        print(f"P50 Latency: {statistics.median(res.latencies):.2f}ms")
-        print(f"P95 Latency: {statistics.quantiles(res.latencies, n=20)[-1]:.2f}ms")
-        print(f"P99 Latency: {statistics.quantiles(res.latencies, n=100)[-1]:.2f}ms")
+    print(f"Total Jobs: {res['requests']}")
+    print(f"Successful: {res['successful']}")
+    print(f"Failed:     {res['failed']} {res['errors'] or ''}")
+    print(f"Duration:   {res['duration_sec']:.2f}s")
+    print(f"Throughput: {res['throughput']:.2f} jobs/sec")
+    print(f"P50 Latency:   {latency['p50']:.2f}ms")
+    print(f"P90 Latency:   {latency['p90']:.2f}ms")
+    print(f"P99 Latency:   {latency['p99']:.2f}ms")
+    print(f"P99.9 Latency: {latency['p99_9']:.2f}ms")
+    print(f"Max Latency:   {latency['max']:.2f}ms")
+
+    config = {
+        "jobs": args.jobs,
+        "rate": None if args.concurrency else args.rate,
+        "concurrency": args.concurrency,
+        "target": "in-process" if args.in_process else args.url,
+        "redis": args.redis_url or ("fakeredis" if args.in_process else None)
+    }
+    if args.output:
+        write_results(args.output, "job_api_submit", config, res)
+
+    if args.baseline:
+        regressions = compare_to_baseline(
+            res, load_baseline(args.baseline), LOWER_IS_BETTER, HIGHER_IS_BETTER, args.max_regression
+        )
+        if regressions:
+            print("\nRegressions vs baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.max_regression:.0%} vs baseline")
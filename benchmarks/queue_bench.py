@@ -0,0 +1,294 @@
+"""
+Job queue microbenchmarks across queue depth, batch size and payload size
+Usage:
+    python queue_bench.py --output queue.json
+    python queue_bench.py --depths 1000 100000 1000000 --redis-url redis://localhost:6379/15
+    python queue_bench.py --baseline queue.json --max-regression 0.15
+
+For every (depth, payload size) the queue is prefilled to `depth` jobs, then
+enqueue, dequeue(count=batch), complete and fail are each timed over a fixed
+number of jobs. Enqueue goes through the API's RedisJobQueue; dequeue, complete
+and fail through the WorkerJobQueue the workers run (ai_jobs.job_queue). Reported per cell: ops/sec (jobs/sec), Redis round trips per
+job and Redis memory per queued job. Each cell is measured --repeats times and
+the median is kept so runs are comparable across queue changes.
+
+Runs against fakeredis by default. Use --redis-url for real numbers, ideally
+a dedicated local redis-server: the selected DB is FLUSHed between cells.
+"""
+import argparse
+import asyncio
+import gc
+import inspect
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from harness import write_results, load_baseline, compare_to_baseline
+
+JOB_SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "job-service")
+sys.path.insert(0, os.path.abspath(JOB_SERVICE_DIR))
+
+from ai_jobs.fair_share import resource_class  # noqa: E402
+from ai_jobs.job_queue import JobMessage, WorkerJobQueue  # noqa: E402
+from app.services.redis_queue import RedisJobQueue  # noqa: E402
+
+PREFILL_BATCH = 1000
+
+
+class RoundTripCounter:
+    """Counts network round trips: one per direct command, one per pipeline execute"""
+
+    def __init__(self):
+        self.count = 0
+
+    def attach_async(self, client):
+        original_execute = client.execute_command
+        original_pipeline = client.pipeline
+
+        async def execute_command(*args, **kwargs):
+            self.count += 1
+            return await original_execute(*args, **kwargs)
+
+        def pipeline(*args, **kwargs):
+            pipe = original_pipeline(*args, **kwargs)
+            original_pipe_execute = pipe.execute
+
+            async def execute(*a, **kw):
+                self.count += 1
+                return await original_pipe_execute(*a, **kw)
+
+            pipe.execute = execute
+            return pipe
+
+        client.execute_command = execute_command
+        client.pipeline = pipeline
+
+    def attach(self, client):
+        """Same for the synchronous client the worker queue uses"""
+        original_execute = client.execute_command
+        original_pipeline = client.pipeline
+
+        def execute_command(*args, **kwargs):
+            self.count += 1
+            return original_execute(*args, **kwargs)
+
+        def pipeline(*args, **kwargs):
+            pipe = original_pipeline(*args, **kwargs)
+            original_pipe_execute = pipe.execute
+
+            def execute(*a, **kw):
+                self.count += 1
+                return original_pipe_execute(*a, **kw)
+
+            pipe.execute = execute
+            return pipe
+
+        client.execute_command = execute_command
+        client.pipeline = pipeline
+
+
+def make_job(job_id: str, payload_bytes: int, priority: int) -> JobMessage:
+    return JobMessage(
+        job_id=job_id,
+        job_type="inference",
+        priority=priority,
+        payload={"blob": "x" * payload_bytes},
+        submitted_at=datetime.utcnow().isoformat()
+    )
+
+
+async def prefill(client, depth: int, payload_bytes: int):
+    """Fill the queue through RedisJobQueue itself, batched into pipelines"""
+    for start in range(0, depth, PREFILL_BATCH):
+        pipe = client.pipeline(transaction=False)
+        queue = RedisJobQueue(pipe)
+        for i in range(start, min(depth, start + PREFILL_BATCH)):
+            await queue.enqueue(make_job(f"prefill-{i}", payload_bytes, i % 100))
+        await pipe.execute()
+
+
+async def used_memory(client) -> Optional[int]:
+    try:
+        return int((await client.info("memory"))["used_memory"])
+    except Exception:
+        return None
+
+
+async def memory_per_job(client, queue: RedisJobQueue, depth: int, baseline_memory: Optional[int]):
+    """Bytes per queued job from INFO, or DUMP sizes where the backend has no INFO (fakeredis)"""
+    current = await used_memory(client)
+    if current is not None and baseline_memory is not None and depth:
+        return (current - baseline_memory) / depth, "info"
+    sample = [f"prefill-{i}" for i in range(0, depth, max(1, depth // 100))]
+    dumped = 0
+    for job_id in sample:
+        data = await client.dump(queue.job_data_key.format(job_id=job_id))
+        dumped += len(data or b"")
+    zset = await client.dump(queue.queue_key.format(queue="default", resource_class=resource_class("inference")))
+    per_job = dumped / len(sample) + len(zset or b"") / depth if sample else 0.0
+    return per_job, "dump_estimate"
+
+
+async def measure(counter: RoundTripCounter, fn, jobs: int) -> Dict[str, float]:
+    """Run fn() (which processes `jobs` jobs, sync or async) and report throughput + round trips per job"""
+    gc.collect()
+    counter.count = 0
+    start = time.perf_counter()
+    outcome = fn()
+    if inspect.isawaitable(outcome):
+        await outcome
+    elapsed = time.perf_counter() - start
+    return {"ops_per_sec": jobs / elapsed, "round_trips_per_op": counter.count / jobs}
+
+
+async def bench_cell(
+    client, worker_client, counter, depth, payload_bytes, batch_sizes, ops, repeats
+) -> Dict[str, Dict]:
+    results: Dict[str, Dict] = {}
+    await client.flushdb()
+    before = await used_memory(client)
+    await prefill(client, depth, payload_bytes)
+    queue = RedisJobQueue(client)
+    worker_queue = WorkerJobQueue(worker_client)
+    per_job, method = await memory_per_job(client, queue, depth, before)
+
+    samples: Dict[str, List[Dict[str, float]]] = {}
+    seq = 0
+    for _ in range(repeats):
+        # enqueue: ops new jobs on top of the prefilled depth
+        ids = [f"bench-{seq}-{i}" for i in range(ops)]
+        seq += 1
+
+        async def do_enqueue():
+            for i, job_id in enumerate(ids):
+                await queue.enqueue(make_job(job_id, payload_bytes, i % 100))
+
+        samples.setdefault("enqueue", []).append(await measure(counter, do_enqueue, ops))
+
+        for batch in batch_sizes:
+            dequeued: List[JobMessage] = []
+
+            def do_dequeue():
+                while len(dequeued) < ops:
+                    jobs = worker_queue.dequeue(min(batch, ops - len(dequeued)))
+                    if not jobs:
+                        break
+                    dequeued.extend(jobs)
+
+            samples.setdefault(f"dequeue|batch={batch}", []).append(await measure(counter, do_dequeue, ops))
+
+            # Half of the dequeued jobs complete, half fail (and get retried)
+            half = len(dequeued) // 2
+
+            def do_complete():
+                for job in dequeued[:half]:
+                    worker_queue.complete(job, {"ok": True})
+
+            def do_fail():
+                for job in dequeued[half:]:
+                    worker_queue.fail(job, "benchmark failure")
+
+            samples.setdefault(f"complete|batch={batch}", []).append(await measure(counter, do_complete, max(1, half)))
+            samples.setdefault(f"fail|batch={batch}", []).append(
+                await measure(counter, do_fail, max(1, len(dequeued) - half))
+            )
+
+    for op, runs in samples.items():
+        key = f"{op}|depth={depth}|payload={payload_bytes}"
+        results[key] = {
+            "ops_per_sec": statistics.median(r["ops_per_sec"] for r in runs),
+            "round_trips_per_op": statistics.median(r["round_trips_per_op"] for r in runs),
+            "memory_bytes_per_job": per_job,
+            "memory_method": method
+        }
+    return results
+
+
+async def run(args) -> Dict[str, Dict]:
+    # The API side enqueues through the async client, the worker side runs on a sync one
+    if args.redis_url:
+        import redis
+        import redis.asyncio
+        client = redis.asyncio.from_url(args.redis_url)
+        worker_client = redis.from_url(args.redis_url)
+    else:
+        import fakeredis
+        server = fakeredis.FakeServer()
+        client = fakeredis.aioredis.FakeRedis(server=server)
+        worker_client = fakeredis.FakeRedis(server=server)
+    counter = RoundTripCounter()
+    counter.attach_async(client)
+    counter.attach(worker_client)
+
+    results: Dict[str, Dict] = {}
+    try:
+        for depth in args.depths:
+            for payload_bytes in args.payload_sizes:
+                print(f"depth={depth} payload={payload_bytes}B ...", flush=True)
+                cell = await bench_cell(
+                    client, worker_client, counter, depth, payload_bytes, args.batch_sizes, args.ops, args.repeats
+                )
+                results.update(cell)
+    finally:
+        await client.flushdb()
+        await client.aclose()
+        worker_client.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depths", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--payload-sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--ops", type=int, default=1000, help="Jobs processed per measured operation")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--redis-url", help="Real Redis (DB gets flushed!) instead of fakeredis")
+    parser.add_argument("--output", help="Write machine-readable results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against results JSON from a previous run")
+    parser.add_argument("--max-regression", type=float, default=0.10)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    print(f"\n{'operation':<48} {'ops/sec':>12} {'RT/op':>8} {'mem/job':>10}")
+    for key, r in results.items():
+        print(
+            f"{key:<48} {r['ops_per_sec']:>12.0f} {r['round_trips_per_op']:>8.2f} "
+            f"{r['memory_bytes_per_job']:>9.0f}B"
+        )
+
+    config = {
+        "depths": args.depths,
+        "batch_sizes": args.batch_sizes,
+        "payload_sizes": args.payload_sizes,
+        "ops": args.ops,
+        "repeats": args.repeats,
+        "redis": args.redis_url or "fakeredis"
+    }
+    if args.output:
+        write_results(args.output, "redis_job_queue", config, results)
+
+    if args.baseline:
+        baseline = load_baseline(args.baseline)
+        # Round trips are deterministic, so any increase is flagged; throughput uses the tolerance
+        regressions = compare_to_baseline(
+            results, baseline,
+            lower_is_better=[f"{k}.round_trips_per_op" for k in results],
+            higher_is_better=[],
+            max_regression=0.0
+        ) + compare_to_baseline(
+            results, baseline,
+            lower_is_better=[],
+            higher_is_better=[f"{k}.ops_per_sec" for k in results],
+            max_regression=args.max_regression
+        )
+        if regressions:
+            print("\nRegressions vs baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo round trip increases and no throughput regressions beyond {args.max_regression:.0%} vs baseline")
@@ -0,0 +1 @@
+"""Queue protocol shared by the job-service and the workers"""
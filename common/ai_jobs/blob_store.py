@@ -0,0 +1,155 @@
+"""
+Chunked, compressed storage for job results too large to keep in Redis/Postgres.
+
+A result is split into fixed-size chunks, each compressed independently with
+zlib, plus a JSON manifest written last (its presence marks the blob complete).
+Redis and Postgres only keep the reference returned by `store_result`.
+
+    <root>/<key>/manifest.json
+    <root>/<key>/00000000.z
+    <root>/<key>/00000001.z
+    ...
+
+Workers write results with `store_result`; the job-service streams them back
+with `iter_result` from the same store (a volume shared with the API pods).
+Backends implement `BlobStore`; `LocalBlobStore` (a directory, e.g. a shared
+volume) is the only one for now and is what the tests use.
+"""
+import abc
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import zlib
+from contextlib import contextmanager
+from typing import Any, ContextManager, Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+DEFAULT_CHUNK_BYTES = 4 * 1024 * 1024
+COMPRESSION_LEVEL = 6
+# Bounds memory while streaming: compressed bytes fed / decompressed bytes produced per step
+STREAM_READ_BYTES = 256 * 1024
+STREAM_WRITE_BYTES = 1024 * 1024
+
+
+class BlobStore(abc.ABC):
+    """Backend interface; keys are relative paths like results/<job_id>"""
+
+    @abc.abstractmethod
+    def put(self, key: str, name: str, data: bytes):
+        ...
+
+    @abc.abstractmethod
+    def open(self, key: str, name: str) -> ContextManager[Any]:
+        """Context manager yielding a bytes-like view of one stored object"""
+
+    @abc.abstractmethod
+    def exists(self, key: str, name: str) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        ...
+
+
+class LocalBlobStore(BlobStore):
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str, name: str = "") -> str:
+        path = os.path.normpath(os.path.join(self.root, key, name))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Blob key escapes the store root: {key!r}")
+        return path
+
+    def put(self, key: str, name: str, data: bytes):
+        directory = self._path(key)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key, name))
+
+    @contextmanager
+    def open(self, key: str, name: str) -> Iterator[Any]:
+        # Memory-mapped: pages are read on demand and dropped under memory pressure
+        with open(self._path(key, name), "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+
+    def exists(self, key: str, name: str) -> bool:
+        return os.path.exists(self._path(key, name))
+
+    def delete(self, key: str):
+        shutil.rmtree(self._path(key), ignore_errors=True)
+
+
+def create_blob_store(url: str) -> BlobStore:
+    """file:///path or a plain path -> LocalBlobStore"""
+    parsed = urlparse(url)
+    if parsed.scheme in ("", "file"):
+        return LocalBlobStore(parsed.path if parsed.scheme else url)
+    raise ValueError(f"Unsupported blob store URL scheme: {parsed.scheme}")
+
+
+def _chunk_name(index: int) -> str:
+    return f"{index:08d}.z"
+
+
+def store_result(
+    store: BlobStore,
+    key: str,
+    data: bytes,
+    content_type: str = "application/json",
+    chunk_bytes: int = DEFAULT_CHUNK_BYTES
+) -> Dict[str, Any]:
+    """Write data as compressed chunks and return the reference to keep instead of it"""
+    chunks = []
+    for index, offset in enumerate(range(0, len(data), chunk_bytes)):
+        compressed = zlib.compress(data[offset:offset + chunk_bytes], COMPRESSION_LEVEL)
+        store.put(key, _chunk_name(index), compressed)
+        chunks.append({"size": min(chunk_bytes, len(data) - offset), "compressed_size": len(compressed)})
+    manifest = {
+        "encoding": "zlib",
+        "content_type": content_type,
+        "size": len(data),
+        "compressed_size": sum(c["compressed_size"] for c in chunks),
+        "chunks": chunks
+    }
+    store.put(key, "manifest.json", json.dumps(manifest).encode())
+    return {
+        "blob_ref": key,
+        "size": manifest["size"],
+        "compressed_size": manifest["compressed_size"],
+        "content_type": content_type
+    }
+
+
+def is_blob_ref(result: Optional[Dict[str, Any]]) -> bool:
+    return isinstance(result, dict) and "blob_ref" in result
+
+
+def read_manifest(store: BlobStore, key: str) -> Dict[str, Any]:
+    with store.open(key, "manifest.json") as data:
+        return json.loads(bytes(data))
+
+
+def iter_result(store: BlobStore, key: str, manifest: Optional[Dict[str, Any]] = None) -> Iterator[bytes]:
+    """Yield the decompressed result piece by piece, never holding more than a few MB"""
+    manifest = manifest or read_manifest(store, key)
+    for index in range(len(manifest["chunks"])):
+        with store.open(key, _chunk_name(index)) as compressed:
+            decompressor = zlib.decompressobj()
+            for offset in range(0, len(compressed), STREAM_READ_BYTES):
+                pending = compressed[offset:offset + STREAM_READ_BYTES]
+                while pending:
+                    out = decompressor.decompress(pending, STREAM_WRITE_BYTES)
+                    if out:
+                        yield out
+                    pending = decompressor.unconsumed_tail
+            tail = decompressor.flush()
+            if tail:
+                yield tail
@@ -0,0 +1,471 @@
+"""
+Weighted fair-share, resource-aware scheduling across JobQueues.
+
+Jobs are indexed by JobQueue and by resource class. The resource class is the
+job type plus GPU, CPU and memory requests, each rounded up to a power of
+two, e.g. inference:g1:c4:m16. Every (queue, class) pair has its own
+priority sorted set, ai_jobs:queue:<queue>:<class>.
+
+Fairness uses stride scheduling. Every queue has a "pass" (ai_jobs:fair:pass).
+A dequeue serves the eligible queue with the lowest pass and advances that
+pass by 1/weight, so each backlogged queue gets weight/sum(weights) of the
+dequeues no matter how many jobs it has pending. A queue that becomes active
+again starts from the current virtual time, so idling does not bank credit.
+
+Resource matching: a worker passes its free resources and job types on every
+dequeue. Only the resource classes that fit are looked at; there are a few
+dozen at most, and the set of classes with pending jobs is indexed in
+ai_jobs:fair:class_index. For each class, ai_jobs:fair:active:<class> holds
+the queues with pending jobs in that class, scored by pass. Picking a job is
+therefore O(C log Q) for C fitting classes and Q queues. Jobs are never
+scanned.
+
+Classes are rounded up, so a worker may also take some jobs of a class above
+its capacity (6 cores fit a 6-core job of c8). Such a class is looked at when
+its smallest possible request fits, and only its head job is checked against
+the exact request stored on the job hash (gpu_request, cpu_millis,
+memory_mb). If the head is too large the class is skipped for that dequeue,
+and a larger worker takes it.
+
+Every dequeued job or array task gets a lease in ai_jobs:leases (member
+"<job_id>" or "<job_id>:<task_index>", scored by its deadline on the Redis
+clock). Each lease is owned by the token of the claim that took it
+(ai_jobs:lease_owners): the running worker renews it on a heartbeat and only
+the owner may finish the job, which removes the lease. Leases that expire
+because a worker crashed or stalled are taken over with REAP_SCRIPT and the
+job is failed (and retried) by the reaper, so delivery is at-least-once; a
+late result from the worker that lost its lease is discarded.
+
+Array jobs (array_size > 0 on the job hash) are a single queue entry. Each
+dequeue of the entry claims one task index from an atomic counter (or a
+retried index from ai_jobs:array:<job_id>:retry) and puts the entry back
+while unclaimed tasks remain. A retried index whose task has a result or error
+by then (its lease was reaped but the worker still finished it) is dropped.
+Every task claim counts as one dequeue for fair share and for the
+pending-jobs gauge.
+
+The scripts run atomically in Redis, so API replicas and workers can dequeue
+concurrently. Per-queue and per-class keys are built inside the scripts. That
+is fine for a single Redis, but not for Redis Cluster.
+
+Shared by the job-service and the worker images (the `ai_jobs` package in
+common/).
+"""
+import math
+import re
+import time
+from collections import Counter as CounterDict, deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge
+
+QUEUE_KEY_PREFIX = "ai_jobs:queue:"
+ACTIVE_CLASS_PREFIX = "ai_jobs:fair:active:"
+QUEUE_CLASSES_PREFIX = "ai_jobs:fair:classes:"
+WORKER_KEY_PREFIX = "ai_jobs:worker:"
+DATA_KEY_PREFIX = "ai_jobs:data:"
+ARRAY_KEY_PREFIX = "ai_jobs:array:"
+QUEUE_PASS_KEY = "ai_jobs:fair:pass"
+QUEUE_WEIGHTS_KEY = "ai_jobs:fair:weights"
+VIRTUAL_TIME_KEY = "ai_jobs:fair:vtime"
+CLASS_INDEX_KEY = "ai_jobs:fair:class_index"
+CLASS_PENDING_KEY = "ai_jobs:fair:class_pending"
+WORKERS_KEY = "ai_jobs:workers"
+# Total jobs/tasks ever dequeued; its rate is the measured drain rate
+DEQUEUED_TOTAL_KEY = "ai_jobs:stats:dequeued"
+LEASES_KEY = "ai_jobs:leases"
+# Lease member -> token of the claim (a dequeue or a reaper) that currently owns it
+LEASE_OWNERS_KEY = "ai_jobs:lease_owners"
+# How long a dequeued job may go without finishing (or a lease renewal) before it is redelivered
+DEFAULT_LEASE_SEC = 600
+DEFAULT_QUEUE = "default"
+# Workers that have not dequeued for this long no longer count as able to run a class
+WORKER_TTL_SEC = 60
+
+FAIR_SHARE_KEYS = [
+    QUEUE_PASS_KEY, QUEUE_WEIGHTS_KEY, VIRTUAL_TIME_KEY, CLASS_INDEX_KEY, CLASS_PENDING_KEY, WORKERS_KEY,
+    DEQUEUED_TOTAL_KEY, LEASES_KEY, LEASE_OWNERS_KEY
+]
+
+_SCRIPT_PREFIXES = f"""
+local QUEUE_PREFIX = '{QUEUE_KEY_PREFIX}'
+local ACTIVE_PREFIX = '{ACTIVE_CLASS_PREFIX}'
+local CLASSES_PREFIX = '{QUEUE_CLASSES_PREFIX}'
+local WORKER_PREFIX = '{WORKER_KEY_PREFIX}'
+local DATA_PREFIX = '{DATA_KEY_PREFIX}'
+local ARRAY_PREFIX = '{ARRAY_KEY_PREFIX}'
+"""
+
+# KEYS: FAIR_SHARE_KEYS
+# ARGV: queue, resource class, job id, priority, weight ("" keeps the current one), only_new ("1" = ZADD NX),
+#       tasks (pending tasks the entry adds when it is new: 1, or the array size)
+ENQUEUE_SCRIPT = _SCRIPT_PREFIXES + """
+local queue, class = ARGV[1], ARGV[2]
+local queue_key = QUEUE_PREFIX .. queue .. ':' .. class
+if ARGV[5] ~= '' then
+  redis.call('HSET', KEYS[2], queue, ARGV[5])
+end
+local added
+if ARGV[6] == '1' then
+  added = redis.call('ZADD', queue_key, 'NX', ARGV[4], ARGV[3])
+else
+  added = redis.call('ZADD', queue_key, ARGV[4], ARGV[3])
+end
+if added == 1 then
+  redis.call('HINCRBY', KEYS[5], class, tonumber(ARGV[7] or '1'))
+end
+local active_key = ACTIVE_PREFIX .. class
+if not redis.call('ZSCORE', active_key, queue) then
+  local classes_key = CLASSES_PREFIX .. queue
+  local pass = tonumber(redis.call('HGET', KEYS[1], queue) or '0')
+  if redis.call('SCARD', classes_key) == 0 then
+    local vtime = tonumber(redis.call('GET', KEYS[3]) or '0')
+    if pass < vtime then
+      pass = vtime
+      redis.call('HSET', KEYS[1], queue, pass)
+    end
+  end
+  redis.call('ZADD', active_key, pass, queue)
+  redis.call('SADD', classes_key, class)
+  redis.call('SADD', KEYS[4], class)
+end
+return added
+"""
+
+# KEYS: FAIR_SHARE_KEYS
+# ARGV: count, worker id ("" = anonymous), gpus, cpu millicores, memory MiB, job types ("*" = any),
+#       lease seconds, lease token (owner of the leases taken)
+# Returns a flat list of job id, queue, resource class, task index ("" unless an array job), ...
+DEQUEUE_SCRIPT = _SCRIPT_PREFIXES + """
+local now = tonumber(redis.call('TIME')[1])
+local deadline = now + tonumber(ARGV[7] or '0')
+local gpus, cpu, memory = tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+local types = nil
+if ARGV[6] ~= '*' then
+  types = {}
+  for t in string.gmatch(ARGV[6], '[^,]+') do types[t] = true end
+end
+if ARGV[2] ~= '' then
+  redis.call('HSET', WORKER_PREFIX .. ARGV[2], 'gpus', ARGV[3], 'cpu_millis', ARGV[4], 'memory_mb', ARGV[5], 'job_types', ARGV[6])
+  redis.call('ZADD', KEYS[6], now, ARGV[2])
+end
+
+-- Smallest request a class rounded up to `tier` can hold
+local function lower_bound(tier, unit, smallest)
+  if tier <= 1 then return smallest end
+  return tier / 2 * unit + 1
+end
+
+-- Classes whose every job fits, and those where only some may (exact requests checked per job)
+local eligible, partial = {}, {}
+for _, class in ipairs(redis.call('SMEMBERS', KEYS[4])) do
+  local job_type, g, c, m = string.match(class, '^(.*):g(%d+):c(%d+):m(%d+)$')
+  if job_type and (types == nil or types[job_type]) then
+    g, c, m = tonumber(g), tonumber(c), tonumber(m)
+    if g <= gpus and c * 1000 <= cpu and m * 1024 <= memory then
+      table.insert(eligible, class)
+    elseif lower_bound(g, 1, g) <= gpus and lower_bound(c, 1000, 0) <= cpu and lower_bound(m, 1024, 0) <= memory then
+      table.insert(eligible, class)
+      partial[class] = {g, c * 1000, m * 1024}
+    end
+  end
+end
+
+-- Highest priority entry of a queue in a class, nil if there is none this worker can take
+local function top_job(queue, class)
+  local top = redis.call('ZRANGE', QUEUE_PREFIX .. queue .. ':' .. class, -1, -1, 'WITHSCORES')
+  if #top == 0 then return nil end
+  local tier = partial[class]
+  if tier then
+    -- Jobs enqueued without exact requests count as the whole tier
+    local req = redis.call('HMGET', DATA_PREFIX .. top[1], 'gpu_request', 'cpu_millis', 'memory_mb')
+    if tonumber(req[1] or tier[1]) > gpus or tonumber(req[2] or tier[2]) > cpu
+        or tonumber(req[3] or tier[3]) > memory then
+      return nil
+    end
+  end
+  return top
+end
+
+local out = {}
+for _ = 1, tonumber(ARGV[1]) do
+  -- Lowest pass among queues with a job in any eligible class
+  local queue, pass = nil, nil
+  for _, class in ipairs(eligible) do
+    local head = redis.call('ZRANGE', ACTIVE_PREFIX .. class, 0, 0, 'WITHSCORES')
+    if #head > 0 and (not partial[class] or top_job(head[1], class)) then
+      local p = tonumber(head[2])
+      if pass == nil or p < pass or (p == pass and head[1] < queue) then
+        queue, pass = head[1], p
+      end
+    end
+  end
+  if queue == nil then break end
+
+  -- Highest priority job of that queue across the eligible classes
+  local best_class, best_priority = nil, nil
+  for _, class in ipairs(eligible) do
+    local top = top_job(queue, class)
+    if top and (best_priority == nil or tonumber(top[2]) > best_priority) then
+      best_class, best_priority = class, tonumber(top[2])
+    end
+  end
+
+  local queue_key = QUEUE_PREFIX .. queue .. ':' .. best_class
+  local popped = redis.call('ZPOPMAX', queue_key)
+  local job_id, task = popped[1], ''
+  local data_key = DATA_PREFIX .. job_id
+  local size = tonumber(redis.call('HGET', data_key, 'array_size') or '0')
+  if size > 0 then
+    local array_key = ARRAY_PREFIX .. job_id
+    local retry_key = array_key .. ':retry'
+    task = redis.call('LPOP', retry_key)
+    -- Retries of tasks that finished meanwhile (a reaped lease whose worker still completed) are dropped
+    while task and (redis.call('HEXISTS', array_key .. ':results', task) == 1
+        or redis.call('HEXISTS', array_key .. ':errors', task) == 1) do
+      redis.call('HINCRBY', KEYS[5], best_class, -1)
+      task = redis.call('LPOP', retry_key)
+    end
+    if not task and tonumber(redis.call('HGET', data_key, 'next_index') or '0') < size then
+      task = redis.call('HINCRBY', data_key, 'next_index', 1) - 1
+    end
+    if redis.call('LLEN', retry_key) > 0 or tonumber(redis.call('HGET', data_key, 'next_index') or '0') < size then
+      redis.call('ZADD', queue_key, popped[2], job_id)
+    end
+  end
+  if task then
+    table.insert(out, job_id)
+    table.insert(out, queue)
+    table.insert(out, best_class)
+    table.insert(out, tostring(task))
+    local member = job_id
+    if task ~= '' then
+      member = job_id .. ':' .. task
+    end
+    redis.call('ZADD', KEYS[8], deadline, member)
+    redis.call('HSET', KEYS[9], member, ARGV[8])
+    redis.call('HINCRBY', KEYS[5], best_class, -1)
+  end
+
+  local classes_key = CLASSES_PREFIX .. queue
+  if redis.call('ZCARD', queue_key) == 0 then
+    redis.call('ZREM', ACTIVE_PREFIX .. best_class, queue)
+    redis.call('SREM', classes_key, best_class)
+    if redis.call('ZCARD', ACTIVE_PREFIX .. best_class) == 0 then
+      redis.call('SREM', KEYS[4], best_class)
+    end
+  end
+
+  if task then
+    local weight = tonumber(redis.call('HGET', KEYS[2], queue) or '1')
+    if weight <= 0 then weight = 1 end
+    local next_pass = pass + 1 / weight
+    redis.call('SET', KEYS[3], pass)
+    redis.call('HSET', KEYS[1], queue, next_pass)
+    for _, class in ipairs(redis.call('SMEMBERS', classes_key)) do
+      redis.call('ZADD', ACTIVE_PREFIX .. class, next_pass, queue)
+    end
+  end
+end
+if #out > 0 then
+  redis.call('INCRBY', KEYS[7], #out / 4)
+end
+return out
+"""
+
+# KEYS: LEASES_KEY, LEASE_OWNERS_KEY
+# ARGV: lease member, lease seconds, lease token
+# Extends a lease the token still owns, returns 0 if it was reaped (or released) in the meantime
+RENEW_LEASE_SCRIPT = """
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) or redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[3] then
+  return 0
+end
+redis.call('ZADD', KEYS[1], tonumber(redis.call('TIME')[1]) + tonumber(ARGV[2]), ARGV[1])
+return 1
+"""
+
+# KEYS: LEASES_KEY, LEASE_OWNERS_KEY
+# ARGV: limit, grace seconds, lease token of the reaper
+# Returns up to `limit` expired lease members. Their deadline moves `grace` seconds ahead and the
+# reaper's token becomes their owner, so one reaper owns them and the worker that let them expire
+# can no longer finish them. They come back if that reaper dies before failing the jobs.
+REAP_SCRIPT = """
+local now = tonumber(redis.call('TIME')[1])
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, tonumber(ARGV[1]))
+for _, member in ipairs(expired) do
+  redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), member)
+  redis.call('HSET', KEYS[2], member, ARGV[3])
+end
+return expired
+"""
+
+QUEUE_DEQUEUED = Counter(
+    'job_queue_dequeued_total',
+    'Jobs handed out by the fair-share dequeue, per JobQueue',
+    ['queue']
+)
+QUEUE_THROUGHPUT_SHARE = Gauge(
+    'job_queue_throughput_share',
+    'Fraction of the most recent dequeues (this process) that went to each JobQueue',
+    ['queue']
+)
+CLASS_PENDING_JOBS = Gauge(
+    'job_queue_pending_jobs',
+    'Jobs waiting to be dequeued, per resource class',
+    ['resource_class']
+)
+CLASS_UNMATCHED_JOBS = Gauge(
+    'job_queue_unmatched_jobs',
+    'Pending jobs of a resource class that no live worker can run',
+    ['resource_class']
+)
+
+SHARE_WINDOW = 1000
+
+
+class QueueShareTracker:
+    """Rolling per-queue share of the last SHARE_WINDOW dequeues"""
+
+    def __init__(self, window: int = SHARE_WINDOW):
+        self.recent: Deque[str] = deque(maxlen=window)
+        self.counts: CounterDict = CounterDict()
+
+    def record(self, queue: str):
+        if len(self.recent) == self.recent.maxlen:
+            oldest = self.recent[0]
+            self.counts[oldest] -= 1
+        self.recent.append(queue)
+        self.counts[queue] += 1
+        QUEUE_DEQUEUED.labels(queue=queue).inc()
+
+    def publish(self):
+        total = len(self.recent)
+        for queue, count in self.counts.items():
+            QUEUE_THROUGHPUT_SHARE.labels(queue=queue).set(count / total if total else 0.0)
+
+    def share(self, queue: str) -> float:
+        return self.counts[queue] / len(self.recent) if self.recent else 0.0
+
+
+# One tracker per process, shared by every RedisJobQueue instance
+share_tracker = QueueShareTracker()
+
+
+# Resource classes
+
+_QUANTITY = re.compile(r"^([0-9.]+)([a-zA-Z]*)$")
+_MEMORY_UNITS_MB = {
+    "": 1 / 2 ** 20, "k": 1e3 / 2 ** 20, "m": 1e6 / 2 ** 20, "g": 1e9 / 2 ** 20, "t": 1e12 / 2 ** 20,
+    "ki": 1 / 1024, "mi": 1, "gi": 1024, "ti": 1024 ** 2
+}
+_CLASS = re.compile(r"^(.*):g(\d+):c(\d+):m(\d+)$")
+
+
+def parse_cpu(value: Optional[str]) -> int:
+    """Kubernetes CPU quantity ("500m", "2", "1.5") in millicores"""
+    if not value:
+        return 0
+    value = str(value).strip()
+    if value.endswith("m"):
+        return int(float(value[:-1]))
+    return int(float(value) * 1000)
+
+
+def parse_memory(value: Optional[str]) -> int:
+    """Kubernetes memory quantity ("512Mi", "4Gi", "1G", bytes) in MiB"""
+    if not value:
+        return 0
+    match = _QUANTITY.match(str(value).strip())
+    if not match or match.group(2).lower() not in _MEMORY_UNITS_MB:
+        raise ValueError(f"Invalid memory quantity: {value!r}")
+    return math.ceil(float(match.group(1)) * _MEMORY_UNITS_MB[match.group(2).lower()])
+
+
+def _pow2_ceil(n: float) -> int:
+    n = math.ceil(n)
+    return 1 if n <= 1 else 1 << (n - 1).bit_length()
+
+
+def _lower_bound(tier: int, unit: int, smallest: int) -> int:
+    """Smallest request that resource_class rounds up to `tier` (same as lower_bound in DEQUEUE_SCRIPT)"""
+    return smallest if tier <= 1 else tier // 2 * unit + 1
+
+
+def resource_class(job_type: str, gpus: int = 0, cpu_millis: int = 0, memory_mb: int = 0) -> str:
+    """Requests rounded up to powers of two, so the number of classes stays small"""
+    gpu_tier = 0 if not gpus or gpus <= 0 else _pow2_ceil(gpus)
+    return f"{job_type}:g{gpu_tier}:c{_pow2_ceil(cpu_millis / 1000)}:m{_pow2_ceil(memory_mb / 1024)}"
+
+
+@dataclass
+class WorkerResources:
+    """What a worker can take right now; advertised on every dequeue"""
+    gpus: int = 0
+    cpu_millis: int = 1000
+    memory_mb: int = 1024
+    job_types: Tuple[str, ...] = ()  # Empty means any job type
+
+    def fits(self, resource_class: str) -> bool:
+        """Every job of the class fits"""
+        match = _CLASS.match(resource_class)
+        if not match:
+            return False
+        job_type, gpus, cores, gib = match.group(1), *map(int, match.groups()[1:])
+        return (
+            (not self.job_types or job_type in self.job_types)
+            and gpus <= self.gpus and cores * 1000 <= self.cpu_millis and gib * 1024 <= self.memory_mb
+        )
+
+    def may_fit(self, resource_class: str) -> bool:
+        """Some job of the class may fit: its smallest possible request does (exact ones are checked on dequeue)"""
+        match = _CLASS.match(resource_class)
+        if not match:
+            return False
+        job_type, gpus, cores, gib = match.group(1), *map(int, match.groups()[1:])
+        return (
+            (not self.job_types or job_type in self.job_types)
+            and _lower_bound(gpus, 1, gpus) <= self.gpus
+            and _lower_bound(cores, 1000, 0) <= self.cpu_millis
+            and _lower_bound(gib, 1024, 0) <= self.memory_mb
+        )
+
+    def script_args(self) -> List[object]:
+        return [self.gpus, self.cpu_millis, self.memory_mb, ",".join(self.job_types) or "*"]
+
+
+# Callers that do not advertise resources (tests, benchmarks, admin tools) can take anything
+ANY_RESOURCES = WorkerResources(gpus=2 ** 20, cpu_millis=2 ** 40, memory_mb=2 ** 40)
+
+
+def _decode(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+async def export_class_backlog(redis_client, worker_ttl: int = WORKER_TTL_SEC) -> Dict[str, Tuple[int, int]]:
+    """Set the pending/unmatched gauges per resource class; returns {class: (pending, unmatched)}"""
+    pending = {_decode(k): int(v) for k, v in (await redis_client.hgetall(CLASS_PENDING_KEY)).items()}
+    live = [_decode(w) for w in await redis_client.zrangebyscore(WORKERS_KEY, time.time() - worker_ttl, "+inf")]
+    pipe = redis_client.pipeline(transaction=False)
+    for worker_id in live:
+        pipe.hgetall(WORKER_KEY_PREFIX + worker_id)
+    workers = []
+    for caps in await pipe.execute() if live else []:
+        caps = {_decode(k): _decode(v) for k, v in caps.items()}
+        if caps:
+            types = caps.get("job_types", "*")
+            workers.append(WorkerResources(
+                gpus=int(caps["gpus"]),
+                cpu_millis=int(caps["cpu_millis"]),
+                memory_mb=int(caps["memory_mb"]),
+                job_types=() if types == "*" else tuple(types.split(","))
+            ))
+
+    backlog = {}
+    for resource_class, count in pending.items():
+        count = max(0, count)
+        unmatched = 0 if any(w.may_fit(resource_class) for w in workers) else count
+        CLASS_PENDING_JOBS.labels(resource_class=resource_class).set(count)
+        CLASS_UNMATCHED_JOBS.labels(resource_class=resource_class).set(unmatched)
+        backlog[resource_class] = (count, unmatched)
+    return backlog
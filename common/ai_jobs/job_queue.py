@@ -0,0 +1,543 @@
+"""
+Job hash layout, status stream and the consumer side of the Redis job queue.
+
+The job-service enqueues (app/services/redis_queue.py, RedisJobQueue) and
+reads the status stream; workers dequeue, complete and fail jobs through
+WorkerJobQueue. Both import this module so the hash layout, retry rules and
+lifecycle metrics have a single definition.
+"""
+import json
+import logging
+import threading
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field, fields
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+from prometheus_client import Histogram
+from ai_jobs.blob_store import BlobStore, store_result
+from ai_jobs.fair_share import (
+    ANY_RESOURCES, ARRAY_KEY_PREFIX, CLASS_PENDING_KEY, DEFAULT_LEASE_SEC, DEFAULT_QUEUE, DEQUEUE_SCRIPT,
+    ENQUEUE_SCRIPT, FAIR_SHARE_KEYS, LEASE_OWNERS_KEY, LEASES_KEY, REAP_SCRIPT, RENEW_LEASE_SCRIPT,
+    WorkerResources, resource_class, share_tracker
+)
+
+# Lifecycle latency, observed by the consumer
+LIFECYCLE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600, 14400)
+JOB_QUEUE_WAIT = Histogram(
+    'job_queue_wait_seconds',
+    'Time from enqueue until a worker dequeued the job',
+    ['job_type'],
+    buckets=LIFECYCLE_BUCKETS
+)
+JOB_EXECUTION_TIME = Histogram(
+    'job_execution_seconds',
+    'Time from dequeue until the job completed',
+    ['job_type'],
+    buckets=LIFECYCLE_BUCKETS
+)
+JOB_TOTAL_LATENCY = Histogram(
+    'job_total_latency_seconds',
+    'Time from submission until the job completed',
+    ['job_type'],
+    buckets=LIFECYCLE_BUCKETS
+)
+
+MAX_RETRIES = 3
+DLQ_KEY = "ai_jobs:dlq"
+EVENTS_CHANNEL = "ai_jobs:events"
+# Status changes for the job-service write-behind Postgres sync (app/services/status_sync.py)
+STATUS_STREAM_KEY = "ai_jobs:status_stream"
+STATUS_STREAM_MAXLEN = 1_000_000
+# Serialized results larger than this go to the blob store, Redis keeps a reference
+RESULT_OFFLOAD_THRESHOLD = 64 * 1024
+TASK_INDEX_PLACEHOLDER = "{task_index}"
+LEASE_EXPIRED_ERROR = "lease expired"
+# An expired lease taken by a reaper comes back after this long if the reaper dies midway
+REAP_GRACE_SEC = 60
+
+# KEYS: array results hash, array errors hash, job hash
+# ARGV: task index, result or error, outcome ("succeeded" or "failed")
+# Records the task's outcome and bumps tasks_<outcome>, unless the task already has a result or
+# error (its lease was reaped and both runs finished). Returns {succeeded, failed}, or nil then.
+FINISH_TASK_SCRIPT = """
+local target, other = KEYS[1], KEYS[2]
+if ARGV[3] == 'failed' then
+  target, other = KEYS[2], KEYS[1]
+end
+if redis.call('HEXISTS', other, ARGV[1]) == 1 or redis.call('HSETNX', target, ARGV[1], ARGV[2]) == 0 then
+  return false
+end
+redis.call('HINCRBY', KEYS[3], 'tasks_' .. ARGV[3], 1)
+local counts = redis.call('HMGET', KEYS[3], 'tasks_succeeded', 'tasks_failed')
+return {tonumber(counts[1] or '0'), tonumber(counts[2] or '0')}
+"""
+
+
+def utcnow_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Parse an ISO timestamp, treating naive values (e.g. SQLite created_at) as UTC"""
+    if not value:
+        return None
+    try:
+        ts = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def seconds_between(start: Optional[str], end: Optional[str]) -> Optional[float]:
+    start_ts, end_ts = parse_timestamp(start), parse_timestamp(end)
+    if start_ts is None or end_ts is None:
+        return None
+    return max(0.0, (end_ts - start_ts).total_seconds())
+
+
+def task_payload(template: Any, index: int) -> Any:
+    """Expand an array job's payload template for one task: "{task_index}" in strings becomes the index"""
+    if isinstance(template, str):
+        return template.replace(TASK_INDEX_PLACEHOLDER, str(index))
+    if isinstance(template, list):
+        return [task_payload(v, index) for v in template]
+    if isinstance(template, dict):
+        return {k: task_payload(v, index) for k, v in template.items()}
+    return template
+
+
+@dataclass
+class JobMessage:
+    job_id: str
+    job_type: str
+    priority: int
+    payload: dict
+    submitted_at: str
+    retry_count: int = 0
+    queued_at: str = ""
+    # JobQueue name, the fair-share unit
+    queue: str = DEFAULT_QUEUE
+    # Job type + rounded resource requests, see fair_share.resource_class; defaults to the job type alone
+    resource_class: str = ""
+    # Exact requests (the class is rounded up), checked on dequeue for classes above a worker's capacity
+    gpu_request: int = 0
+    cpu_millis: int = 0
+    memory_mb: int = 0
+    # W3C trace context (traceparent/tracestate) of the submitting request
+    trace_context: dict = field(default_factory=dict)
+    # Array jobs: number of tasks, payload is the template expanded per task (see task_payload)
+    array_size: int = 0
+    # Set on dequeue, not part of the enqueued message
+    started_at: str = ""
+    # When this job or array task was dequeued (for an array, started_at is its first task's start)
+    claimed_at: str = ""
+    task_index: int = -1
+    # Token of the claim that owns the lease; only its holder may renew, complete or fail the job
+    lease_token: str = ""
+
+    # Hash values must be flat: these are stored as JSON strings
+    JSON_FIELDS = ("payload", "trace_context")
+    INT_FIELDS = ("priority", "retry_count", "array_size", "gpu_request", "cpu_millis", "memory_mb")
+    DEQUEUE_FIELDS = ("started_at", "claimed_at", "task_index", "lease_token")
+
+    def to_hash(self) -> Dict[str, Any]:
+        data = asdict(self)
+        for name in self.DEQUEUE_FIELDS:
+            del data[name]
+        for name in self.JSON_FIELDS:
+            data[name] = json.dumps(data[name])
+        return data
+
+    @classmethod
+    def from_hash(cls, data: Dict[str, str]) -> "JobMessage":
+        """Build from a decoded job hash; of the lifecycle fields added after enqueue only started_at is kept"""
+        names = {f.name for f in fields(cls)}
+        kwargs: Dict[str, Any] = {k: v for k, v in data.items() if k in names}
+        for name in cls.JSON_FIELDS:
+            if isinstance(kwargs.get(name), str):
+                try:
+                    kwargs[name] = json.loads(kwargs[name])
+                except ValueError:
+                    pass
+        for name in cls.INT_FIELDS:
+            if name in kwargs:
+                kwargs[name] = int(kwargs[name])
+        return cls(**kwargs)
+
+
+class WorkerJobQueue:
+    """
+    Synchronous consumer side of the queue the job-service RedisJobQueue fills.
+
+    Records the started/completed lifecycle timestamps on the job hash and
+    exports queue-wait, execution and end-to-end latency histograms.
+
+    Every dequeued job holds a lease of `lease_seconds` until it completes or
+    fails; keep_lease() renews it while the job runs. A worker that dies (or
+    stalls) with a prefetched batch loses its leases, and reap_expired() puts
+    those jobs back through the normal retry path. complete() and fail() only
+    write if the caller still owns the lease, so a late result is discarded.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        blob_store: Optional[BlobStore] = None,
+        offload_threshold: int = RESULT_OFFLOAD_THRESHOLD,
+        lease_seconds: int = DEFAULT_LEASE_SEC
+    ):
+        self.redis = redis_client
+        self.lease_seconds = lease_seconds
+        self.blob_store = blob_store
+        self.offload_threshold = offload_threshold
+        self.processing_key = "ai_jobs:processing"
+        self.completed_key = "ai_jobs:completed"
+        self.failed_key = "ai_jobs:failed"
+        self.job_data_key = "ai_jobs:data:{job_id}"
+        self._enqueue_script = self.redis.register_script(ENQUEUE_SCRIPT)
+        self._dequeue_script = self.redis.register_script(DEQUEUE_SCRIPT)
+        self._renew_script = self.redis.register_script(RENEW_LEASE_SCRIPT)
+        self._reap_script = self.redis.register_script(REAP_SCRIPT)
+        self._finish_task_script = self.redis.register_script(FINISH_TASK_SCRIPT)
+
+    def _record_status(self, pipe, job_id: str, event: str, **fields):
+        pipe.xadd(
+            STATUS_STREAM_KEY,
+            {"job_id": job_id, "event": event, "data": json.dumps(fields)},
+            maxlen=STATUS_STREAM_MAXLEN,
+            approximate=True
+        )
+
+    def dequeue(
+        self, count: int = 1, resources: Optional[WorkerResources] = None, worker_id: str = ""
+    ) -> List[JobMessage]:
+        """
+        Fair-share dequeue across JobQueues of jobs that fit `resources` (any job if None),
+        then mark the jobs running (2 round trips per batch). Array tasks come back as one
+        JobMessage each, with task_index set and the payload template expanded.
+        """
+        resources = resources or ANY_RESOURCES
+        token = uuid.uuid4().hex
+        popped = [m.decode('utf-8') if isinstance(m, bytes) else m for m in
+                  self._dequeue_script(
+                      keys=FAIR_SHARE_KEYS,
+                      args=[count, worker_id, *resources.script_args(), self.lease_seconds, token]
+                  )]
+        if not popped:
+            return []
+        job_ids = popped[::4]
+        tasks = [int(t) if t != "" else -1 for t in popped[3::4]]
+        for queue in popped[1::4]:
+            share_tracker.record(queue)
+        share_tracker.publish()
+        started_at = utcnow_iso()
+
+        pipe = self.redis.pipeline()
+        for job_id in job_ids:
+            pipe.hgetall(self.job_data_key.format(job_id=job_id))
+        pipe.sadd(self.processing_key, *(self._processing_member(j, t) for j, t in zip(job_ids, tasks)))
+        array_starts = {}  # reply index of the started_at HSETNX -> array job id
+        for job_id, task_index in zip(job_ids, tasks):
+            key = self.job_data_key.format(job_id=job_id)
+            if task_index < 0:
+                pipe.hset(key, mapping={"started_at": started_at, "status": "running"})
+                self._record_status(pipe, job_id, "job_started", started_at=started_at)
+            else:
+                # An array keeps the start of its first task
+                array_starts[len(pipe)] = job_id
+                pipe.hsetnx(key, "started_at", started_at)
+                pipe.hset(key, "status", "running")
+        replies = pipe.execute()
+
+        started = [job_id for index, job_id in array_starts.items() if replies[index]]
+        if started:
+            # Only the claim that actually started the array reports it, retries of task 0 included
+            pipe = self.redis.pipeline()
+            for job_id in started:
+                self._record_status(pipe, job_id, "job_started", started_at=started_at)
+            pipe.execute()
+
+        jobs = []
+        for job_id, task_index, raw in zip(job_ids, tasks, replies[:len(job_ids)]):
+            if not raw:
+                logging.warning(f"Job {job_id} was queued without data, dropping it")
+                pipe = self.redis.pipeline()
+                self._release(pipe, job_id, task_index)
+                pipe.execute()
+                self.redis.delete(self.job_data_key.format(job_id=job_id))
+                continue
+            data = {k.decode('utf-8'): v.decode('utf-8') for k, v in raw.items()}
+            if task_index < 0 or "started_at" not in data:
+                data["started_at"] = started_at
+            job = JobMessage.from_hash(data)
+            job.claimed_at = started_at
+            job.lease_token = token
+            if task_index >= 0:
+                job.task_index = task_index
+                job.payload = task_payload(job.payload, task_index)
+            wait = seconds_between(job.queued_at or job.submitted_at, started_at)
+            if wait is not None:
+                JOB_QUEUE_WAIT.labels(job_type=job.job_type).observe(wait)
+            jobs.append(job)
+        return jobs
+
+    @staticmethod
+    def _processing_member(job_id: str, task_index: int = -1) -> str:
+        return job_id if task_index < 0 else f"{job_id}:{task_index}"
+
+    def _release(self, pipe, job_id: str, task_index: int = -1):
+        """The job (or task) is no longer running: drop its processing member and its lease"""
+        member = self._processing_member(job_id, task_index)
+        pipe.srem(self.processing_key, member)
+        pipe.zrem(LEASES_KEY, member)
+        pipe.hdel(LEASE_OWNERS_KEY, member)
+
+    def renew(self, job: JobMessage) -> bool:
+        """Extend the job's lease by lease_seconds from now; False if it expired and was reaped"""
+        member = self._processing_member(job.job_id, job.task_index)
+        return bool(self._renew_script(
+            keys=[LEASES_KEY, LEASE_OWNERS_KEY], args=[member, self.lease_seconds, job.lease_token]
+        ))
+
+    def _still_owned(self, job: JobMessage, action: str) -> bool:
+        """
+        Ownership check before finishing a job: the renewal also keeps the reaper away while
+        the result is written. False (and the write must be skipped) if the lease was lost.
+        """
+        if self.renew(job):
+            return True
+        member = self._processing_member(job.job_id, job.task_index)
+        logging.warning(f"Lease of {member} was lost (the job was redelivered), discarding its {action}")
+        return False
+
+    @contextmanager
+    def keep_lease(self, job: JobMessage, interval: Optional[float] = None) -> Iterator[threading.Event]:
+        """
+        Renew the job's lease every `interval` seconds (a third of the lease by default) while
+        the block runs. The yielded event is set once the lease is lost.
+        """
+        interval = interval or max(1.0, self.lease_seconds / 3)
+        stop, lost = threading.Event(), threading.Event()
+
+        def heartbeat():
+            while not stop.wait(interval):
+                try:
+                    if not self.renew(job):
+                        lost.set()
+                        return
+                except Exception as e:
+                    # Retried on the next beat, well before the lease runs out
+                    logging.warning(f"Could not renew the lease of job {job.job_id}: {e}")
+
+        thread = threading.Thread(target=heartbeat, name=f"lease-{job.job_id}", daemon=True)
+        thread.start()
+        try:
+            yield lost
+        finally:
+            stop.set()
+            thread.join()
+
+    def reap_expired(self, limit: int = 100) -> int:
+        """
+        Fail (and so retry) jobs whose lease expired, e.g. prefetched by a worker that crashed.
+        Any worker may call this; the reap script hands each expired lease to one caller.
+        """
+        token = uuid.uuid4().hex
+        members = [m.decode('utf-8') if isinstance(m, bytes) else m for m in
+                   self._reap_script(keys=[LEASES_KEY, LEASE_OWNERS_KEY], args=[limit, REAP_GRACE_SEC, token])]
+        for member in members:
+            job_id, task_index = member, -1
+            head, _, tail = member.rpartition(":")
+            raw = self.redis.hgetall(self.job_data_key.format(job_id=job_id))
+            if not raw and head and tail.isdigit():
+                job_id, task_index = head, int(tail)
+                raw = self.redis.hgetall(self.job_data_key.format(job_id=job_id))
+            if not raw:
+                pipe = self.redis.pipeline()
+                self._release(pipe, job_id, task_index)
+                pipe.execute()
+                continue
+            data = {k.decode('utf-8'): v.decode('utf-8') for k, v in raw.items()}
+            job = JobMessage.from_hash(data)
+            job.task_index = task_index
+            job.lease_token = token
+            logging.warning(f"Lease of {member} expired, requeueing it")
+            self.fail(job, LEASE_EXPIRED_ERROR)
+        return len(members)
+
+    def _array_key(self, job_id: str, name: str) -> str:
+        return f"{ARRAY_KEY_PREFIX}{job_id}:{name}"
+
+    def _serialize_result(self, key: str, result: Dict[str, Any]):
+        serialized = json.dumps(result)
+        if self.blob_store is not None and len(serialized) > self.offload_threshold:
+            result = store_result(self.blob_store, key, serialized.encode())
+            serialized = json.dumps(result)
+        return result, serialized
+
+    def complete(self, job: JobMessage, result: Dict[str, Any], metrics: Optional[Dict[str, float]] = None) -> bool:
+        """
+        Mark the job (or array task) succeeded; metrics use JobMetric column names (latency_p50_ms, ...).
+        False if the lease was lost and the result discarded.
+        """
+        if not self._still_owned(job, "result"):
+            return False
+        if job.task_index >= 0:
+            self._complete_task(job, result, metrics)
+            return True
+        completed_at = utcnow_iso()
+        result, serialized = self._serialize_result(f"results/{job.job_id}", result)
+
+        pipe = self.redis.pipeline()
+        self._release(pipe, job.job_id)
+        pipe.sadd(self.completed_key, job.job_id)
+        pipe.hset(
+            self.job_data_key.format(job_id=job.job_id),
+            mapping={"result": serialized, "completed_at": completed_at, "status": "succeeded"}
+        )
+        pipe.publish(EVENTS_CHANNEL, json.dumps({
+            "event": "job_completed",
+            "job_id": job.job_id,
+            "started_at": job.started_at,
+            "completed_at": completed_at
+        }))
+        self._record_status(pipe, job.job_id, "job_completed", completed_at=completed_at, result=result)
+        if metrics:
+            self._record_status(pipe, job.job_id, "job_metrics", **metrics)
+        pipe.execute()
+
+        execution = seconds_between(job.started_at, completed_at)
+        if execution is not None:
+            JOB_EXECUTION_TIME.labels(job_type=job.job_type).observe(execution)
+        total = seconds_between(job.submitted_at, completed_at)
+        if total is not None:
+            JOB_TOTAL_LATENCY.labels(job_type=job.job_type).observe(total)
+        return True
+
+    def _finish_task(self, pipe, job: JobMessage, value: str, outcome: str):
+        """Queue the FINISH_TASK_SCRIPT call for this task on pipe"""
+        self._finish_task_script(
+            keys=[
+                self._array_key(job.job_id, "results"), self._array_key(job.job_id, "errors"),
+                self.job_data_key.format(job_id=job.job_id)
+            ],
+            args=[job.task_index, value, outcome],
+            client=pipe
+        )
+
+    def _complete_task(self, job: JobMessage, result: Dict[str, Any], metrics: Optional[Dict[str, float]]):
+        """The task's result record is only created now; the array's counters are updated with it"""
+        completed_at = utcnow_iso()
+        _, serialized = self._serialize_result(f"results/{job.job_id}/{job.task_index}", result)
+        # One script, so exactly one finishing task sees succeeded + failed == array_size
+        pipe = self.redis.pipeline()
+        self._finish_task(pipe, job, serialized, "succeeded")
+        self._release(pipe, job.job_id, job.task_index)
+        counts = pipe.execute()[0]
+        if counts is None:
+            logging.info(f"Task {job.task_index} of {job.job_id} already finished, dropping this result")
+            return
+
+        execution = seconds_between(job.claimed_at, completed_at)
+        if execution is not None:
+            JOB_EXECUTION_TIME.labels(job_type=job.job_type).observe(execution)
+        self._task_finished(job, *counts, metrics=metrics)
+
+    def _task_finished(self, job: JobMessage, succeeded: int, failed: int, metrics: Optional[Dict[str, float]] = None):
+        """Report aggregated progress, and finish the array job with its last task"""
+        pipe = self.redis.pipeline()
+        if metrics:
+            self._record_status(pipe, job.job_id, "job_metrics", **metrics)
+        self._record_status(pipe, job.job_id, "job_progress", tasks_succeeded=succeeded, tasks_failed=failed)
+        finished = succeeded + failed >= job.array_size
+        if finished:
+            completed_at = utcnow_iso()
+            summary = {"array_size": job.array_size, "tasks_succeeded": succeeded, "tasks_failed": failed}
+            pipe.sadd(self.failed_key if failed else self.completed_key, job.job_id)
+            pipe.hset(
+                self.job_data_key.format(job_id=job.job_id),
+                mapping={
+                    "result": json.dumps(summary),
+                    "completed_at": completed_at,
+                    "status": "failed" if failed else "succeeded"
+                }
+            )
+            pipe.publish(EVENTS_CHANNEL, json.dumps({
+                "event": "job_completed",
+                "job_id": job.job_id,
+                "completed_at": completed_at
+            }))
+            self._record_status(pipe, job.job_id, "job_array_finished", completed_at=completed_at, **summary)
+        pipe.execute()
+        if finished:
+            total = seconds_between(job.submitted_at, completed_at)
+            if total is not None:
+                JOB_TOTAL_LATENCY.labels(job_type=job.job_type).observe(total)
+
+    def fail(self, job: JobMessage, error: str, retry: bool = True) -> bool:
+        """
+        Re-enqueue with lower priority, or dead-letter once retries are exhausted.
+        False if the lease was lost, the job's new owner decides its outcome then.
+        """
+        if not self._still_owned(job, "failure"):
+            return False
+        if job.task_index >= 0:
+            self._fail_task(job, error, retry)
+            return True
+        key = self.job_data_key.format(job_id=job.job_id)
+        pipe = self.redis.pipeline()
+        if retry and job.retry_count < MAX_RETRIES:
+            queued_at = utcnow_iso()
+            # Queued again, no longer running
+            self._release(pipe, job.job_id)
+            pipe.hincrby(key, "retry_count", 1)
+            pipe.hset(key, mapping={"queued_at": queued_at, "status": "queued", "error": error})
+            self._record_status(
+                pipe, job.job_id, "job_retrying", queued_at=queued_at, error=error, retry_count=job.retry_count + 1
+            )
+            # Back into its own queue, weight left as configured
+            self._enqueue_script(
+                keys=FAIR_SHARE_KEYS,
+                args=[
+                    job.queue, job.resource_class or resource_class(job.job_type),
+                    job.job_id, job.priority - 10, "", "0"
+                ],
+                client=pipe
+            )
+        else:
+            self._release(pipe, job.job_id)
+            pipe.sadd(self.failed_key, job.job_id)
+            pipe.lpush(DLQ_KEY, job.job_id)
+            failed_at = utcnow_iso()
+            pipe.hset(key, mapping={"error": error, "failed_at": failed_at, "status": "dead_letter"})
+            self._record_status(pipe, job.job_id, "job_dead_lettered", failed_at=failed_at, error=error)
+        pipe.execute()
+        return True
+
+    def _fail_task(self, job: JobMessage, error: str, retry: bool):
+        """Retry one task of an array job through its retry list, or record it as failed"""
+        job_class = job.resource_class or resource_class(job.job_type)
+        pipe = self.redis.pipeline()
+        pipe.hincrby(self._array_key(job.job_id, "retries"), str(job.task_index), 1)
+        self._release(pipe, job.job_id, job.task_index)
+        retries = pipe.execute()[0]
+        pipe = self.redis.pipeline()
+        if retry and retries <= MAX_RETRIES:
+            pipe.rpush(self._array_key(job.job_id, "retry"), job.task_index)
+            pipe.hincrby(CLASS_PENDING_KEY, job_class, 1)
+            # Puts the array entry back if all of its other tasks were already claimed
+            self._enqueue_script(
+                keys=FAIR_SHARE_KEYS,
+                args=[job.queue, job_class, job.job_id, job.priority, "", "1", 0],
+                client=pipe
+            )
+            pipe.execute()
+            return
+        self._finish_task(pipe, job, error, "failed")
+        counts = pipe.execute()[0]
+        if counts is None:
+            logging.info(f"Task {job.task_index} of {job.job_id} already finished, dropping this failure")
+            return
+        self._task_finished(job, *counts)
@@ -1,10 +1,11 @@
+from functools import lru_cache
 from typing import AsyncGenerator
 import redis.asyncio as redis
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
+from ai_jobs.blob_store import BlobStore, create_blob_store
 from app.core.config import settings
-from app.services.redis_queue import RedisJobQueue
 
 # Database
 engine = create_async_engine(settings.DATABASE_URL)
@@ -22,9 +23,7 @@ async def get_redis() -> AsyncGenerator[redis.Redis, None]:
     finally:
         await client.close()
 
-async def get_job_queue(redis_client: redis.Redis = None) -> RedisJobQueue:
-    if redis_client is None:
-        # If called directly without dependency injection handling redis lifecycle
-        client = redis.from_url(settings.REDIS_URL)
-        return RedisJobQueue(client)
-    return RedisJobQueue(redis_client)
+# Result blob store
+@lru_cache
+def get_blob_store() -> BlobStore:
+    return create_blob_store(settings.RESULT_STORE_URL)
@@ -1,16 +1,30 @@
+import json
+
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from typing import List, Optional
 from uuid import UUID
+from datetime import datetime, timezone
+
+from opentelemetry import trace, propagate
 
+from ai_jobs.blob_store import BlobStore, is_blob_ref, read_manifest, iter_result
+from ai_jobs.fair_share import DEFAULT_QUEUE, parse_cpu, parse_memory, resource_class
 from app.api import dependencies
 from app.db import models
-from app.db.models import Job, JobStatus
+from app.db.models import Job, JobStatus, JobQueue
 from app.services.redis_queue import RedisJobQueue, JobMessage
-from pydantic import BaseModel
+from app.services.archiver import get_archived_job
+from app.services.backpressure import drain_monitor
+from pydantic import BaseModel, Field
 
 router = APIRouter()
+MAX_ARRAY_SIZE = 1_000_000
+# Hardcoded limit for demo, ideally fetch from Queue Config or Redis
+CONCURRENCY_LIMIT = 1000
+tracer = trace.get_tracer(__name__)
 
 # Pydantic Models (Move to schemas.py in real app)
 class JobCreate(BaseModel):
@@ -22,6 +36,13 @@ class JobCreate(BaseModel):
     args: List[str] = []
     input_config: dict = {}
     output_config: dict = {}
+    queue: str = DEFAULT_QUEUE
+    # Kubernetes-style requests; workers only dequeue jobs that fit their free resources
+    gpu_request: int = 0
+    cpu_request: Optional[str] = None
+    memory_request: Optional[str] = None
+    # > 0 submits an array job: one job, array_size tasks, "{task_index}" in command/args is expanded per task
+    array_size: int = Field(default=0, ge=0, le=MAX_ARRAY_SIZE)
     
 class JobResponse(BaseModel):
     id: UUID
@@ -29,6 +50,14 @@ class JobResponse(BaseModel):
     status: str
     priority: int
     created_at: str
+    array_size: int = 0
+
+class TaskProgress(BaseModel):
+    array_size: int
+    pending: int
+    running: int
+    succeeded: int
+    failed: int
 
 @router.post("/", response_model=JobResponse)
 async def create_job(
@@ -36,6 +65,14 @@ async def create_job(
     db: AsyncSession = Depends(dependencies.get_db),
     redis_client = Depends(dependencies.get_redis)
 ):
+    # Queue config decides the job's fair-share weight; unknown names share the default weight
+    job_queue = (await db.execute(select(JobQueue).where(JobQueue.name == job_in.queue))).scalar_one_or_none()
+    try:
+        cpu_millis, memory_mb = parse_cpu(job_in.cpu_request), parse_memory(job_in.memory_request)
+        job_class = resource_class(job_in.job_type, job_in.gpu_request, cpu_millis, memory_mb)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
     # 1. Save to DB
     job = Job(
         external_id=job_in.external_id,
@@ -46,6 +83,11 @@ async def create_job(
         args=job_in.args,
         input_config=job_in.input_config,
         output_config=job_in.output_config,
+        queue_id=job_queue.id if job_queue else None,
+        gpu_request=job_in.gpu_request,
+        cpu_request=job_in.cpu_request,
+        memory_request=job_in.memory_request,
+        array_size=job_in.array_size,
         status=JobStatus.PENDING
     )
     db.add(job)
@@ -56,38 +98,54 @@ async def create_job(
     queue = RedisJobQueue(redis_client)
     
     # Backpressure / Rate Limiting Check
-    # Hardcoded limit for demo, ideally fetch from Queue Config or Redis
-    if not await queue.check_concurrency(limit=1000):
-        # Raise 429 Too Many Requests
+    if not await queue.check_concurrency(limit=CONCURRENCY_LIMIT):
+        # Raise 429 Too Many Requests, for as long as the backlog takes to drain at the measured rate
+        retry_after = drain_monitor.retry_after(await queue.backlog(), CONCURRENCY_LIMIT)
         raise HTTPException(
             status_code=429,
             detail="System is overloaded, please try again later",
-            headers={"Retry-After": "60"}
+            headers={"Retry-After": str(retry_after)}
         )
 
-    msg = JobMessage(
-        job_id=str(job.id),
-        job_type=job.job_type,
-        priority=job.priority,
-        payload={
-            "image": job.image,
-            "command": job.command,
-            "args": job.args
-        },
-        submitted_at=str(job.created_at)
-    )
-    await queue.enqueue(msg)
-    
-    # Update status to Queued
+    # Queued before the enqueue: once in Redis, the status sync may already move the row further
+    job.queued_at = datetime.now(timezone.utc)
     job.status = JobStatus.QUEUED
     await db.commit()
+    with tracer.start_as_current_span("enqueue_job", kind=trace.SpanKind.PRODUCER) as span:
+        span.set_attribute("job.id", str(job.id))
+        span.set_attribute("job.type", job.job_type.value)
+        span.set_attribute("job.resource_class", job_class)
+        # Carried through Redis so the worker's spans join this trace
+        trace_context = {}
+        propagate.inject(trace_context)
+        msg = JobMessage(
+            job_id=str(job.id),
+            job_type=job.job_type.value,
+            priority=job.priority,
+            payload={
+                "image": job.image,
+                "command": job.command,
+                "args": job.args
+            },
+            submitted_at=job.created_at.isoformat(),
+            queued_at=job.queued_at.isoformat(),
+            queue=job_in.queue,
+            resource_class=job_class,
+            gpu_request=job_in.gpu_request,
+            cpu_millis=cpu_millis,
+            memory_mb=memory_mb,
+            trace_context=trace_context,
+            array_size=job_in.array_size
+        )
+        await queue.enqueue(msg, weight=job_queue.weight if job_queue else 1)
     
     return JobResponse(
         id=job.id,
         external_id=job.external_id,
         status=job.status.value,
         priority=job.priority,
-        created_at=str(job.created_at)
+        created_at=str(job.created_at),
+        array_size=job.array_size or 0
     )
 
 @router.get("/{job_id}", response_model=JobResponse)
@@ -97,6 +155,9 @@ async def get_job(
 ):
     result = await db.execute(select(Job).where(Job.id == job_id))
     job = result.scalar_one_or_none()
+    if not job:
+        # Old finished jobs are moved to jobs_archive
+        job = await get_archived_job(db, job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
         
@@ -105,7 +166,72 @@ async def get_job(
         external_id=job.external_id,
         status=job.status.value,
         priority=job.priority,
-        created_at=str(job.created_at)
+        created_at=str(job.created_at),
+        array_size=job.array_size or 0
+    )
+
+@router.get("/{job_id}/progress", response_model=TaskProgress)
+async def get_job_progress(
+    job_id: UUID,
+    db: AsyncSession = Depends(dependencies.get_db),
+    redis_client = Depends(dependencies.get_redis)
+):
+    """Task counts of an array job (a plain job counts as an array of one)"""
+    progress = await RedisJobQueue(redis_client).task_progress(str(job_id))
+    if progress is not None and progress["array_size"] > 0:
+        return TaskProgress(**progress)
+    job = (await db.execute(select(Job).where(Job.id == job_id))).scalar_one_or_none()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.array_size:
+        # Synced counters; tasks not yet succeeded or failed are reported as pending
+        succeeded, failed = job.tasks_succeeded or 0, job.tasks_failed or 0
+        return TaskProgress(
+            array_size=job.array_size, pending=job.array_size - succeeded - failed,
+            running=0, succeeded=succeeded, failed=failed
+        )
+    status = job.status
+    return TaskProgress(
+        array_size=1,
+        pending=int(status in (JobStatus.PENDING, JobStatus.QUEUED)),
+        running=int(status == JobStatus.RUNNING),
+        succeeded=int(status == JobStatus.SUCCEEDED),
+        failed=int(status in (JobStatus.FAILED, JobStatus.CANCELLED))
+    )
+
+@router.get("/{job_id}/result")
+async def get_job_result(
+    job_id: UUID,
+    db: AsyncSession = Depends(dependencies.get_db),
+    redis_client = Depends(dependencies.get_redis),
+    blob_store: BlobStore = Depends(dependencies.get_blob_store)
+):
+    result = await db.execute(select(Job.result).where(Job.id == job_id))
+    row = result.one_or_none()
+    if row is None:
+        archived = await get_archived_job(db, job_id)
+        if archived is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        row = (archived.result,)
+    job_result = row[0]
+    if job_result is None:
+        # Not synced to Postgres yet, the job hash in Redis is authoritative until then
+        cached = await redis_client.hget(f"ai_jobs:data:{job_id}", "result")
+        job_result = json.loads(cached) if cached else None
+    if job_result is None:
+        raise HTTPException(status_code=404, detail="Job has no result yet")
+    if not is_blob_ref(job_result):
+        return JSONResponse(job_result)
+
+    try:
+        manifest = read_manifest(blob_store, job_result["blob_ref"])
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Job result is no longer available")
+    # Chunks are memory-mapped and decompressed while streaming (in the threadpool)
+    return StreamingResponse(
+        iter_result(blob_store, job_result["blob_ref"], manifest),
+        media_type=manifest["content_type"],
+        headers={"Content-Length": str(manifest["size"])}
     )
 
 @router.get("/", response_model=List[JobResponse])
@@ -128,6 +254,7 @@ async def list_jobs(
             external_id=job.external_id,
             status=job.status.value,
             priority=job.priority,
-            created_at=str(job.created_at)
+            created_at=str(job.created_at),
+            array_size=job.array_size or 0
         ) for job in jobs
     ]
@@ -34,8 +34,9 @@ class Job(Base):
 
     # Job configuration
     image = Column(String(500), nullable=False)
-    command = Column(ARRAY(Text))
-    args = Column(ARRAY(Text))
+    # JSON fallback lets the models run on SQLite (tests, in-process benchmarks)
+    command = Column(ARRAY(Text).with_variant(JSON, "sqlite"))
+    args = Column(ARRAY(Text).with_variant(JSON, "sqlite"))
     env_vars = Column(JSON, default={})
 
     # Resource requirements
@@ -53,6 +54,11 @@ class Job(Base):
     max_retries = Column(Integer, default=3)
     timeout_seconds = Column(Integer, default=3600)
 
+    # Array jobs: one row for all tasks, per-task records live in Redis (ai_jobs:array:<id>:*)
+    array_size = Column(Integer, default=0)
+    tasks_succeeded = Column(Integer, default=0)
+    tasks_failed = Column(Integer, default=0)
+
     # Timing
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     queued_at = Column(DateTime(timezone=True))
@@ -80,6 +86,8 @@ class JobQueue(Base):
     max_concurrent_jobs = Column(Integer, default=100)
     is_paused = Column(Boolean, default=False)
     scheduling_algorithm = Column(String(50), default='priority')
+    # Relative share of dequeues when several queues are backlogged (fair-share)
+    weight = Column(Integer, default=1, nullable=False)
 
     # Resource quotas
     max_gpus = Column(Integer)
@@ -115,7 +123,8 @@ class JobMetric(Base):
     __tablename__ = "job_metrics"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    job_id = Column(UUID(as_uuid=True), ForeignKey("jobs.id", ondelete="CASCADE"))
+    # One row per job so the status sync can upsert on it
+    job_id = Column(UUID(as_uuid=True), ForeignKey("jobs.id", ondelete="CASCADE"), unique=True)
     
     # Performance metrics
     latency_p50_ms = Column(Float)
@@ -132,3 +141,25 @@ class JobMetric(Base):
     recorded_at = Column(DateTime(timezone=True), server_default=func.now())
 
     job = relationship("Job", back_populates="metrics")
+
+
+class ArchivedJob(Base):
+    """
+    Cold storage for terminal jobs, moved here by the archiver (app/services/archiver.py).
+    On Postgres the table is range-partitioned by month of created_at, so a month of
+    old jobs can be detached or dropped without touching the hot `jobs` table.
+    """
+    __tablename__ = "jobs_archive"
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
+
+    # The partition key has to be part of the primary key
+    id = Column(UUID(as_uuid=True), primary_key=True)
+    created_at = Column(DateTime(timezone=True), primary_key=True)
+    external_id = Column(String(255), nullable=False, index=True)
+    status = Column(String(50), nullable=False)
+    completed_at = Column(DateTime(timezone=True))
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    # Full `jobs` row and its `job_metrics` row, JSON-encoded
+    record = Column(JSON, nullable=False)
+    metrics = Column(JSON)
@@ -1,8 +1,15 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+
+import redis.asyncio as redis
+from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
 from prometheus_client import make_asgi_app
 
+from ai_jobs.fair_share import export_class_backlog
 from app.api.routes import jobs, queues, clusters, metrics
 from app.core.config import settings
+from app.services.backpressure import drain_monitor
 
 # OpenTelemetry imports
 from opentelemetry import trace
@@ -16,8 +23,11 @@ from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 resource = Resource.create(attributes={"service.name": "ai-job-api"})
 trace.set_tracer_provider(TracerProvider(resource=resource))
 tracer = trace.get_tracer(__name__)
-otlp_exporter = OTLPSpanExporter(endpoint="http://jaeger:4317", insecure=True)
-trace.get_tracer_provider().add_span_processor(BatchSpanProcessor(otlp_exporter))
+if settings.OTLP_ENDPOINT:
+    otlp_exporter = OTLPSpanExporter(endpoint=settings.OTLP_ENDPOINT, insecure=True)
+    trace.get_tracer_provider().add_span_processor(BatchSpanProcessor(otlp_exporter))
+
+logger = logging.getLogger(__name__)
 
 # OAuth2 scheme and dependency
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -66,16 +76,31 @@ async def health_ready():
     # (Simplified for now, in real prod check actual connectivity)
     return {"status": "ready"}
 
+async def export_queue_stats():
+    """Keep the pending/unmatched per resource class gauges and the drain rate (Retry-After) fresh"""
+    client = redis.from_url(settings.REDIS_URL)
+    try:
+        while True:
+            try:
+                await export_class_backlog(client)
+                await drain_monitor.sample(client)
+            except Exception as e:
+                logger.warning(f"Queue stats refresh failed: {e}")
+            await asyncio.sleep(settings.QUEUE_STATS_INTERVAL_SEC)
+    finally:
+        await client.close()
+
 @app.on_event("startup")
 async def startup_event():
-    # Helper to clean up on startup if needed
-    pass
+    app.state.queue_stats_task = asyncio.create_task(export_queue_stats())
 
 @app.on_event("shutdown")
 async def shutdown_event():
     # Graceful shutdown logic (e.g. close DB pools)
     # The dependency injection usually handles session closure but explicit cleanup is good
-    pass
+    task = getattr(app.state, "queue_stats_task", None)
+    if task:
+        task.cancel()
 
 @app.get("/health")
 async def health_check():
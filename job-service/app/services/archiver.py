@@ -0,0 +1,232 @@
+"""
+Hot/cold archival of finished jobs.
+
+`jobs` and `job_metrics` only need to hold live and recently finished jobs;
+everything else makes list queries, index maintenance and vacuum slower. The
+archiver moves terminal jobs (succeeded, failed, cancelled) that finished more
+than ARCHIVE_AFTER_DAYS ago into `jobs_archive`, one batch per transaction:
+the job row and its metrics row become a single archive row, then both are
+deleted from the hot tables. Rows are picked with FOR UPDATE SKIP LOCKED, so
+several archivers can run side by side.
+
+On Postgres `jobs_archive` is partitioned by month of created_at. The
+archiver creates the monthly partitions it needs, each in its own short
+transaction before the batch is moved: CREATE ... PARTITION OF locks the
+parent table exclusively, which must not last as long as a whole batch.
+Retiring a month is a DETACH PARTITION / DROP TABLE instead of a large DELETE.
+
+get_archived_job() rebuilds a (detached) Job from its archive row, which is
+how the API falls back to the archive for jobs no longer in `jobs`.
+
+Run as its own process:
+    python -m app.services.archiver
+"""
+import asyncio
+import enum
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from prometheus_client import Counter, Histogram
+from sqlalchemy import DateTime, Enum, delete, func, insert, select, text
+from sqlalchemy.dialects.postgresql import UUID
+
+from ai_jobs.job_queue import parse_timestamp
+from app.db.models import ArchivedJob, Job, JobMetric, JobStatus
+
+TERMINAL_STATUSES = (JobStatus.SUCCEEDED, JobStatus.FAILED, JobStatus.CANCELLED)
+PARTITION_LOCK_TIMEOUT = "5s"
+
+ARCHIVED_JOBS = Counter(
+    'archiver_jobs_archived_total',
+    'Jobs moved from the hot jobs table to jobs_archive'
+)
+ARCHIVE_BATCH_DURATION = Histogram(
+    'archiver_batch_seconds',
+    'Time to move one batch of jobs to the archive'
+)
+
+
+def _to_json(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value
+
+
+def to_record(row, columns: Iterable) -> Dict[str, Any]:
+    """ORM row as a JSON-safe dict of its column values"""
+    return {column.key: _to_json(getattr(row, column.key)) for column in columns}
+
+
+def from_record(model, record: Dict[str, Any]):
+    """Inverse of to_record: a transient (never added to a session) instance of model"""
+    values = {}
+    for column in model.__table__.columns:
+        if column.key not in record:
+            continue
+        value = record[column.key]
+        if value is not None:
+            if isinstance(column.type, DateTime):
+                value = parse_timestamp(value)
+            elif isinstance(column.type, Enum) and column.type.enum_class is not None:
+                value = column.type.enum_class(value)
+            elif isinstance(column.type, UUID):
+                value = uuid.UUID(value)
+        values[column.key] = value
+    return model(**values)
+
+
+def month_start(ts: datetime) -> datetime:
+    ts = ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+    ts = ts.astimezone(timezone.utc)
+    return datetime(ts.year, ts.month, 1, tzinfo=timezone.utc)
+
+
+def next_month(start: datetime) -> datetime:
+    return start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+
+
+def partition_name(start: datetime) -> str:
+    return f"{ArchivedJob.__tablename__}_y{start.year}m{start.month:02d}"
+
+
+async def get_archived_job(session, job_id: uuid.UUID) -> Optional[Job]:
+    """The archived job as a detached Job, or None"""
+    row = (await session.execute(
+        select(ArchivedJob.record).where(ArchivedJob.id == job_id)
+    )).scalar_one_or_none()
+    return from_record(Job, row) if row is not None else None
+
+
+class JobArchiver:
+
+    def __init__(self, session_factory, archive_after_days: int = 30, batch_size: int = 1000):
+        self.session_factory = session_factory
+        self.archive_after = timedelta(days=archive_after_days)
+        self.batch_size = batch_size
+        # Monthly partitions known to exist
+        self._partitions = set()
+
+    async def ensure_partitions(self, months: Iterable[datetime]):
+        """
+        Create the missing monthly jobs_archive partitions (Postgres only, the table is plain
+        elsewhere). Runs in its own transaction, and only when a month is not attached yet.
+        """
+        missing = set(months) - self._partitions
+        if not missing:
+            return
+        async with self.session_factory() as session:
+            if session.bind.dialect.name != "postgresql":
+                self._partitions |= missing
+                return
+            existing = set((await session.execute(
+                text(
+                    "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                    "WHERE i.inhparent = CAST(:parent AS regclass)"
+                ),
+                {"parent": ArchivedJob.__tablename__}
+            )).scalars())
+            created = False
+            for start in sorted(missing):
+                if partition_name(start) in existing:
+                    continue
+                if not created:
+                    # Wait briefly for inserting archivers rather than queue every insert behind the DDL
+                    await session.execute(text(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'"))
+                    created = True
+                await session.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF {ArchivedJob.__tablename__} "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{next_month(start).isoformat()}')"
+                ))
+            await session.commit()
+        self._partitions |= missing
+
+    async def archive_batch(self, now: Optional[datetime] = None) -> int:
+        """Move up to batch_size old terminal jobs (and their metrics) to the archive in one transaction"""
+        cutoff = (now or datetime.now(timezone.utc)) - self.archive_after
+        start = time.perf_counter()
+        async with self.session_factory() as session:
+            jobs: List[Job] = list((await session.execute(
+                select(Job)
+                .where(Job.status.in_(TERMINAL_STATUSES))
+                .where(func.coalesce(Job.completed_at, Job.created_at) < cutoff)
+                .order_by(Job.completed_at)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )).scalars())
+            if not jobs:
+                return 0
+            ids = [job.id for job in jobs]
+            metrics = {m.job_id: m for m in (await session.execute(
+                select(JobMetric).where(JobMetric.job_id.in_(ids))
+            )).scalars()}
+
+            rows = []
+            for job in jobs:
+                created_at = job.created_at or job.completed_at or cutoff
+                metric = metrics.get(job.id)
+                rows.append({
+                    "id": job.id,
+                    "created_at": created_at,
+                    "external_id": job.external_id,
+                    "status": job.status.value,
+                    "completed_at": job.completed_at,
+                    "record": to_record(job, Job.__table__.columns),
+                    "metrics": to_record(metric, JobMetric.__table__.columns) if metric else None
+                })
+            # The batch has not touched jobs_archive yet, so the DDL cannot wait on this transaction
+            await self.ensure_partitions(month_start(r["created_at"]) for r in rows)
+            await session.execute(insert(ArchivedJob), rows)
+            await session.execute(delete(JobMetric).where(JobMetric.job_id.in_(ids)))
+            await session.execute(delete(Job).where(Job.id.in_(ids)))
+            await session.commit()
+
+        ARCHIVED_JOBS.inc(len(rows))
+        ARCHIVE_BATCH_DURATION.observe(time.perf_counter() - start)
+        return len(rows)
+
+    async def archive_all(self, now: Optional[datetime] = None) -> int:
+        """Archive batches until nothing old is left"""
+        total = 0
+        while True:
+            moved = await self.archive_batch(now)
+            total += moved
+            if moved < self.batch_size:
+                return total
+
+    async def run(self, interval: float, stop: Optional[asyncio.Event] = None):
+        logging.info(f"Archiving terminal jobs older than {self.archive_after.days} days every {interval}s")
+        while stop is None or not stop.is_set():
+            try:
+                moved = await self.archive_all()
+                if moved:
+                    logging.info(f"Archived {moved} jobs")
+            except Exception as e:
+                logging.error(f"Archiving failed, retrying: {e}")
+            await asyncio.sleep(interval)
+
+
+async def main():
+    from prometheus_client import start_http_server
+
+    from app.api.dependencies import AsyncSessionLocal
+    from app.core.config import settings
+
+    logging.basicConfig(level=logging.INFO)
+    start_http_server(settings.ARCHIVE_METRICS_PORT)
+    archiver = JobArchiver(
+        AsyncSessionLocal,
+        archive_after_days=settings.ARCHIVE_AFTER_DAYS,
+        batch_size=settings.ARCHIVE_BATCH_SIZE
+    )
+    await archiver.run(settings.ARCHIVE_INTERVAL_SEC)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
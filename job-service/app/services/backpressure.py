@@ -0,0 +1,59 @@
+"""
+Admission backpressure driven by the measured drain rate.
+
+The dequeue script counts every job (or array task) it hands out in
+ai_jobs:stats:dequeued. Sampling that counter gives the rate at which
+workers drain the queues, smoothed with an EWMA. When the API rejects a
+submission, Retry-After is the time the current backlog above the
+admission limit takes to drain at that rate, so clients back off exactly
+as long as needed instead of a fixed minute.
+"""
+import math
+import time
+from typing import Optional
+
+from prometheus_client import Gauge
+
+from ai_jobs.fair_share import DEQUEUED_TOTAL_KEY
+
+DRAIN_RATE = Gauge(
+    'job_queue_drain_rate',
+    'Jobs dequeued per second across all workers (EWMA)'
+)
+
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 300
+
+
+class DrainRateMonitor:
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self.rate: Optional[float] = None
+        self._last: Optional[tuple] = None
+
+    async def sample(self, redis_client, now: Optional[float] = None) -> Optional[float]:
+        """Fold the dequeues since the previous sample into the rate; call periodically"""
+        now = time.monotonic() if now is None else now
+        total = int(await redis_client.get(DEQUEUED_TOTAL_KEY) or 0)
+        if self._last is not None:
+            last_total, last_time = self._last
+            elapsed = now - last_time
+            if elapsed > 0:
+                # A reset counter (Redis flushed) counts as no progress rather than a negative rate
+                current = max(0, total - last_total) / elapsed
+                self.rate = current if self.rate is None else self.alpha * current + (1 - self.alpha) * self.rate
+                DRAIN_RATE.set(self.rate)
+        self._last = (total, now)
+        return self.rate
+
+    def retry_after(self, backlog: int, limit: int) -> int:
+        """Seconds until `backlog` outstanding jobs drain below `limit` at the measured rate"""
+        excess = max(1, backlog - limit + 1)
+        if not self.rate:
+            return MAX_RETRY_AFTER
+        return min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, math.ceil(excess / self.rate)))
+
+
+# One per API process, sampled by the queue stats task (app.main)
+drain_monitor = DrainRateMonitor()
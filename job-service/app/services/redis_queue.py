@@ -1,137 +1,108 @@
 import redis.asyncio as redis
 import json
-from datetime import datetime
-from typing import Optional, List
-from dataclasses import dataclass, asdict
+from typing import Optional
 
-@dataclass
-class JobMessage:
-    job_id: str
-    job_type: str
-    priority: int
-    payload: dict
-    submitted_at: str
-    retry_count: int = 0
+from ai_jobs.fair_share import (
+    ARRAY_KEY_PREFIX, CLASS_PENDING_KEY, ENQUEUE_SCRIPT, FAIR_SHARE_KEYS, QUEUE_KEY_PREFIX, resource_class
+)
+from ai_jobs.job_queue import EVENTS_CHANNEL, STATUS_STREAM_KEY, STATUS_STREAM_MAXLEN, JobMessage, utcnow_iso
 
 class RedisJobQueue:
+    """
+    Producer side of the job queue: the API enqueues jobs, reports array progress and
+    applies admission limits. Workers consume through ai_jobs.job_queue.WorkerJobQueue.
+    """
+
     def __init__(self, redis_client: redis.Redis):
         self.redis = redis_client
-        self.queue_key = "ai_jobs:queue:{priority}"
+        self.queue_key = QUEUE_KEY_PREFIX + "{queue}:{resource_class}"
         self.processing_key = "ai_jobs:processing"
-        self.completed_key = "ai_jobs:completed"
-        self.failed_key = "ai_jobs:failed"
         self.job_data_key = "ai_jobs:data:{job_id}"
+        self.status_stream_key = STATUS_STREAM_KEY
+        self._enqueue_script = self.redis.register_script(ENQUEUE_SCRIPT)
+
+    async def record_status(self, job_id: str, event: str, **fields):
+        """Append a status change for the Postgres sync (trimmed, approximately, to the last 1M)"""
+        await self.redis.xadd(
+            self.status_stream_key,
+            {"job_id": job_id, "event": event, "data": json.dumps(fields)},
+            maxlen=STATUS_STREAM_MAXLEN,
+            approximate=True
+        )
     
-    async def enqueue(self, job: JobMessage) -> str:
-        """Add job to priority queue with O(log N) insertion"""
-        # Store job data
+    async def _push(
+        self, queue: str, job_class: str, job_id: str, priority: int, weight: Optional[int], only_new: bool,
+        tasks: int = 1
+    ):
+        await self._enqueue_script(
+            keys=FAIR_SHARE_KEYS,
+            args=[
+                queue, job_class, job_id, priority, "" if weight is None else weight, "1" if only_new else "0", tasks
+            ]
+        )
+
+    def _array_key(self, job_id: str, name: str) -> str:
+        """Per-array task records: results, errors, retries (hashes by task index) and the retry list"""
+        return f"{ARRAY_KEY_PREFIX}{job_id}:{name}"
+
+    async def enqueue(self, job: JobMessage, weight: int = 1) -> str:
+        """
+        Add job to its queue's priority set with O(log N) insertion; weight comes from the JobQueue config.
+        An array job is one entry however many tasks it has.
+        """
+        if not job.queued_at:
+            job.queued_at = utcnow_iso()
+        if not job.resource_class:
+            job.resource_class = resource_class(job.job_type)
+        # Store job data (hash values must be flat, see JobMessage.to_hash)
         await self.redis.hset(
             self.job_data_key.format(job_id=job.job_id),
-            mapping=asdict(job)
+            mapping=job.to_hash()
         )
-        # Add to sorted set with priority as score
-        await self.redis.zadd(
-            "ai_jobs:priority_queue",
-            {job.job_id: job.priority},
-            nx=True
+        # Add to the queue's sorted set with priority as score (and activate the queue)
+        await self._push(
+            job.queue, job.resource_class, job.job_id, job.priority, weight, only_new=True, tasks=job.array_size or 1
         )
         # Publish event for real-time updates
-        await self.redis.publish("ai_jobs:events", json.dumps({
+        await self.redis.publish(EVENTS_CHANNEL, json.dumps({
             "event": "job_submitted",
             "job_id": job.job_id
         }))
         return job.job_id
     
-    async def dequeue(self, count: int = 1) -> List[JobMessage]:
-        """Atomically dequeue highest priority jobs"""
-        # Use ZPOPMAX for O(log N) removal of highest priority
-        jobs = await self.redis.zpopmax("ai_jobs:priority_queue", count)
-        result = []
-        for job_id, priority in jobs:
-            # redis-py returns bytes, need to decode if needed, but zpopmax returns (member, score)
-            # job_id might be bytes or str depending on client decoding
-            if isinstance(job_id, bytes):
-                job_id = job_id.decode('utf-8')
-                
-            job_data = await self.redis.hgetall(
-                self.job_data_key.format(job_id=job_id)
-            )
-            if job_data:
-                # Decode byte keys/values from hgetall if needed
-                decoded_data = {k.decode('utf-8'): v.decode('utf-8') if isinstance(v, bytes) else v for k, v in job_data.items()}
-                
-                # Payload is stored as string/dict, if it was serialized before. 
-                # In enqueue asdict(job) -> payload is a dict. hset might fail if it's a dict unless serialized?
-                # Actually hset mapping checks types. Simple types ok. Dict needs serialization.
-                # Assuming payload in JobMessage is handled or serialized before passed to enqueue or we serialize it here.
-                # Use json.loads for payload if it's a string
-                if 'payload' in decoded_data and isinstance(decoded_data['payload'], str):
-                     try:
-                         decoded_data['payload'] = json.loads(decoded_data['payload'])
-                     except:
-                         pass
-                
-                # Move to processing set
-                await self.redis.sadd(self.processing_key, job_id)
-                result.append(JobMessage(**decoded_data))
-        return result
-    
-    async def complete(self, job_id: str, result: dict):
-        """Mark job as completed"""
-        await self.redis.srem(self.processing_key, job_id)
-        await self.redis.sadd(self.completed_key, job_id)
-        await self.redis.hset(
-            self.job_data_key.format(job_id=job_id),
-            mapping={
-                "result": json.dumps(result),
-                "completed_at": datetime.utcnow().isoformat()
-            }
-        )
-    
-    async def fail(self, job_id: str, error: str, retry: bool = True):
-        """Handle job failure with optional retry"""
-        job_data = await self.redis.hgetall(
-            self.job_data_key.format(job_id=job_id)
+    async def task_progress(self, job_id: str) -> Optional[dict]:
+        """Aggregated task counts of an array job from its counters, None if Redis no longer has it"""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hmget(
+            self.job_data_key.format(job_id=job_id), "array_size", "next_index", "tasks_succeeded", "tasks_failed"
         )
-        if not job_data:
-            return
-
-        decoded_data = {k.decode('utf-8'): v.decode('utf-8') for k, v in job_data.items()}
-        retry_count = int(decoded_data.get("retry_count", 0))
-        max_retries = 3
-        
-        if retry and retry_count < max_retries:
-            # Re-enqueue with incremented retry count (Exponential Backoff could be here)
-            await self.redis.hincrby(
-                self.job_data_key.format(job_id=job_id),
-                "retry_count", 1
-            )
-            # Add back to queue with slightly lower priority
-            original_priority = int(decoded_data.get("priority", 50))
-            await self.redis.zadd(
-                "ai_jobs:priority_queue",
-                {job_id: original_priority - 10}
-            )
-        else:
-            # Move to Dead Letter Queue (DLQ)
-            await self.redis.srem(self.processing_key, job_id)
-            await self.redis.sadd(self.failed_key, job_id) # Failed set
-            await self.redis.lpush("ai_jobs:dlq", job_id)  # DLQ List
-            
-            await self.redis.hset(
-                self.job_data_key.format(job_id=job_id),
-                mapping={
-                    "error": error,
-                    "failed_at": datetime.utcnow().isoformat(),
-                    "status": "dead_letter"
-                }
-            )
+        pipe.llen(self._array_key(job_id, "retry"))
+        (size, claimed, succeeded, failed), retrying = await pipe.execute()
+        if size is None:
+            return None
+        size, claimed, succeeded, failed = (int(v or 0) for v in (size, claimed, succeeded, failed))
+        pending = size - claimed + retrying
+        return {
+            "array_size": size,
+            "pending": pending,
+            "running": size - pending - succeeded - failed,
+            "succeeded": succeeded,
+            "failed": failed
+        }
 
     async def check_concurrency(self, limit: int) -> bool:
         """Check if global concurrency limit is reached"""
         count = await self.redis.scard(self.processing_key)
         return count < limit
 
+    async def backlog(self) -> int:
+        """Outstanding work: jobs/tasks waiting in any queue plus those being processed"""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hvals(CLASS_PENDING_KEY)
+        pipe.scard(self.processing_key)
+        pending, processing = await pipe.execute()
+        return sum(max(0, int(v)) for v in pending) + processing
+
     async def acquire_lock(self, lock_name: str, timeout: int = 10) -> bool:
         """Acquire a distributed lock"""
         return await self.redis.set(f"lock:{lock_name}", "1", nx=True, ex=timeout)
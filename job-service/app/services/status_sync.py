@@ -0,0 +1,357 @@
+"""
+Write-behind sync of job status and metrics from Redis to Postgres.
+
+Workers only write to Redis. Every status transition is also appended to the
+ai_jobs:status_stream Redis Stream (see RedisJobQueue.record_status). This
+service reads the stream through a consumer group in batches, coalesces all
+events of a job into one row update, applies them as a bulk UPDATE of `jobs`
+and an upsert of `job_metrics` in a single transaction, then acknowledges the
+entries.
+
+Replicas apply their batches in any order, so updates are monotonic: a
+status only moves forward (a retry counts as forward when its retry_count is
+higher), nothing changes a job once it has a completed_at, and the array task
+counters only grow.
+
+An event waits at most STATUS_SYNC_MAX_DELAY_MS for its batch to fill, so the
+lag is bounded by that delay plus the flush time. Lag is exported per event
+as status_sync_lag_seconds, measured from the stream entry ID (Redis server
+clock) to the commit. Every CLAIM_IDLE_MS the service also takes over the
+entries left pending by a consumer that died, so a crashed replica's batch
+is applied by the others.
+
+Run as its own process:
+    python -m app.services.status_sync
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+from redis.exceptions import ResponseError
+from sqlalchemy import and_, bindparam, case, func, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from ai_jobs.job_queue import STATUS_STREAM_KEY, parse_timestamp
+from app.db.models import Job, JobMetric, JobStatus
+
+STATUS_SYNC_EVENTS = Counter(
+    'status_sync_events_total',
+    'Status stream events consumed by the Postgres sync',
+    ['event']
+)
+STATUS_SYNC_ROWS = Counter(
+    'status_sync_rows_total',
+    'Rows written by the Postgres sync after coalescing',
+    ['table']
+)
+STATUS_SYNC_LAG = Histogram(
+    'status_sync_lag_seconds',
+    'Time from a status event being written to Redis until it is committed to Postgres',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+)
+STATUS_SYNC_MAX_LAG = Gauge(
+    'status_sync_max_lag_seconds',
+    'Largest event lag in the last committed batch'
+)
+STATUS_SYNC_FLUSH_DURATION = Histogram(
+    'status_sync_flush_seconds',
+    'Time to apply one coalesced batch to Postgres'
+)
+
+CONSUMER_GROUP = "status-sync"
+# Pending entries of a consumer that has been silent this long are taken over
+CLAIM_IDLE_MS = 60_000
+
+TERMINAL_STATUSES = (JobStatus.SUCCEEDED, JobStatus.FAILED, JobStatus.CANCELLED)
+STATUS_RANK = {JobStatus.PENDING: 0, JobStatus.QUEUED: 1, JobStatus.RUNNING: 2}
+COUNTER_COLUMNS = ("tasks_succeeded", "tasks_failed")
+
+METRIC_COLUMNS = (
+    "latency_p50_ms", "latency_p95_ms", "latency_p99_ms", "throughput_rps",
+    "cpu_usage_percent", "memory_usage_mb", "gpu_usage_percent", "gpu_memory_usage_mb"
+)
+
+
+def job_update(event: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Map a status event onto `jobs` columns"""
+    if event == "job_started":
+        return {"status": JobStatus.RUNNING, "started_at": parse_timestamp(data.get("started_at"))}
+    if event == "job_completed":
+        return {
+            "status": JobStatus.SUCCEEDED,
+            "completed_at": parse_timestamp(data.get("completed_at")),
+            "result": data.get("result")
+        }
+    if event == "job_retrying":
+        return {
+            "status": JobStatus.QUEUED,
+            "queued_at": parse_timestamp(data.get("queued_at")),
+            "retry_count": data.get("retry_count"),
+            "error_message": data.get("error")
+        }
+    if event == "job_progress":
+        return {"tasks_succeeded": data.get("tasks_succeeded"), "tasks_failed": data.get("tasks_failed")}
+    if event == "job_array_finished":
+        summary = {k: data.get(k) for k in ("array_size", "tasks_succeeded", "tasks_failed")}
+        return {
+            "status": JobStatus.FAILED if data.get("tasks_failed") else JobStatus.SUCCEEDED,
+            "completed_at": parse_timestamp(data.get("completed_at")),
+            "result": summary,
+            "tasks_succeeded": data.get("tasks_succeeded"),
+            "tasks_failed": data.get("tasks_failed")
+        }
+    if event == "job_dead_lettered":
+        return {
+            "status": JobStatus.FAILED,
+            "completed_at": parse_timestamp(data.get("failed_at")),
+            "error_message": data.get("error")
+        }
+    return {}
+
+
+def _status_guard(table, status: JobStatus, has_retry_count: bool):
+    """Rows an update moving to `status` may still change"""
+    still_open = and_(table.c.completed_at.is_(None), table.c.status.notin_(TERMINAL_STATUSES))
+    if status in TERMINAL_STATUSES:
+        return still_open
+    current_rank = case(*((table.c.status == s, rank) for s, rank in STATUS_RANK.items()), else_=len(STATUS_RANK))
+    forward = current_rank < STATUS_RANK[status]
+    if has_retry_count:
+        # A retry starts a new attempt, which is ahead of any status of the previous ones
+        retry_count, current = bindparam("b_retry_count"), func.coalesce(table.c.retry_count, 0)
+        forward = or_(retry_count > current, and_(retry_count == current, forward))
+    return and_(still_open, forward)
+
+
+def _greatest(dialect: str, *values):
+    return (func.greatest if dialect == "postgresql" else func.max)(*values)
+
+
+def _decode(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _entry_time(entry_id: str) -> float:
+    """Stream IDs are <unix ms>-<seq> assigned by the Redis server"""
+    return int(entry_id.split("-")[0]) / 1000
+
+
+class StatusSync:
+
+    def __init__(
+        self,
+        redis_client,
+        session_factory,
+        batch_size: int = 1000,
+        max_delay: float = 0.5,
+        consumer: Optional[str] = None,
+        stream_key: str = STATUS_STREAM_KEY,
+        group: str = CONSUMER_GROUP,
+        claim_idle_ms: int = CLAIM_IDLE_MS
+    ):
+        self.redis = redis_client
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.stream_key = stream_key
+        self.group = group
+        self.claim_idle_ms = claim_idle_ms
+        # "0" replays our own pending (read, never acknowledged) entries before new ones
+        self._read_id = "0"
+
+    async def ensure_group(self):
+        try:
+            await self.redis.xgroup_create(self.stream_key, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        await self.claim_stale()
+
+    async def claim_stale(self):
+        """Take over entries left pending by consumers that died before acknowledging"""
+        cursor = "0-0"
+        while True:
+            reply = await self.redis.xautoclaim(
+                self.stream_key, self.group, self.consumer, self.claim_idle_ms, start_id=cursor, count=self.batch_size
+            )
+            cursor = _decode(reply[0])
+            if cursor == "0-0":
+                break
+        self._read_id = "0"
+
+    async def read_batch(self) -> List[Tuple[str, Dict[str, str]]]:
+        """Up to batch_size entries; waits at most max_delay after the first one arrives"""
+        if self._read_id == "0":
+            reply = await self.redis.xreadgroup(
+                self.group, self.consumer, {self.stream_key: "0"}, count=self.batch_size
+            )
+            entries = reply[0][1] if reply else []
+            if entries:
+                return [(_decode(i), {_decode(k): _decode(v) for k, v in f.items()}) for i, f in entries]
+            self._read_id = ">"
+
+        entries = []
+        deadline = None
+        while len(entries) < self.batch_size:
+            timeout = self.max_delay if deadline is None else deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            reply = await self.redis.xreadgroup(
+                self.group, self.consumer, {self.stream_key: ">"},
+                count=self.batch_size - len(entries), block=max(1, int(timeout * 1000))
+            )
+            if not reply or not reply[0][1]:
+                break
+            entries.extend(reply[0][1])
+            if deadline is None:
+                deadline = time.monotonic() + self.max_delay
+        return [(_decode(i), {_decode(k): _decode(v) for k, v in f.items()}) for i, f in entries]
+
+    @staticmethod
+    def coalesce(entries: List[Tuple[str, Dict[str, str]]]) -> Tuple[Dict[uuid.UUID, Dict], Dict[uuid.UUID, Dict]]:
+        """Fold events in stream order into one pending update per job"""
+        jobs: Dict[uuid.UUID, Dict[str, Any]] = {}
+        metrics: Dict[uuid.UUID, Dict[str, Any]] = {}
+        for _, fields in entries:
+            event = fields.get("event", "")
+            STATUS_SYNC_EVENTS.labels(event=event).inc()
+            try:
+                job_id = uuid.UUID(fields["job_id"])
+                data = json.loads(fields.get("data") or "{}")
+            except (KeyError, ValueError):
+                logging.warning(f"Skipping malformed status event {fields}")
+                continue
+            if event == "job_metrics":
+                metrics.setdefault(job_id, {}).update({k: v for k, v in data.items() if k in METRIC_COLUMNS})
+            else:
+                jobs.setdefault(job_id, {}).update(job_update(event, data))
+        return jobs, metrics
+
+    @staticmethod
+    def job_updates(dialect: str, job_rows: List[Dict[str, Any]]) -> List[Tuple[Any, List[Dict[str, Any]]]]:
+        """
+        Monotonic UPDATEs of `jobs` by primary key, one executemany statement per set of columns
+        and target status: status columns only change while _status_guard holds, counters use GREATEST.
+        """
+        table = Job.__table__
+        groups: Dict[Tuple, List[Dict[str, Any]]] = {}
+        for row in job_rows:
+            groups.setdefault((tuple(sorted(k for k in row if k != "id")), row.get("status")), []).append(row)
+
+        statements = []
+        for (columns, status), rows in groups.items():
+            guard = None if status is None else _status_guard(table, status, "retry_count" in columns)
+            values = {}
+            for column in columns:
+                new = bindparam(f"b_{column}", type_=table.c[column].type)
+                if column in COUNTER_COLUMNS:
+                    values[column] = _greatest(dialect, func.coalesce(table.c[column], 0), new)
+                elif guard is not None:
+                    values[column] = case((guard, new), else_=table.c[column])
+                else:
+                    values[column] = new
+            stmt = update(table).where(table.c.id == bindparam("b_id")).values(values)
+            statements.append((stmt, [{f"b_{k}": v for k, v in row.items()} for row in rows]))
+        return statements
+
+    async def apply(self, jobs: Dict[uuid.UUID, Dict], metrics: Dict[uuid.UUID, Dict]):
+        """One transaction: monotonic bulk UPDATE of jobs by primary key, upsert job_metrics on job_id"""
+        async with self.session_factory() as session:
+            # Events for jobs that are not (or no longer) in Postgres must not fail the batch
+            known = set((await session.execute(
+                select(Job.id).where(Job.id.in_(list(jobs.keys() | metrics.keys())))
+            )).scalars())
+            dialect = session.bind.dialect.name
+
+            job_rows = [{"id": job_id, **values} for job_id, values in jobs.items() if job_id in known and values]
+            for stmt, params in self.job_updates(dialect, job_rows):
+                await session.execute(stmt, params)
+
+            metric_rows = [
+                {"job_id": job_id, **{c: values.get(c) for c in METRIC_COLUMNS}}
+                for job_id, values in metrics.items() if job_id in known
+            ]
+            if metric_rows:
+                insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+                stmt = insert(JobMetric.__table__)
+                table = JobMetric.__table__
+                # Columns missing from this batch keep the value already stored
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[table.c.job_id],
+                    set_={
+                        **{c: func.coalesce(stmt.excluded[c], table.c[c]) for c in METRIC_COLUMNS},
+                        "recorded_at": func.now()
+                    }
+                )
+                await session.execute(stmt, [{"id": uuid.uuid4(), **row} for row in metric_rows])
+
+            await session.commit()
+        STATUS_SYNC_ROWS.labels(table="jobs").inc(len(job_rows))
+        STATUS_SYNC_ROWS.labels(table="job_metrics").inc(len(metric_rows))
+
+    async def sync_once(self) -> int:
+        """Read, coalesce, apply and acknowledge one batch; returns the number of events"""
+        entries = await self.read_batch()
+        if not entries:
+            return 0
+        jobs, metrics = self.coalesce(entries)
+        start = time.perf_counter()
+        try:
+            await self.apply(jobs, metrics)
+        except Exception:
+            # Entries stay pending and are replayed on the next read
+            self._read_id = "0"
+            raise
+        STATUS_SYNC_FLUSH_DURATION.observe(time.perf_counter() - start)
+
+        ids = [entry_id for entry_id, _ in entries]
+        await self.redis.xack(self.stream_key, self.group, *ids)
+        now = time.time()
+        lags = [max(0.0, now - _entry_time(entry_id)) for entry_id in ids]
+        for lag in lags:
+            STATUS_SYNC_LAG.observe(lag)
+        STATUS_SYNC_MAX_LAG.set(max(lags))
+        return len(entries)
+
+    async def run(self, stop: Optional[asyncio.Event] = None):
+        await self.ensure_group()
+        logging.info(f"Status sync consuming {self.stream_key} as {self.group}/{self.consumer}")
+        next_claim = time.monotonic() + self.claim_idle_ms / 1000
+        while stop is None or not stop.is_set():
+            try:
+                if time.monotonic() >= next_claim:
+                    await self.claim_stale()
+                    next_claim = time.monotonic() + self.claim_idle_ms / 1000
+                await self.sync_once()
+            except Exception as e:
+                logging.error(f"Status sync batch failed, retrying: {e}")
+                await asyncio.sleep(1)
+
+
+async def main():
+    import redis.asyncio as redis
+    from prometheus_client import start_http_server
+
+    from app.api.dependencies import AsyncSessionLocal
+    from app.core.config import settings
+
+    logging.basicConfig(level=logging.INFO)
+    start_http_server(settings.STATUS_SYNC_METRICS_PORT)
+    sync = StatusSync(
+        redis.from_url(settings.REDIS_URL),
+        AsyncSessionLocal,
+        batch_size=settings.STATUS_SYNC_BATCH_SIZE,
+        max_delay=settings.STATUS_SYNC_MAX_DELAY_MS / 1000
+    )
+    await sync.run()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
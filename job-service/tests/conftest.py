@@ -1,3 +1,8 @@
+import os
+
+# No trace exporter in tests (the default endpoint only resolves inside docker-compose)
+os.environ.setdefault("OTLP_ENDPOINT", "")
+
 import pytest
 from httpx import AsyncClient
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
@@ -0,0 +1,36 @@
+import pytest
+import fakeredis
+
+from ai_jobs.job_queue import WorkerJobQueue
+from app.services.backpressure import DrainRateMonitor, MAX_RETRY_AFTER
+from app.services.redis_queue import RedisJobQueue, JobMessage
+
+
+@pytest.mark.anyio
+async def test_retry_after_follows_the_measured_drain_rate():
+    server = fakeredis.FakeServer()
+    client = fakeredis.aioredis.FakeRedis(server=server)
+    queue = RedisJobQueue(client)
+    worker = WorkerJobQueue(fakeredis.FakeRedis(server=server))
+    monitor = DrainRateMonitor(alpha=1.0)
+    for i in range(30):
+        await queue.enqueue(JobMessage(
+            job_id=f"job-{i}", job_type="inference", priority=50, payload={}, submitted_at=""
+        ))
+
+    await monitor.sample(client, now=0.0)
+    # Nothing measured yet: back off for the longest
+    assert monitor.retry_after(backlog=1100, limit=1000) == MAX_RETRY_AFTER
+
+    dequeued = worker.dequeue(20)
+    assert await monitor.sample(client, now=10.0) == 2.0
+    assert await queue.backlog() == 30
+    # 101 jobs above the limit at 2 jobs/s
+    assert monitor.retry_after(backlog=1100, limit=1000) == 51
+    assert monitor.retry_after(backlog=1000, limit=1000) == 1
+
+    # A retried job is pending again, not also still processing
+    worker.fail(dequeued[0], "boom")
+    assert not await client.sismember(queue.processing_key, dequeued[0].job_id)
+    assert await queue.backlog() == 30
+    await client.aclose()
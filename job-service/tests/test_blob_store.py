@@ -0,0 +1,92 @@
+import json
+import os
+
+import pytest
+import fakeredis
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from ai_jobs.blob_store import BlobStore, LocalBlobStore, store_result, iter_result, is_blob_ref
+from ai_jobs.job_queue import JobMessage, WorkerJobQueue
+from app.main import app
+from app.api import dependencies
+from app.db.models import Base, Job, JobStatus
+from app.services.redis_queue import RedisJobQueue
+
+
+def large_result(items: int = 20000) -> dict:
+    return {"predictions": [[i, i * 0.5, f"class-{i % 1000}"] for i in range(items)]}
+
+
+def test_backends_must_implement_the_interface():
+    class WriteOnlyStore(BlobStore):
+        def put(self, key, name, data):
+            pass
+
+    with pytest.raises(TypeError):
+        WriteOnlyStore()
+
+
+def test_chunks_round_trip(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    data = os.urandom(1000) * 300  # Compressible, spans several chunks
+    ref = store_result(store, "results/abc", data, chunk_bytes=64 * 1024)
+
+    assert ref["size"] == len(data)
+    assert ref["compressed_size"] < len(data)
+    assert len([n for n in os.listdir(tmp_path / "results" / "abc") if n.endswith(".z")]) == 5
+    assert b"".join(iter_result(store, "results/abc")) == data
+
+
+def test_keys_cannot_escape_root(tmp_path):
+    store = LocalBlobStore(str(tmp_path / "blobs"))
+    with pytest.raises(ValueError):
+        store.put("../outside", "manifest.json", b"{}")
+
+
+@pytest.mark.anyio
+async def test_large_result_is_offloaded_and_streamed(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/jobs.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    server = fakeredis.FakeServer()
+    redis_client = fakeredis.aioredis.FakeRedis(server=server)
+    store = LocalBlobStore(str(tmp_path / "blobs"))
+
+    async with sessions() as session:
+        job = Job(external_id="job-1", job_type="inference", image="img", status=JobStatus.RUNNING)
+        session.add(job)
+        await session.commit()
+
+    await RedisJobQueue(redis_client).enqueue(JobMessage(
+        job_id=str(job.id), job_type="inference", priority=50, payload={}, submitted_at=""
+    ))
+    worker = WorkerJobQueue(fakeredis.FakeRedis(server=server), blob_store=store, offload_threshold=1024)
+    result = large_result()
+    worker.complete(worker.dequeue()[0], result)
+    stored = json.loads(await redis_client.hget(f"ai_jobs:data:{job.id}", "result"))
+    assert is_blob_ref(stored)
+    assert stored["compressed_size"] < stored["size"]
+
+    async def get_db():
+        async with sessions() as session:
+            yield session
+
+    async def get_redis():
+        yield redis_client
+
+    app.dependency_overrides[dependencies.get_db] = get_db
+    app.dependency_overrides[dependencies.get_redis] = get_redis
+    app.dependency_overrides[dependencies.get_blob_store] = lambda: store
+    try:
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get(f"/api/v1/jobs/{job.id}/result")
+    finally:
+        app.dependency_overrides.clear()
+        await redis_client.aclose()
+        await engine.dispose()
+
+    assert response.status_code == 200
+    assert response.headers["content-length"] == str(stored["size"])
+    assert response.json() == result
@@ -0,0 +1,174 @@
+import pytest
+import fakeredis
+
+from ai_jobs.fair_share import WorkerResources, export_class_backlog, resource_class
+from ai_jobs.job_queue import WorkerJobQueue
+from app.services.redis_queue import RedisJobQueue, JobMessage
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+async def queue(server):
+    client = fakeredis.aioredis.FakeRedis(server=server)
+    yield RedisJobQueue(client)
+    await client.aclose()
+
+
+@pytest.fixture
+def worker(server):
+    """The consumer the workers run, on the same Redis"""
+    client = fakeredis.FakeRedis(server=server)
+    yield WorkerJobQueue(client)
+    client.close()
+
+
+def make_job(job_id: str, priority: int = 50) -> JobMessage:
+    return JobMessage(
+        job_id=job_id,
+        job_type="inference",
+        priority=priority,
+        payload={"image": "img"},
+        submitted_at="2024-01-01 12:00:00",
+        trace_context={"traceparent": "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"}
+    )
+
+
+@pytest.mark.anyio
+async def test_lifecycle_timestamps_and_trace_context(queue: RedisJobQueue, worker: WorkerJobQueue):
+    await queue.enqueue(make_job("job-1"))
+
+    job = worker.dequeue()[0]
+    assert job.payload == {"image": "img"}
+    assert job.trace_context["traceparent"].startswith("00-0af7")
+    assert job.queued_at
+
+    worker.complete(job, {"ok": True})
+    data = await queue.redis.hgetall("ai_jobs:data:job-1")
+    assert data[b"status"] == b"succeeded"
+    assert data[b"started_at"] <= data[b"completed_at"]
+
+
+@pytest.mark.anyio
+async def test_retried_job_dequeues_again(queue: RedisJobQueue, worker: WorkerJobQueue):
+    await queue.enqueue(make_job("job-1"))
+    worker.fail(worker.dequeue()[0], "boom")
+
+    job = worker.dequeue()[0]
+    assert job.retry_count == 1
+    assert job.priority == 50
+
+
+@pytest.mark.anyio
+async def test_weighted_fair_share_across_queues(queue: RedisJobQueue, worker: WorkerJobQueue):
+    # A flood in one queue must not starve the others; shares follow the weights
+    for i in range(300):
+        job = make_job(f"flood-{i}")
+        job.queue = "flood"
+        await queue.enqueue(job, weight=1)
+    for name, weight in (("team-a", 3), ("team-b", 1)):
+        for i in range(100):
+            job = make_job(f"{name}-{i}")
+            job.queue = name
+            await queue.enqueue(job, weight=weight)
+
+    served = [job.queue for job in worker.dequeue(100)]
+    assert served.count("team-a") == 60
+    assert served.count("team-b") == 20
+    assert served.count("flood") == 20
+
+
+@pytest.mark.anyio
+async def test_idle_queue_does_not_bank_credit(queue: RedisJobQueue, worker: WorkerJobQueue):
+    for i in range(50):
+        job = make_job(f"busy-{i}")
+        job.queue = "busy"
+        await queue.enqueue(job)
+    worker.dequeue(40)
+
+    # "late" was idle while "busy" was served; it must not now get 40 jobs in a row
+    for i in range(20):
+        job = make_job(f"late-{i}")
+        job.queue = "late"
+        await queue.enqueue(job)
+    served = [job.queue for job in worker.dequeue(10)]
+    assert served.count("late") in (5, 6)
+
+
+@pytest.mark.anyio
+async def test_dequeue_only_hands_out_jobs_that_fit(queue: RedisJobQueue, worker: WorkerJobQueue):
+    for i in range(5):
+        job = make_job(f"gpu-{i}", priority=90)
+        job.resource_class = resource_class("training", gpus=1, cpu_millis=4000, memory_mb=16384)
+        await queue.enqueue(job)
+    for i in range(5):
+        job = make_job(f"cpu-{i}", priority=10)
+        job.resource_class = resource_class("inference", cpu_millis=500, memory_mb=512)
+        await queue.enqueue(job)
+
+    cpu_worker = WorkerResources(gpus=0, cpu_millis=8000, memory_mb=32768)
+    served = worker.dequeue(10, resources=cpu_worker, worker_id="cpu-worker")
+    assert sorted(job.job_id for job in served) == [f"cpu-{i}" for i in range(5)]
+    assert worker.dequeue(1, resources=cpu_worker, worker_id="cpu-worker") == []
+
+    # Nothing live can take the GPU jobs
+    backlog = await export_class_backlog(queue.redis)
+    assert backlog["training:g1:c4:m16"] == (5, 5)
+
+    gpu_worker = WorkerResources(gpus=1, cpu_millis=8000, memory_mb=32768, job_types=("training",))
+    assert len(worker.dequeue(10, resources=gpu_worker, worker_id="gpu-worker")) == 5
+
+
+@pytest.mark.anyio
+async def test_exact_requests_fit_above_the_rounded_class(queue: RedisJobQueue, worker: WorkerJobQueue):
+    # 6 cores / 6 GiB: classes c8 and m8 are above it, but these exact requests fit
+    node = WorkerResources(gpus=0, cpu_millis=6000, memory_mb=6144)
+    for job_id, cpu_millis, memory_mb in (("small", 3000, 5120), ("six-cores", 6000, 1024), ("seven-cores", 7000, 1024)):
+        job = make_job(job_id)
+        job.cpu_millis, job.memory_mb = cpu_millis, memory_mb
+        job.resource_class = resource_class("inference", cpu_millis=cpu_millis, memory_mb=memory_mb)
+        await queue.enqueue(job)
+    assert node.may_fit("inference:g0:c8:m1") and not node.fits("inference:g0:c8:m1")
+    assert not node.may_fit("inference:g0:c16:m1")
+
+    served = worker.dequeue(10, resources=node, worker_id="node")
+    assert sorted(job.job_id for job in served) == ["six-cores", "small"]
+    # The 7-core job shares class c8 and stays queued for a larger worker
+    assert worker.dequeue(1, resources=node, worker_id="node") == []
+    (job,) = worker.dequeue(1, resources=WorkerResources(gpus=0, cpu_millis=8000, memory_mb=8192))
+    assert job.job_id == "seven-cores"
+
+
+@pytest.mark.anyio
+async def test_array_job_claims_tasks_lazily(queue: RedisJobQueue, worker: WorkerJobQueue):
+    job = make_job("sweep")
+    job.payload = {"args": ["--seed", "{task_index}"]}
+    job.array_size = 5
+    await queue.enqueue(job)
+    assert await queue.redis.zcard(queue.queue_key.format(queue="default", resource_class=job.resource_class)) == 1
+
+    tasks = worker.dequeue(10)
+    assert [t.task_index for t in tasks] == [0, 1, 2, 3, 4]
+    assert tasks[3].payload == {"args": ["--seed", "3"]}
+    assert await queue.redis.exists("ai_jobs:array:sweep:results") == 0
+    assert await queue.task_progress("sweep") == {
+        "array_size": 5, "pending": 0, "running": 5, "succeeded": 0, "failed": 0
+    }
+
+    for task in tasks[:4]:
+        worker.complete(task, {"loss": task.task_index})
+    worker.fail(tasks[4], "oom")
+    (retried,) = worker.dequeue(10)
+    assert retried.task_index == 4
+    worker.complete(retried, {"loss": 4})
+
+    assert await queue.task_progress("sweep") == {
+        "array_size": 5, "pending": 0, "running": 0, "succeeded": 5, "failed": 0
+    }
+    data = await queue.redis.hgetall("ai_jobs:data:sweep")
+    assert data[b"status"] == b"succeeded"
+    assert await queue.redis.hlen("ai_jobs:array:sweep:results") == 5
+    assert worker.dequeue() == []
@@ -0,0 +1,213 @@
+import asyncio
+import uuid
+
+import pytest
+import fakeredis
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from ai_jobs.job_queue import WorkerJobQueue
+from app.db.models import Base, Job, JobMetric, JobStatus
+from app.services.redis_queue import RedisJobQueue, JobMessage
+from app.services.status_sync import StatusSync, job_update
+
+
+@pytest.fixture
+async def sessions(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/sync.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield async_sessionmaker(engine, expire_on_commit=False)
+    await engine.dispose()
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+async def redis_client(server):
+    client = fakeredis.aioredis.FakeRedis(server=server)
+    yield client
+    await client.aclose()
+
+
+@pytest.fixture
+def worker(server):
+    """The consumer the workers run, on the same Redis"""
+    client = fakeredis.FakeRedis(server=server)
+    yield WorkerJobQueue(client)
+    client.close()
+
+
+async def create_jobs(sessions, queue: RedisJobQueue, count: int):
+    async with sessions() as session:
+        jobs = [
+            Job(external_id=f"job-{i}", job_type="inference", image="img", status=JobStatus.QUEUED)
+            for i in range(count)
+        ]
+        session.add_all(jobs)
+        await session.commit()
+    for job in jobs:
+        await queue.enqueue(JobMessage(
+            job_id=str(job.id), job_type="inference", priority=50, payload={}, submitted_at=""
+        ))
+    return [job.id for job in jobs]
+
+
+@pytest.mark.anyio
+async def test_events_are_coalesced_into_batched_writes(sessions, redis_client, worker):
+    queue = RedisJobQueue(redis_client)
+    await create_jobs(sessions, queue, 3)
+    sync = StatusSync(redis_client, sessions, batch_size=100, max_delay=0.05, consumer="test")
+    await sync.ensure_group()
+
+    dequeued = worker.dequeue(3)
+    worker.complete(dequeued[0], {"label": 7}, metrics={"latency_p50_ms": 12.5})
+    failing = dequeued[1]
+    for _ in range(4):
+        worker.fail(failing, "boom")
+        failing = (worker.dequeue() or [failing])[0]
+    # An event for a job that never reached Postgres must not break the batch
+    await queue.record_status(str(uuid.uuid4()), "job_started", started_at="2024-01-01T00:00:00+00:00")
+
+    assert await sync.sync_once() == 13
+    assert await sync.sync_once() == 0
+
+    async with sessions() as session:
+        jobs = {j.id: j for j in (await session.execute(select(Job))).scalars()}
+        metric = (await session.execute(select(JobMetric))).scalar_one()
+
+    completed, failed, running = (jobs[uuid.UUID(j.job_id)] for j in dequeued)
+    assert completed.status == JobStatus.SUCCEEDED
+    assert completed.result == {"label": 7}
+    assert completed.started_at is not None and completed.completed_at is not None
+    assert failed.status == JobStatus.FAILED
+    assert failed.error_message == "boom"
+    assert failed.retry_count == 3
+    assert running.status == JobStatus.RUNNING
+    assert metric.job_id == completed.id and metric.latency_p50_ms == 12.5
+
+
+@pytest.mark.anyio
+async def test_metrics_upsert_keeps_earlier_columns(sessions, redis_client, worker):
+    queue = RedisJobQueue(redis_client)
+    (job_id,) = await create_jobs(sessions, queue, 1)
+    sync = StatusSync(redis_client, sessions, batch_size=100, max_delay=0.05, consumer="test")
+    await sync.ensure_group()
+
+    await queue.record_status(str(job_id), "job_metrics", latency_p50_ms=10.0)
+    await sync.sync_once()
+    await queue.record_status(str(job_id), "job_metrics", throughput_rps=200.0)
+    await sync.sync_once()
+
+    async with sessions() as session:
+        metric = (await session.execute(select(JobMetric))).scalar_one()
+    assert (metric.latency_p50_ms, metric.throughput_rps) == (10.0, 200.0)
+
+
+@pytest.mark.anyio
+async def test_unacknowledged_events_are_replayed(sessions, redis_client, worker):
+    queue = RedisJobQueue(redis_client)
+    (job_id,) = await create_jobs(sessions, queue, 1)
+    sync = StatusSync(redis_client, sessions, batch_size=100, max_delay=0.05, consumer="test")
+    await sync.ensure_group()
+    worker.dequeue()
+
+    async def broken_apply(jobs, metrics):
+        raise RuntimeError("database down")
+
+    original_apply, sync.apply = sync.apply, broken_apply
+    with pytest.raises(RuntimeError):
+        await sync.sync_once()
+
+    sync.apply = original_apply
+    assert await sync.sync_once() == 1
+    async with sessions() as session:
+        assert (await session.get(Job, job_id)).status == JobStatus.RUNNING
+
+
+@pytest.mark.anyio
+async def test_running_consumer_takes_over_a_dead_consumers_entries(sessions, redis_client, worker):
+    queue = RedisJobQueue(redis_client)
+    (job_id,) = await create_jobs(sessions, queue, 1)
+    alive = StatusSync(redis_client, sessions, batch_size=100, max_delay=0.05, consumer="alive", claim_idle_ms=50)
+    await alive.ensure_group()
+
+    # Delivered to a replica that dies before applying and acknowledging it
+    worker.dequeue()
+    dead = StatusSync(redis_client, sessions, batch_size=100, max_delay=0.05, consumer="dead")
+    assert len(await dead.read_batch()) == 1
+
+    stop = asyncio.Event()
+    task = asyncio.create_task(alive.run(stop))
+    await asyncio.sleep(0.5)
+    stop.set()
+    await task
+
+    async with sessions() as session:
+        assert (await session.get(Job, job_id)).status == JobStatus.RUNNING
+    pending = await redis_client.xpending(alive.stream_key, alive.group)
+    assert pending["pending"] == 0
+
+
+@pytest.mark.anyio
+async def test_array_progress_is_aggregated_on_the_job_row(sessions, redis_client, worker):
+    queue = RedisJobQueue(redis_client)
+    async with sessions() as session:
+        job = Job(external_id="sweep", job_type="inference", image="img", status=JobStatus.QUEUED, array_size=3)
+        session.add(job)
+        await session.commit()
+    await queue.enqueue(JobMessage(
+        job_id=str(job.id), job_type="inference", priority=50, payload={}, submitted_at="", array_size=3
+    ))
+    sync = StatusSync(redis_client, sessions, batch_size=100, max_delay=0.05, consumer="test")
+    await sync.ensure_group()
+
+    for task in worker.dequeue(3):
+        worker.complete(task, {})
+    await sync.sync_once()
+
+    async with sessions() as session:
+        synced = await session.get(Job, job.id)
+    assert synced.status == JobStatus.SUCCEEDED
+    assert (synced.tasks_succeeded, synced.tasks_failed) == (3, 0)
+    assert synced.result == {"array_size": 3, "tasks_succeeded": 3, "tasks_failed": 0}
+
+
+@pytest.mark.anyio
+async def test_out_of_order_batches_never_move_a_job_backwards(sessions, redis_client):
+    queue = RedisJobQueue(redis_client)
+    (job_id,) = await create_jobs(sessions, queue, 1)
+    sync = StatusSync(redis_client, sessions)
+
+    async def apply(event, **data):
+        await sync.apply({job_id: job_update(event, data)}, {})
+        async with sessions() as session:
+            job = await session.get(Job, job_id)
+        return job.status, job.retry_count
+
+    # Replicas apply their batches in any order: the retry lands before the first start
+    assert await apply("job_retrying", queued_at="2024-01-01T00:00:02+00:00", retry_count=1, error="boom") == (
+        JobStatus.QUEUED, 1
+    )
+    assert await apply("job_started", started_at="2024-01-01T00:00:03+00:00") == (JobStatus.RUNNING, 1)
+    assert await apply("job_retrying", queued_at="2024-01-01T00:00:02+00:00", retry_count=1, error="boom") == (
+        JobStatus.RUNNING, 1
+    )
+    assert await apply("job_completed", completed_at="2024-01-01T00:00:04+00:00", result={"ok": True}) == (
+        JobStatus.SUCCEEDED, 1
+    )
+    assert await apply("job_started", started_at="2024-01-01T00:00:01+00:00") == (JobStatus.SUCCEEDED, 1)
+    assert await apply("job_dead_lettered", failed_at="2024-01-01T00:00:05+00:00", error="late") == (
+        JobStatus.SUCCEEDED, 1
+    )
+
+    await sync.apply({job_id: job_update("job_progress", {"tasks_succeeded": 3, "tasks_failed": 1})}, {})
+    await sync.apply({job_id: job_update("job_progress", {"tasks_succeeded": 2, "tasks_failed": 0})}, {})
+    async with sessions() as session:
+        job = await session.get(Job, job_id)
+    assert (job.tasks_succeeded, job.tasks_failed) == (3, 1)
+    assert job.result == {"ok": True}
+    assert job.started_at is not None and job.error_message == "boom"
@@ -0,0 +1,172 @@
+"""
+CPU tuning benchmark for InferenceWorker
+Usage: python cpu_tuning.py --model /models/resnet50.pt --batch-size 8 --output cpu_config.json
+
+Runs the model under every candidate CPUExecutionConfig and reports the
+fastest one. The JSON written with --output can be fed back to the worker
+through the CPU_CONFIG_PATH environment variable.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import time
+import zipfile
+from dataclasses import dataclass, asdict
+from typing import List, Optional, Sequence
+
+import numpy as np
+import torch
+
+from inference_worker import InferenceWorker, CPUExecutionConfig, cpu_supports_bf16
+
+
+@dataclass
+class TuningResult:
+    config: CPUExecutionConfig
+    batch_size: int
+    p50_ms: float
+    p99_ms: float
+    throughput: float  # samples/sec
+    error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["config"] = self.config.to_dict()
+        return data
+
+
+def default_thread_options() -> List[int]:
+    cores = os.cpu_count() or 1
+    return sorted({max(1, cores // 2), cores})
+
+
+def is_torchscript(model_path: str) -> bool:
+    """TorchScript archives carry constants.pkl next to their code, torch.save checkpoints do not"""
+    try:
+        with zipfile.ZipFile(model_path) as archive:
+            return any(name.endswith("/constants.pkl") for name in archive.namelist())
+    except (OSError, zipfile.BadZipFile):
+        return False
+
+
+def candidate_configs(
+    thread_options: Optional[Sequence[int]] = None,
+    include_quantize: bool = True,
+    model_path: Optional[str] = None
+) -> List[CPUExecutionConfig]:
+    """
+    Cartesian product of the tunable knobs, skipping bf16 on CPUs without support
+    and quantization for TorchScript models (dynamic quantization only rewrites eager ones)
+    """
+    threads = list(thread_options or default_thread_options())
+    bf16_options = [False, True] if cpu_supports_bf16() else [False]
+    if include_quantize and model_path and is_torchscript(model_path):
+        logging.info(f"{model_path} is a TorchScript model, skipping int8 candidates")
+        include_quantize = False
+    quantize_options = [False, True] if include_quantize else [False]
+    return [
+        CPUExecutionConfig(
+            num_threads=t,
+            channels_last=cl,
+            bf16=bf16,
+            freeze=freeze,
+            quantize=q
+        )
+        for t, cl, bf16, freeze, q in itertools.product(
+            threads, [False, True], bf16_options, [False, True], quantize_options
+        )
+    ]
+
+
+def benchmark_config(
+    model_path: str,
+    config: CPUExecutionConfig,
+    batch_size: int,
+    input_shape: Sequence[int] = (3, 224, 224),
+    iterations: int = 30,
+    warmup: int = 5
+) -> TuningResult:
+    """Measure per-batch latency of one configuration"""
+    try:
+        worker = InferenceWorker(
+            model_path,
+            device="cpu",
+            max_batch_size=batch_size,
+            cpu_config=config,
+            input_shape=tuple(input_shape)
+        )
+        inputs = [np.random.randn(*input_shape).astype(np.float32) for _ in range(batch_size)]
+        for _ in range(warmup):
+            worker.predict(inputs)
+
+        latencies = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            worker.predict(inputs)
+            latencies.append((time.perf_counter() - start) * 1000)
+    except Exception as e:
+        logging.warning(f"Config {config} failed: {e}")
+        return TuningResult(config, batch_size, float("inf"), float("inf"), 0.0, error=str(e))
+
+    p50, p99 = np.percentile(latencies, [50, 99])
+    throughput = batch_size * 1000 / float(np.mean(latencies))
+    return TuningResult(config, batch_size, float(p50), float(p99), throughput)
+
+
+def tune(
+    model_path: str,
+    batch_size: int,
+    configs: Optional[Sequence[CPUExecutionConfig]] = None,
+    **kwargs
+) -> List[TuningResult]:
+    """Benchmark all candidate configs, fastest (highest throughput) first"""
+    default_threads = torch.get_num_threads()
+    results = []
+    try:
+        for config in configs or candidate_configs(model_path=model_path):
+            result = benchmark_config(model_path, config, batch_size, **kwargs)
+            logging.info(
+                f"{config}: p50={result.p50_ms:.2f}ms p99={result.p99_ms:.2f}ms "
+                f"throughput={result.throughput:.1f}/s"
+            )
+            results.append(result)
+    finally:
+        # num_threads is process-global, don't leak the last candidate's setting
+        torch.set_num_threads(default_threads)
+    return sorted(results, key=lambda r: r.throughput, reverse=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--threads", type=int, nargs="*", help="Thread counts to try")
+    parser.add_argument("--no-quantize", action="store_true", help="Skip int8 candidates")
+    parser.add_argument("--output", help="Write the winning config as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    results = tune(
+        args.model,
+        args.batch_size,
+        configs=candidate_configs(args.threads, include_quantize=not args.no_quantize, model_path=args.model),
+        iterations=args.iterations
+    )
+
+    print("\nCPU Tuning Results")
+    print("==================")
+    for r in results:
+        status = f"error: {r.error}" if r.error else (
+            f"p50={r.p50_ms:8.2f}ms p99={r.p99_ms:8.2f}ms {r.throughput:10.1f} samples/s"
+        )
+        print(f"{r.config}  {status}")
+
+    best = results[0]
+    print(f"\nFastest for batch size {args.batch_size}: {best.config}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(best.config.to_dict(), f, indent=2)
@@ -0,0 +1,130 @@
+import re
+import numpy as np
+from dataclasses import dataclass, asdict, field
+from typing import Dict, Any, List, Optional
+
+# Aggregates over a whole series; pNN is any percentile (p50, p95, p99.9, ...)
+SCALAR_AGGREGATES = ('max', 'min', 'mean')
+ROLLING_AGGREGATES = ('rolling_mean', 'rolling_max', 'rolling_min')
+PERCENTILE = re.compile(r'^p(\d+(?:\.\d+)?)$')
+OPS = ('gt', 'lt')
+
+DEFAULT_WINDOW = 30  # frames
+
+
+@dataclass
+class Rule:
+    """Threshold on an aggregate of one metric; violated when value `op` threshold"""
+    metric: str
+    threshold: float
+    aggregate: str = 'max'
+    op: str = 'gt'  # 'gt': must stay <= threshold, 'lt': must stay >= threshold
+    window: int = DEFAULT_WINDOW
+
+    def __post_init__(self):
+        # Anything but 'lt' would otherwise silently be treated as 'gt'
+        if self.op not in OPS:
+            raise ValueError(f"Unknown op '{self.op}' for metric '{self.metric}', expected one of {OPS}")
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Rule":
+        return cls(**{k: v for k, v in data.items() if k in cls.__dataclass_fields__})
+
+
+@dataclass
+class RuleResult:
+    metric: str
+    aggregate: str
+    threshold: float
+    value: Optional[float]
+    passed: bool
+    violations: int = 0  # violating frames, or windows for rolling aggregates
+    first_violation_frame: Optional[int] = None
+
+
+@dataclass
+class EvaluationReport:
+    passed: bool
+    rules: List[RuleResult] = field(default_factory=list)
+
+    @property
+    def first_violation_frame(self) -> Optional[int]:
+        frames = [r.first_violation_frame for r in self.rules if r.first_violation_frame is not None]
+        return min(frames) if frames else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "passed": self.passed,
+            "first_violation_frame": self.first_violation_frame,
+            "rules": [asdict(r) for r in self.rules]
+        }
+
+
+def _violates(values, threshold: float, op: str):
+    return values < threshold if op == 'lt' else values > threshold
+
+
+def rolling(series: np.ndarray, window: int, how: str) -> np.ndarray:
+    """Aggregate over every full window; value i covers frames [i, i + window)"""
+    window = max(1, min(window, len(series)))
+    if how == 'mean':
+        # O(n) via prefix sums, float64 to keep long series accurate
+        csum = np.cumsum(series, dtype=np.float64)
+        csum = np.concatenate(([0.0], csum))
+        return (csum[window:] - csum[:-window]) / window
+    view = np.lib.stride_tricks.sliding_window_view(series, window)
+    return view.max(axis=1) if how == 'max' else view.min(axis=1)
+
+
+def evaluate_series(series: Dict[str, np.ndarray], rules: List[Rule]) -> EvaluationReport:
+    """
+    Evaluate threshold rules over per-frame metric series.
+
+    Every aggregate is a single vectorized pass over the array; all percentile
+    rules on one metric share one np.percentile call. A rule on a metric that
+    produced no samples passes with value None.
+    """
+    percentiles: Dict[str, Dict[float, float]] = {}
+    for metric in {r.metric for r in rules if PERCENTILE.match(r.aggregate)}:
+        data = series.get(metric)
+        if data is None or len(data) == 0:
+            continue
+        qs = sorted({float(PERCENTILE.match(r.aggregate).group(1)) for r in rules
+                     if r.metric == metric and PERCENTILE.match(r.aggregate)})
+        percentiles[metric] = dict(zip(qs, np.percentile(data, qs)))
+
+    results = []
+    for rule in rules:
+        data = series.get(rule.metric)
+        if data is None or len(data) == 0:
+            results.append(RuleResult(rule.metric, rule.aggregate, rule.threshold, None, True))
+            continue
+        data = np.asarray(data)
+
+        if rule.aggregate in ROLLING_AGGREGATES:
+            values = rolling(data, rule.window, rule.aggregate.split('_', 1)[1])
+            mask = _violates(values, rule.threshold, rule.op)
+            value = values.min() if rule.op == 'lt' else values.max()
+            # Report the frame that closes the first violating window
+            offset = max(1, min(rule.window, len(data))) - 1
+        else:
+            match = PERCENTILE.match(rule.aggregate)
+            if match:
+                value = percentiles[rule.metric][float(match.group(1))]
+            elif rule.aggregate in SCALAR_AGGREGATES:
+                value = getattr(np, rule.aggregate)(data)
+            else:
+                raise ValueError(f"Unknown aggregate '{rule.aggregate}' for metric '{rule.metric}'")
+            mask = _violates(data, rule.threshold, rule.op)
+            offset = 0
+
+        passed = not bool(_violates(value, rule.threshold, rule.op))
+        violations = int(np.count_nonzero(mask))
+        first = None
+        if not passed and violations:
+            first = int(np.argmax(mask)) + offset
+        results.append(RuleResult(
+            rule.metric, rule.aggregate, rule.threshold, float(value), passed, violations, first
+        ))
+
+    return EvaluationReport(all(r.passed for r in results), results)
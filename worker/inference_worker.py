@@ -1,10 +1,16 @@
+import bisect
+import logging
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, asdict
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
 import torch
 import torch.nn as nn
-from typing import Dict, Any, List
-import numpy as np
 from prometheus_client import Counter, Histogram, Gauge
-import time
-import logging
+
+from model_cache import ModelArtifactCache, load_eager
 
 # Prometheus metrics
 INFERENCE_REQUESTS = Counter(
@@ -29,6 +35,43 @@ GPU_UTILIZATION = Gauge(
     'GPU utilization percentage',
     ['device_id']
 )
+WARMUP_FIRST_REQUEST_LATENCY = Gauge(
+    'inference_warmup_first_request_latency_seconds',
+    'Latency of the first request after warmup, per batch bucket',
+    ['model_name', 'bucket']
+)
+STARTUP_SECONDS = Gauge(
+    'inference_worker_startup_seconds',
+    'Worker cold start time by phase (import, load, optimize, warmup)',
+    ['model_name', 'phase']
+)
+
+DEFAULT_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32)
+
+@dataclass(frozen=True)
+class CPUExecutionConfig:
+    """Tuning knobs applied when the worker runs on CPU-only nodes"""
+    num_threads: Optional[int] = None  # None keeps torch's default
+    channels_last: bool = True
+    bf16: bool = False  # Only honoured if the CPU has native bf16 support
+    freeze: bool = True  # Trace + freeze into an optimized TorchScript graph
+    quantize: bool = False  # Dynamic int8 quantization of Linear/LSTM layers
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CPUExecutionConfig":
+        return cls(**{k: v for k, v in data.items() if k in cls.__dataclass_fields__})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def cpu_supports_bf16() -> bool:
+    """Whether oneDNN can run bfloat16 kernels natively on this CPU"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
 
 class InferenceWorker:
     def __init__(
@@ -36,64 +79,208 @@ class InferenceWorker:
         model_path: str,
         device: str = "cuda",
         max_batch_size: int = 32,
-        timeout_ms: int = 100
+        timeout_ms: int = 100,
+        cpu_config: Optional[CPUExecutionConfig] = None,
+        input_shape: Tuple[int, ...] = (3, 224, 224),
+        batch_buckets: Sequence[int] = DEFAULT_BATCH_BUCKETS,
+        pad_to_bucket: bool = True,
+        cache_dir: Optional[str] = None
     ):
         self.device = torch.device(device if torch.cuda.is_available() else "cpu")
-        self.model = self._load_model(model_path)
-        self.model.to(self.device)
-        self.model.eval()
+        self.execution_mode = "cpu" if self.device.type == "cpu" else "cuda"
+        self.cpu_config = cpu_config or CPUExecutionConfig()
+        self.input_shape = tuple(input_shape)
+        self.use_bf16 = (
+            self.execution_mode == "cpu"
+            and self.cpu_config.bf16
+            and cpu_supports_bf16()
+        )
         self.max_batch_size = max_batch_size
         self.timeout_ms = timeout_ms
+        # Fixed batch shapes keep allocator/JIT caches hot; max_batch_size is always a bucket
+        self.batch_buckets = sorted({b for b in batch_buckets if 0 < b < max_batch_size} | {max_batch_size})
+        self.pad_to_bucket = pad_to_bucket
+        self.first_request_ms: Dict[int, float] = {}
+        self.startup_timings: Dict[str, float] = {}
         self.model_name = model_path.split("/")[-1]
+        self.cache = ModelArtifactCache(cache_dir) if cache_dir else None
+
+        # Load (from the artifact cache when possible)
+        phase_start = time.perf_counter()
+        cache_key = None
+        model = None
+        if self.cache:
+            cache_key = self.cache.key(model_path, self._artifact_config())
+            model = self.cache.load(cache_key, map_location=self.device)
+        cache_hit = model is not None
+        if not cache_hit:
+            model = self._load_model(model_path)
+        model.to(self.device)
+        model.eval()
+        self.record_startup_phase("load", time.perf_counter() - phase_start)
+
+        # Optimize; cached artifacts are already quantized/frozen
+        phase_start = time.perf_counter()
+        if self.execution_mode == "cpu":
+            if self.cpu_config.num_threads:
+                torch.set_num_threads(self.cpu_config.num_threads)
+            if not cache_hit:
+                model = self._optimize_for_cpu(model)
+        if self.cache and not cache_hit:
+            self.cache.store(cache_key, model)
+        if self.execution_mode == "cpu" and self.cpu_config.freeze:
+            # Prepacked oneDNN weights do not serialize, so this step always runs after the cache
+            model = self._optimize_frozen(model)
+        self.model = model
+        self.record_startup_phase("optimize", time.perf_counter() - phase_start)
         
-        logging.info(f"Loaded model {self.model_name} on {self.device}")
+        logging.info(
+            f"Loaded model {self.model_name} on {self.device} ({self.execution_mode} mode, "
+            f"artifact cache {'hit' if cache_hit else 'miss' if self.cache else 'disabled'})"
+        )
+
+    def record_startup_phase(self, phase: str, seconds: float):
+        """Record one cold start phase (import, load, optimize, warmup)"""
+        self.startup_timings[phase] = seconds
+        STARTUP_SECONDS.labels(model_name=self.model_name, phase=phase).set(seconds)
+
+    def _artifact_config(self) -> Dict[str, Any]:
+        """Everything that changes the optimized artifact, used in the cache key"""
+        config = {
+            "execution_mode": self.execution_mode,
+            "input_shape": list(self.input_shape)
+        }
+        if self.execution_mode == "cpu":
+            config["cpu_config"] = self.cpu_config.to_dict()
+            config["bf16"] = self.use_bf16
+        return config
     
     def _load_model(self, model_path: str) -> nn.Module:
         """Load PyTorch model with JIT optimization if available"""
         try:
             # Try loading as TorchScript first
-            model = torch.jit.load(model_path)
+            model = torch.jit.load(model_path, map_location=self.device)
             logging.info("Loaded TorchScript model")
         except:
             # Fall back to regular PyTorch model
             try:
-                model = torch.load(model_path)
+                model = load_eager(model_path, map_location=self.device)
                 logging.info("Loaded PyTorch model")
             except Exception as e:
                 logging.warning(f"Failed to load model from path, using dummy ResNet50 for demo: {e}")
+                # torchvision is only imported on this path, keeping it out of normal cold starts
                 from torchvision.models import resnet50
                 model = resnet50()
         return model
+
+    def _optimize_for_cpu(self, model: nn.Module) -> nn.Module:
+        """Apply the CPU execution config: quantization, layout, graph freeze"""
+        cfg = self.cpu_config
+        if cfg.quantize and isinstance(model, torch.jit.ScriptModule):
+            # Dynamic quantization only rewrites eager modules
+            logging.warning(f"quantize=True ignored for TorchScript model {self.model_name}, running it in fp32")
+        elif cfg.quantize:
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {nn.Linear, nn.LSTM}, dtype=torch.qint8
+            )
+        if cfg.channels_last and len(self.input_shape) == 3:
+            model = model.to(memory_format=torch.channels_last)
+        if cfg.freeze:
+            model = self._freeze(model)
+        logging.info(f"CPU execution config: {cfg.to_dict()} (bf16 active: {self.use_bf16})")
+        return model
+
+    def _freeze(self, model: nn.Module) -> nn.Module:
+        """Trace (if eager) and freeze the model so constant weights get folded"""
+        example = self._prepare_batch(torch.randn(1, *self.input_shape, device=self.device))
+        try:
+            with torch.no_grad(), self._autocast():
+                if not isinstance(model, torch.jit.ScriptModule):
+                    model = torch.jit.trace(model, example, check_trace=False)
+                model = torch.jit.freeze(model)
+        except Exception as e:
+            logging.warning(f"Graph freeze failed, running unfrozen model: {e}")
+        return model
+
+    def _optimize_frozen(self, model: nn.Module) -> nn.Module:
+        """Fuse ops and prepack weights for oneDNN on a frozen TorchScript graph"""
+        if not isinstance(model, torch.jit.ScriptModule):
+            return model
+        try:
+            return torch.jit.optimize_for_inference(model)
+        except Exception as e:
+            logging.warning(f"optimize_for_inference failed, running frozen graph as is: {e}")
+            return model
+
+    def _autocast(self):
+        """Mixed precision context for the current execution mode"""
+        if self.execution_mode == "cuda":
+            return torch.autocast(device_type="cuda", dtype=torch.float16)
+        if self.use_bf16:
+            return torch.autocast(device_type="cpu", dtype=torch.bfloat16)
+        return nullcontext()
+
+    def _prepare_batch(self, batch: torch.Tensor) -> torch.Tensor:
+        if self.execution_mode == "cpu" and self.cpu_config.channels_last and batch.dim() == 4:
+            return batch.contiguous(memory_format=torch.channels_last)
+        return batch
+
+    @staticmethod
+    def _to_numpy(tensor: torch.Tensor) -> np.ndarray:
+        # numpy has no bfloat16, upcast before leaving torch
+        if tensor.dtype == torch.bfloat16:
+            tensor = tensor.float()
+        return tensor.cpu().numpy()
     
+    def _bucket_for(self, n: int) -> int:
+        """Smallest configured batch bucket that fits n samples"""
+        idx = bisect.bisect_left(self.batch_buckets, n)
+        return self.batch_buckets[min(idx, len(self.batch_buckets) - 1)]
+
+    def _run_batch(self, inputs: List[np.ndarray]) -> List[Any]:
+        """Run one forward pass, padding the batch up to its shape bucket"""
+        n = len(inputs)
+        padded = self._bucket_for(n) if self.pad_to_bucket else n
+
+        # Assuming inputs are already preprocessed numpy arrays of correct shape
+        # For demo, if input is not valid, we generate random
+        if inputs and inputs[0] is None:
+            batch = torch.randn(padded, *self.input_shape, device=self.device)
+        else:
+            array = np.stack(inputs)
+            if padded > n:
+                pad = np.zeros((padded - n,) + array.shape[1:], dtype=array.dtype)
+                array = np.concatenate([array, pad])
+            batch = torch.tensor(
+                array,
+                dtype=torch.float32,
+                device=self.device
+            )
+
+        batch = self._prepare_batch(batch)
+
+        # Run inference
+        with self._autocast():  # Mixed precision (fp16 on GPU, bf16 on capable CPUs)
+            outputs = self.model(batch)
+
+        # Process outputs, dropping the padding rows
+        if isinstance(outputs, torch.Tensor):
+            return self._to_numpy(outputs)[:n].tolist()
+        return [self._to_numpy(o)[:n].tolist() for o in outputs]
+
     @torch.inference_mode()
     def predict(self, inputs: List[np.ndarray]) -> List[Dict[str, Any]]:
         """Run batch inference with metrics collection"""
         start_time = time.perf_counter()
         
         try:
-            # Convert inputs to tensor
-            # Assuming inputs are already preprocessed numpy arrays of correct shape
-            # For demo, if input is not valid, we generate random
-            if inputs and inputs[0] is None:
-                 batch = torch.randn(len(inputs), 3, 224, 224, device=self.device)
-            else:
-                batch = torch.tensor(
-                    np.stack(inputs), 
-                    dtype=torch.float32,
-                    device=self.device
-                )
-            
             BATCH_SIZE.labels(model_name=self.model_name).observe(len(inputs))
-            
-            # Run inference
-            with torch.cuda.amp.autocast(enabled=True):  # Mixed precision
-                outputs = self.model(batch)
-            
-            # Process outputs
-            if isinstance(outputs, torch.Tensor):
-                results = outputs.cpu().numpy().tolist()
-            else:
-                results = [o.cpu().numpy().tolist() for o in outputs]
+
+            # Batches larger than the biggest bucket are split into bucket-sized chunks
+            step = self.batch_buckets[-1]
+            results = []
+            for i in range(0, len(inputs), step):
+                results.extend(self._run_batch(inputs[i:i + step]))
             
             # Record metrics
             latency = time.perf_counter() - start_time
@@ -122,12 +309,29 @@ class InferenceWorker:
             logging.error(f"Inference error: {e}")
             raise
     
-    def warmup(self, sample_input: np.ndarray = None, iterations: int = 10):
-        """Warmup model for consistent latency"""
-        logging.info(f"Warming up model with {iterations} iterations...")
+    def warmup(self, sample_input: np.ndarray = None, iterations: int = 3) -> Dict[int, float]:
+        """
+        Warmup every batch bucket, then time the first request after warmup per bucket (ms).
+        A single probe, not a percentile: enough samples for a p99 would multiply the cold start.
+        """
+        logging.info(
+            f"Warming up model on buckets {self.batch_buckets} with {iterations} iterations each..."
+        )
+        warmup_start = time.perf_counter()
         if sample_input is None:
-             sample_input = np.random.randn(3, 224, 224).astype(np.float32)
-             
-        for _ in range(iterations):
-            self.predict([sample_input])
-        logging.info("Warmup complete")
+             sample_input = np.random.randn(*self.input_shape).astype(np.float32)
+
+        for bucket in self.batch_buckets:
+            batch = [sample_input] * bucket
+            for _ in range(iterations):
+                self.predict(batch)
+
+            start = time.perf_counter()
+            self.predict(batch)
+            latency = time.perf_counter() - start
+            WARMUP_FIRST_REQUEST_LATENCY.labels(model_name=self.model_name, bucket=str(bucket)).set(latency)
+            self.first_request_ms[bucket] = latency * 1000
+
+        self.record_startup_phase("warmup", time.perf_counter() - warmup_start)
+        logging.info(f"Warmup complete, first request latency (ms) per bucket: {self.first_request_ms}")
+        return self.first_request_ms
@@ -1,65 +1,197 @@
+import time
+
+_IMPORT_START = time.perf_counter()
+
 import os
 import json
-import time
 import logging
+import socket
 import redis
 import numpy as np
+import torch
 from prometheus_client import start_http_server
+from opentelemetry import trace, propagate
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.resources import Resource
+from ai_jobs.blob_store import create_blob_store
+from ai_jobs.fair_share import WorkerResources
+from ai_jobs.job_queue import WorkerJobQueue
 
-from inference_worker import InferenceWorker
+from inference_worker import InferenceWorker, CPUExecutionConfig
+from prefetch import AdaptivePrefetch, ServiceTimeEstimator
+
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_START
 
 # Config
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 MODEL_PATH = os.getenv("MODEL_PATH", "/models/resnet50.pt")
 DEVICE = os.getenv("DEVICE", "cuda")
-QUEUE_KEY = "ai_jobs:processing" # Simplified for demo, should pop from queue
+# CPU execution mode (used when DEVICE=cpu or no GPU is present)
+CPU_CONFIG_PATH = os.getenv("CPU_CONFIG_PATH")  # JSON written by cpu_tuning.py
+CPU_NUM_THREADS = int(os.getenv("CPU_NUM_THREADS", "0")) or None
+CPU_CHANNELS_LAST = os.getenv("CPU_CHANNELS_LAST", "true").lower() == "true"
+CPU_BF16 = os.getenv("CPU_BF16", "false").lower() == "true"
+CPU_FREEZE = os.getenv("CPU_FREEZE", "true").lower() == "true"
+CPU_QUANTIZE = os.getenv("CPU_QUANTIZE", "false").lower() == "true"
+# Batch shape buckets warmed up at startup; incoming batches are padded to the nearest one
+BATCH_BUCKETS = [int(b) for b in os.getenv("BATCH_BUCKETS", "1,2,4,8,16,32").split(",") if b.strip()]
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "32"))
+# Passes per bucket before its first timed request; every pass costs a full forward at that batch size
+WARMUP_ITERATIONS = int(os.getenv("WARMUP_ITERATIONS", "3"))
+# Node-local cache of optimized model artifacts (empty string disables it)
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", "/var/cache/ai-worker/models")
+# Large results are offloaded here (shared with the job-service, empty disables it)
+RESULT_STORE_URL = os.getenv("RESULT_STORE_URL", "file:///var/lib/ai-jobs/results")
+RESULT_OFFLOAD_THRESHOLD_BYTES = int(os.getenv("RESULT_OFFLOAD_THRESHOLD_BYTES", str(64 * 1024)))
+# Trace export (empty disables it); spans join the submitting API request's trace
+OTLP_ENDPOINT = os.getenv("OTLP_ENDPOINT", "http://jaeger:4317")
+# Advertised on every dequeue; only jobs whose resource class fits are handed out
+WORKER_ID = os.getenv("WORKER_ID", socket.gethostname())
+WORKER_GPUS = int(os.getenv("WORKER_GPUS", str(torch.cuda.device_count() if DEVICE == "cuda" else 0)))
+WORKER_CPU_MILLIS = int(os.getenv("WORKER_CPU_MILLIS", str((os.cpu_count() or 1) * 1000)))
+WORKER_MEMORY_MB = int(os.getenv("WORKER_MEMORY_MB", str(
+    os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2 ** 20
+)))
+# Prefetch as many jobs as finish within this many seconds (by measured service time)
+PREFETCH_LATENCY_TARGET_SEC = float(os.getenv("PREFETCH_LATENCY_TARGET_SEC", "2.0"))
+MAX_PREFETCH = int(os.getenv("MAX_PREFETCH", "32"))
+# A prefetched job not finished within this many seconds is redelivered; a running job's
+# lease is renewed every LEASE_HEARTBEAT_SEC (a third of the lease by default)
+WORKER_LEASE_SEC = int(os.getenv("WORKER_LEASE_SEC", "600"))
+LEASE_HEARTBEAT_SEC = float(os.getenv("LEASE_HEARTBEAT_SEC", str(WORKER_LEASE_SEC / 3)))
+LEASE_REAP_INTERVAL_SEC = float(os.getenv("LEASE_REAP_INTERVAL_SEC", "30"))
+WORKER_JOB_TYPES = tuple(t.strip() for t in os.getenv("WORKER_JOB_TYPES", "inference").split(",") if t.strip())
 
 logging.basicConfig(level=logging.INFO)
 
+def setup_tracing():
+    trace.set_tracer_provider(TracerProvider(resource=Resource.create(attributes={"service.name": "ai-job-worker"})))
+    if OTLP_ENDPOINT:
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter(endpoint=OTLP_ENDPOINT, insecure=True)
+        trace.get_tracer_provider().add_span_processor(BatchSpanProcessor(exporter))
+    return trace.get_tracer(__name__)
+
+def load_cpu_config() -> CPUExecutionConfig:
+    if CPU_CONFIG_PATH:
+        with open(CPU_CONFIG_PATH) as f:
+            return CPUExecutionConfig.from_dict(json.load(f))
+    return CPUExecutionConfig(
+        num_threads=CPU_NUM_THREADS,
+        channels_last=CPU_CHANNELS_LAST,
+        bf16=CPU_BF16,
+        freeze=CPU_FREEZE,
+        quantize=CPU_QUANTIZE
+    )
+
 def main():
     # Start Prometheus server
     start_http_server(8081)
     
     # Init Worker
-    worker = InferenceWorker(MODEL_PATH, DEVICE)
-    worker.warmup()
-    
-    # Redis
-    r = redis.from_url(REDIS_URL)
+    worker = InferenceWorker(
+        MODEL_PATH,
+        DEVICE,
+        max_batch_size=MAX_BATCH_SIZE,
+        cpu_config=load_cpu_config(),
+        batch_buckets=BATCH_BUCKETS,
+        cache_dir=MODEL_CACHE_DIR or None
+    )
+    worker.record_startup_phase("import", IMPORT_SECONDS)
+    worker.warmup(iterations=WARMUP_ITERATIONS)
+    logging.info(f"Startup breakdown (s): {worker.startup_timings}")
     
-    logging.info("Worker started, listening for jobs...")
+    tracer = setup_tracing()
+    queue = WorkerJobQueue(
+        redis.from_url(REDIS_URL),
+        blob_store=create_blob_store(RESULT_STORE_URL) if RESULT_STORE_URL else None,
+        offload_threshold=RESULT_OFFLOAD_THRESHOLD_BYTES,
+        lease_seconds=WORKER_LEASE_SEC
+    )
     
-    # Simplified loop using BLPOP or similar from a queue
-    # The Architecture describes a RedisJobQueue class, but usage here implies 
-    # we need to pop from 'ai_jobs:queue:{priority}' or rely on the queue logic.
-    # For this demo, let's assume we pull from a simplified list key.
+    resources = WorkerResources(
+        gpus=WORKER_GPUS,
+        cpu_millis=WORKER_CPU_MILLIS,
+        memory_mb=WORKER_MEMORY_MB,
+        job_types=WORKER_JOB_TYPES
+    )
+    estimator = ServiceTimeEstimator()
+    prefetch = AdaptivePrefetch(
+        estimator, PREFETCH_LATENCY_TARGET_SEC, job_types=WORKER_JOB_TYPES, max_count=MAX_PREFETCH
+    )
+    logging.info(f"Worker {WORKER_ID} started with {resources}, listening for jobs...")
     
+    next_reap = 0.0
     while True:
         try:
-            # Simple demo polling, real one would use the sophisticated queue class
-            # or BLPOP on multiple priority keys.
-            # Here we just look for 'ai_jobs:queue:50'
-            job_data_raw = r.rpop("ai_jobs:queue:50") 
-            
-            if job_data_raw:
-                job_id = job_data_raw.decode('utf-8')
-                logging.info(f"Processing job {job_id}")
-                
-                # simulate fetching payload etc
-                # inputs = fetch_inputs(job_id)
-                fake_inputs = [np.random.randn(3, 224, 224).astype(np.float32)]
-                
-                results = worker.predict(fake_inputs)
-                
-                logging.info(f"Job {job_id} completed: {results}")
-                # Mark complete in Redis...
-                
-            else:
+            # Requeue jobs prefetched by workers that died before finishing them
+            if time.monotonic() >= next_reap:
+                queue.reap_expired()
+                next_reap = time.monotonic() + LEASE_REAP_INTERVAL_SEC
+            jobs = queue.dequeue(prefetch.count(), resources=resources, worker_id=WORKER_ID)
+            if not jobs:
                 time.sleep(0.1)
-                
+                continue
         except Exception as e:
             logging.error(f"Error in worker loop: {e}")
             time.sleep(1)
+            continue
+
+        # Prefetched jobs are already marked running, work through all of them
+        for job in jobs:
+            try:
+                if not queue.renew(job):
+                    logging.warning(f"Lease of job {job.job_id} expired while prefetched, skipping it")
+                    continue
+            except Exception as e:
+                logging.error(f"Could not renew the lease of job {job.job_id}: {e}")
+            with queue.keep_lease(job, LEASE_HEARTBEAT_SEC):
+                parent = propagate.extract(job.trace_context)
+                with tracer.start_as_current_span("process_job", context=parent, kind=trace.SpanKind.CONSUMER) as span:
+                    span.set_attribute("job.id", job.job_id)
+                    span.set_attribute("job.type", job.job_type)
+                    span.set_attribute("job.retry_count", job.retry_count)
+                    if job.task_index >= 0:
+                        span.set_attribute("job.task_index", job.task_index)
+                    logging.info(f"Processing job {job.job_id}")
+                    started = time.perf_counter()
+                    try:
+                        # simulate fetching payload etc
+                        # inputs = fetch_inputs(job.payload)
+                        fake_inputs = [np.random.randn(3, 224, 224).astype(np.float32)]
+                
+                        results = worker.predict(fake_inputs)
+                        latency_ms = results[0]["latency_ms"] if results else 0.0
+                        summary = {
+                            "predictions": [int(np.argmax(r["prediction"])) for r in results],
+                            "latency_ms": latency_ms
+                        }
+                        # Synced to the job_metrics table by the job-service status sync
+                        metrics = {
+                            "latency_p50_ms": latency_ms,
+                            "latency_p95_ms": latency_ms,
+                            "latency_p99_ms": latency_ms,
+                            "throughput_rps": len(results) / (latency_ms / 1000) if latency_ms else 0.0
+                        }
+                
+                        with tracer.start_as_current_span("write_back"):
+                            written = queue.complete(job, summary, metrics)
+                        if not written:
+                            # Redelivered meanwhile: its new owner reports the outcome
+                            span.set_attribute("job.lease_lost", True)
+                            continue
+                        # Failed jobs are left out, failing fast would make the type look cheap
+                        estimator.observe(job.job_type, time.perf_counter() - started)
+                        logging.info(f"Job {job.job_id} completed: {summary}")
+                    except Exception as e:
+                        logging.error(f"Job {job.job_id} failed: {e}")
+                        span.record_exception(e)
+                        try:
+                            queue.fail(job, str(e))
+                        except Exception as write_error:
+                            logging.error(f"Could not record failure of job {job.job_id}: {write_error}")
+                        time.sleep(1)
 
 if __name__ == "__main__":
     main()
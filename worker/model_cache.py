@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Any, Dict, Optional
+
+import torch
+import torch.nn as nn
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def load_eager(path: str, map_location: Any = None) -> nn.Module:
+    """torch.load a pickled module, memory-mapping the weights where the format allows it"""
+    try:
+        return torch.load(path, map_location=map_location, mmap=True, weights_only=False)
+    except RuntimeError:
+        # Legacy (non-zipfile) checkpoints cannot be memory-mapped
+        return torch.load(path, map_location=map_location, weights_only=False)
+
+
+class ModelArtifactCache:
+    """
+    Local on-disk cache of optimized, serialized models.
+
+    Artifacts are keyed by the sha256 of the source model file plus the
+    runtime config (device, execution config, input shape) and the torch
+    version, so any change to the model or the way it is optimized produces
+    a new entry. TorchScript artifacts are stored as .ts, eager modules
+    (e.g. dynamically quantized ones) as .pt and loaded memory-mapped.
+
+    Only .pt artifacts are memory-mapped: torch.jit.load has no mmap mode and
+    reads the whole archive into memory. That covers the default freeze=True
+    config, whose artifact is a frozen graph. Its weights are folded
+    constants that freezing and optimize_for_inference rewrite anyway, so
+    mapping them would not share pages between workers. Such a load costs
+    the artifact's size in reads, and no tracing or freezing.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.sources_dir = os.path.join(cache_dir, "sources")
+        os.makedirs(self.sources_dir, exist_ok=True)
+
+    def source_digest(self, model_path: str) -> str:
+        """sha256 of the source file, memoized by (size, mtime) so restarts skip rehashing"""
+        try:
+            stat = os.stat(model_path)
+        except OSError:
+            # No source file, the worker will build the fallback model
+            return f"missing:{model_path}"
+
+        memo_path = os.path.join(
+            self.sources_dir,
+            hashlib.sha1(os.path.abspath(model_path).encode()).hexdigest() + ".json"
+        )
+        try:
+            with open(memo_path) as f:
+                memo = json.load(f)
+            if memo["size"] == stat.st_size and memo["mtime_ns"] == stat.st_mtime_ns:
+                return memo["sha256"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        digest = hashlib.sha256()
+        with open(model_path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+                digest.update(chunk)
+        sha256 = digest.hexdigest()
+        self._write_atomic(memo_path, json.dumps({
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": sha256
+        }).encode())
+        return sha256
+
+    def key(self, model_path: str, runtime_config: Dict[str, Any]) -> str:
+        material = json.dumps({
+            "source": self.source_digest(model_path),
+            "config": runtime_config,
+            "torch": torch.__version__
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def load(self, key: str, map_location: Any = None) -> Optional[nn.Module]:
+        """Return the cached artifact for key, or None on a miss"""
+        script_path = self._path(key, ".ts")
+        eager_path = self._path(key, ".pt")
+        try:
+            if os.path.exists(script_path):
+                # Read in full, TorchScript archives cannot be memory-mapped
+                return torch.jit.load(script_path, map_location=map_location)
+            if os.path.exists(eager_path):
+                return load_eager(eager_path, map_location=map_location)
+        except Exception as e:
+            logging.warning(f"Discarding unreadable model artifact {key}: {e}")
+            for path in (script_path, eager_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        return None
+
+    def store(self, key: str, model: nn.Module) -> Optional[str]:
+        """Serialize model under key; failures are logged, never fatal"""
+        is_script = isinstance(model, torch.jit.ScriptModule)
+        path = self._path(key, ".ts" if is_script else ".pt")
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            if is_script:
+                torch.jit.save(model, tmp_path)
+            else:
+                torch.save(model, tmp_path)
+            os.replace(tmp_path, path)
+            return path
+        except Exception as e:
+            logging.warning(f"Failed to cache model artifact {key}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def _write_atomic(self, path: str, data: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
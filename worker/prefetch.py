@@ -0,0 +1,75 @@
+"""
+Adaptive prefetch: dequeue as many jobs as can be finished within a latency target.
+
+Service time is estimated online per job type with an EWMA of the measured
+processing time. A worker processes its prefetched batch one job at a time,
+so the last job of a batch of n finishes after about n * service_time;
+n = latency_target / service_time keeps that within the target. Slow job
+types shrink the batch to 1, fast ones grow it up to max_count, and until a
+first job has been measured the worker takes one job at a time.
+
+Prefetched jobs are already marked running. If the worker dies, each of
+them stays claimed until its lease (WORKER_LEASE_SEC, renewed when the job
+starts) expires and a reaper requeues it, so a crash delays up to
+max_count jobs by at most one lease period. Requeued jobs may run twice.
+"""
+import math
+from typing import Dict, Iterable, Optional
+
+from prometheus_client import Gauge
+
+SERVICE_TIME_EWMA = Gauge(
+    'worker_service_time_ewma_seconds',
+    'Smoothed per-job processing time used to size the prefetch',
+    ['job_type']
+)
+PREFETCH_COUNT = Gauge(
+    'worker_prefetch_count',
+    'Jobs requested by the latest dequeue'
+)
+
+
+class ServiceTimeEstimator:
+    """EWMA of the processing time per job type"""
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.estimates: Dict[str, float] = {}
+
+    def observe(self, job_type: str, seconds: float):
+        previous = self.estimates.get(job_type)
+        estimate = seconds if previous is None else self.alpha * seconds + (1 - self.alpha) * previous
+        self.estimates[job_type] = estimate
+        SERVICE_TIME_EWMA.labels(job_type=job_type).set(estimate)
+
+    def estimate(self, job_type: str) -> Optional[float]:
+        return self.estimates.get(job_type)
+
+
+class AdaptivePrefetch:
+
+    def __init__(
+        self,
+        estimator: ServiceTimeEstimator,
+        latency_target: float,
+        job_types: Iterable[str] = (),
+        max_count: int = 32
+    ):
+        self.estimator = estimator
+        self.latency_target = latency_target
+        self.job_types = tuple(job_types)
+        self.max_count = max_count
+
+    def count(self) -> int:
+        """Batch size for the next dequeue, sized for the slowest job type this worker may get"""
+        types = self.job_types or tuple(self.estimator.estimates)
+        # A type not measured yet is measured on its first job, the others bound the batch meanwhile
+        estimates = [e for e in (self.estimator.estimate(t) for t in types) if e is not None]
+        if not estimates:
+            count = 1
+        else:
+            slowest = max(estimates)
+            count = self.max_count if slowest <= 0 else math.floor(self.latency_target / slowest)
+        count = max(1, min(self.max_count, count))
+        PREFETCH_COUNT.set(count)
+        return count
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, Any, Optional
+
+from prometheus_client import Counter, Gauge
+
+SIMULATION_CACHE_REQUESTS = Counter(
+    'simulation_cache_requests_total',
+    'Simulation result cache lookups',
+    ['result']  # hit_disk, hit_redis, miss
+)
+SIMULATION_CACHE_HIT_RATIO = Gauge(
+    'simulation_cache_hit_ratio',
+    'Fraction of simulation result cache lookups served from the cache'
+)
+
+DEFAULT_MAX_DISK_BYTES = 1024 * 1024 * 1024
+DEFAULT_MAX_REDIS_BYTES = 256 * 1024 * 1024
+EVICT_TO_FRACTION = 0.9  # Evict down to 90% of the limit so we don't evict on every put
+
+# KEYS: lru zset, sizes hash, total bytes counter, entry key
+# ARGV: key, data, now, max bytes, evict-to bytes
+# Stores the entry, accounts its size and drops least recently used entries from the accounting in
+# one step, so concurrent workers never see (or leave) a total that disagrees with the LRU. Returns
+# the evicted keys: their entry keys are not known up front, so the caller deletes them.
+PUT_SCRIPT = """
+local key, data = ARGV[1], ARGV[2]
+local size = string.len(data)
+local previous = tonumber(redis.call('HGET', KEYS[2], key) or '0')
+redis.call('SET', KEYS[4], data)
+redis.call('ZADD', KEYS[1], ARGV[3], key)
+redis.call('HSET', KEYS[2], key, size)
+local total = redis.call('INCRBY', KEYS[3], size - previous)
+local evicted = {}
+if total > tonumber(ARGV[4]) then
+  local target = tonumber(ARGV[5])
+  while total > target do
+    local oldest = redis.call('ZPOPMIN', KEYS[1])
+    if #oldest == 0 then
+      break
+    end
+    local freed = tonumber(redis.call('HGET', KEYS[2], oldest[1]) or '0')
+    redis.call('HDEL', KEYS[2], oldest[1])
+    total = redis.call('DECRBY', KEYS[3], freed)
+    table.insert(evicted, oldest[1])
+  end
+end
+return evicted
+"""
+
+
+def canonical_spec_hash(job_spec: Dict[str, Any], worker_version: str) -> str:
+    """sha256 of the spec with sorted keys and no whitespace, salted with the worker version"""
+    canonical = json.dumps(
+        {"spec": job_spec, "worker_version": worker_version},
+        sort_keys=True,
+        separators=(',', ':'),
+        default=str
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed cache of simulation results.
+
+    Lookups go local disk first, then Redis (shared between workers); a Redis
+    hit is written back to disk. Both tiers evict least-recently-used entries
+    once their byte budget is exceeded.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        redis_client=None,
+        max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES,
+        max_redis_bytes: int = DEFAULT_MAX_REDIS_BYTES,
+        key_prefix: str = "sim_cache"
+    ):
+        self.cache_dir = cache_dir
+        self.redis = redis_client
+        self.max_disk_bytes = max_disk_bytes
+        self.max_redis_bytes = max_redis_bytes
+        self.entry_key = key_prefix + ":entry:{key}"
+        self.lru_key = key_prefix + ":lru"
+        self.sizes_key = key_prefix + ":sizes"
+        self.bytes_key = key_prefix + ":bytes"
+        self._put_script = redis_client.register_script(PUT_SCRIPT) if redis_client is not None else None
+        self.hits = 0
+        self.requests = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.disk_bytes = sum(e.stat().st_size for e in self._disk_entries())
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        result, tier = self._get_disk(key), "hit_disk"
+        if result is None and self.redis is not None:
+            result, tier = self._get_redis(key), "hit_redis"
+            if result is not None:
+                self._put_disk(key, json.dumps(result).encode())
+        self._record(tier if result is not None else "miss")
+        return result
+
+    def put(self, key: str, result: Dict[str, Any]):
+        data = json.dumps(result).encode()
+        self._put_disk(key, data)
+        if self.redis is not None:
+            try:
+                self._put_redis(key, data)
+            except Exception as e:
+                logging.warning(f"Failed to write result {key} to Redis cache: {e}")
+
+    @property
+    def hit_ratio(self) -> float:
+        return self.hits / self.requests if self.requests else 0.0
+
+    def _record(self, result: str):
+        self.requests += 1
+        self.hits += result != "miss"
+        SIMULATION_CACHE_REQUESTS.labels(result=result).inc()
+        SIMULATION_CACHE_HIT_RATIO.set(self.hit_ratio)
+
+    # Disk tier: one JSON file per key, mtime doubles as LRU timestamp
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def _disk_entries(self):
+        return [e for e in os.scandir(self.cache_dir) if e.name.endswith(".json")]
+
+    def _get_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                result = json.loads(f.read())
+            os.utime(path)
+            return result
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Dropping unreadable cache entry {key}: {e}")
+            self._remove_disk(path)
+            return None
+
+    def _put_disk(self, key: str, data: bytes):
+        path = self._path(key)
+        previous = os.path.getsize(path) if os.path.exists(path) else 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.disk_bytes += len(data) - previous
+        if self.disk_bytes > self.max_disk_bytes:
+            self._evict_disk()
+
+    def _remove_disk(self, path: str):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            self.disk_bytes -= size
+        except OSError:
+            pass
+
+    def _evict_disk(self):
+        target = self.max_disk_bytes * EVICT_TO_FRACTION
+        for entry in sorted(self._disk_entries(), key=lambda e: e.stat().st_mtime):
+            if self.disk_bytes <= target:
+                break
+            self._remove_disk(entry.path)
+
+    # Redis tier: entry strings + LRU sorted set + per-entry sizes for byte accounting
+
+    def _get_redis(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            data = self.redis.get(self.entry_key.format(key=key))
+            if data is None:
+                return None
+            # XX: an entry evicted but not yet deleted does not rejoin the LRU without a size
+            self.redis.zadd(self.lru_key, {key: time.time()}, xx=True)
+            return json.loads(data)
+        except Exception as e:
+            logging.warning(f"Redis cache lookup failed for {key}: {e}")
+            return None
+
+    def _put_redis(self, key: str, data: bytes):
+        evicted = self._put_script(
+            keys=[self.lru_key, self.sizes_key, self.bytes_key, self.entry_key.format(key=key)],
+            args=[key, data, time.time(), self.max_redis_bytes, int(self.max_redis_bytes * EVICT_TO_FRACTION)]
+        )
+        if evicted:
+            keys = (k.decode() if isinstance(k, bytes) else k for k in evicted)
+            self.redis.delete(*(self.entry_key.format(key=k) for k in keys))
+
+
+def create_result_cache() -> Optional[ResultCache]:
+    """
+    ResultCache configured from the environment, None if SIM_CACHE_DIR is empty.
+    The Redis tier (shared between workers) uses SIM_CACHE_REDIS_URL, falling back to REDIS_URL.
+    """
+    cache_dir = os.getenv("SIM_CACHE_DIR", "/var/cache/ai-worker/simulations")
+    if not cache_dir:
+        return None
+    redis_url = os.getenv("SIM_CACHE_REDIS_URL", os.getenv("REDIS_URL", ""))
+    redis_client = None
+    if redis_url:
+        import redis
+        redis_client = redis.from_url(redis_url)
+    return ResultCache(
+        cache_dir,
+        redis_client=redis_client,
+        max_disk_bytes=int(os.getenv("SIM_CACHE_MAX_DISK_BYTES", str(DEFAULT_MAX_DISK_BYTES))),
+        max_redis_bytes=int(os.getenv("SIM_CACHE_MAX_REDIS_BYTES", str(DEFAULT_MAX_REDIS_BYTES)))
+    )
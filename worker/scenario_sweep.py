@@ -0,0 +1,201 @@
+import copy
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Any, Callable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from sensor_data import DEFAULT_CHUNK_BYTES
+
+DEFAULT_PASS_RATE_WINDOW = 1000
+INFLIGHT_PER_WORKER = 4  # Futures queued per process, bounds parent memory on huge grids
+
+
+def expand_parameter_grid(parameters: Dict[str, List[Any]]) -> Iterator[Dict[str, Any]]:
+    """Lazily yield every combination of {dotted.path: [values]} as an override dict"""
+    if not parameters:
+        yield {}
+        return
+    paths = list(parameters)
+    for values in itertools.product(*(parameters[p] for p in paths)):
+        yield dict(zip(paths, values))
+
+
+def grid_size(parameters: Dict[str, List[Any]]) -> int:
+    size = 1
+    for values in parameters.values():
+        size *= len(values)
+    return size
+
+
+def apply_overrides(base_spec: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a copy of base_spec with dotted paths (e.g. 'sensors.0.count') set"""
+    spec = copy.deepcopy(base_spec)
+    for path, value in overrides.items():
+        node = spec
+        keys = path.split('.')
+        for key in keys[:-1]:
+            if isinstance(node, list):
+                node = node[int(key)]
+            else:
+                node = node.setdefault(key, {})
+        last = keys[-1]
+        if isinstance(node, list):
+            node[int(last)] = value
+        else:
+            node[last] = value
+    return spec
+
+
+def scenario_seed(base_seed: int, index: int) -> int:
+    """Independent, reproducible seed for scenario #index of a sweep"""
+    return int(np.random.SeedSequence(base_seed, spawn_key=(index,)).generate_state(1)[0])
+
+
+class ScenarioStats:
+    """Rolling pass rate plus per-scenario-type running aggregates, O(window + types) memory"""
+
+    def __init__(self, window: int = DEFAULT_PASS_RATE_WINDOW):
+        self.recent = deque(maxlen=window)
+        self.total = 0
+        self.passed = 0
+        self.by_type: Dict[str, Dict[str, Any]] = {}
+
+    def add(self, scenario_type: str, passed: bool, elapsed_sec: float, metrics: Dict[str, float]):
+        self.recent.append(passed)
+        self.total += 1
+        self.passed += passed
+
+        stats = self.by_type.setdefault(scenario_type, {
+            "count": 0, "passed": 0, "mean_elapsed_sec": 0.0, "mean_metrics": {}
+        })
+        stats["count"] += 1
+        stats["passed"] += passed
+        n = stats["count"]
+        # Incremental means so nothing per-scenario has to be kept
+        stats["mean_elapsed_sec"] += (elapsed_sec - stats["mean_elapsed_sec"]) / n
+        means = stats["mean_metrics"]
+        for name, value in metrics.items():
+            means[name] = means.get(name, 0.0) + (value - means.get(name, 0.0)) / n
+
+    @property
+    def rolling_pass_rate(self) -> float:
+        return sum(self.recent) / len(self.recent) if self.recent else 0.0
+
+    @property
+    def pass_rate(self) -> float:
+        return self.passed / self.total if self.total else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "scenarios": self.total,
+            "passed": self.passed,
+            "pass_rate": self.pass_rate,
+            "rolling_pass_rate": self.rolling_pass_rate,
+            "by_scenario_type": {
+                t: dict(s, pass_rate=s["passed"] / s["count"]) for t, s in self.by_type.items()
+            }
+        }
+
+
+# Process pool side: one SimulationWorker per process, created by the pool initializer
+_pool_worker = None
+
+
+def _init_pool_worker(chunk_bytes: int):
+    global _pool_worker
+    from simulation_worker import SimulationWorker
+    _pool_worker = SimulationWorker(chunk_bytes=chunk_bytes)
+
+
+def _run_pool_scenario(task: Tuple[int, Dict[str, Any], Dict[str, Any]]) -> Dict[str, Any]:
+    index, overrides, spec = task
+    try:
+        result = _pool_worker.run_scenario(spec)
+    except Exception as e:
+        # One broken scenario must not abort the whole sweep
+        result = {
+            "status": "error",
+            "error": str(e),
+            "scenario_type": spec.get('scenario', {}).get('type', 'unknown'),
+            "metrics": {},
+            "elapsed_sec": 0.0,
+            "data_processed_mb": 0.0
+        }
+    result["index"] = index
+    result["parameters"] = overrides
+    return result
+
+
+def iter_sweep_tasks(job_spec: Dict[str, Any]) -> Iterator[Tuple[int, Dict[str, Any], Dict[str, Any]]]:
+    """Expand a sweep job spec into (index, overrides, scenario spec) tasks with per-scenario seeds"""
+    sweep = job_spec.get('sweep', {})
+    base_spec = {k: v for k, v in job_spec.items() if k != 'sweep'}
+    base_seed = sweep.get('seed', job_spec.get('seed', 0))
+    repeats = sweep.get('repeats', 1)
+
+    index = 0
+    for overrides in expand_parameter_grid(sweep.get('parameters', {})):
+        spec = apply_overrides(base_spec, overrides)
+        for _ in range(repeats):
+            yield index, overrides, dict(spec, seed=scenario_seed(base_seed, index))
+            index += 1
+
+
+def run_sweep(
+    job_spec: Dict[str, Any],
+    max_workers: Optional[int] = None,
+    chunk_bytes: Optional[int] = None,
+    result_cache=None,
+    cache_key: Optional[Callable[[Dict[str, Any]], str]] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Run every scenario of a sweep across a process pool, yielding results as
+    they finish (completion order, not submission order). Only a bounded
+    number of tasks is in flight at once, so grids of any size stream through.
+    Scenarios found in result_cache are served without touching the pool.
+    """
+    sweep = job_spec.get('sweep', {})
+    max_workers = max_workers or sweep.get('max_workers') or os.cpu_count() or 1
+    chunk_bytes = chunk_bytes or DEFAULT_CHUNK_BYTES
+    limit = max_workers * INFLIGHT_PER_WORKER
+    tasks = iter_sweep_tasks(job_spec)
+    use_cache = result_cache is not None and cache_key is not None
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=_init_pool_worker,
+        initargs=(chunk_bytes,)
+    ) as pool:
+        pending: Dict[Any, Optional[str]] = {}  # future -> cache key
+        ready = deque()
+
+        def fill():
+            while len(pending) < limit and len(ready) < limit:
+                task = next(tasks, None)
+                if task is None:
+                    return
+                index, overrides, spec = task
+                key = cache_key(spec) if use_cache else None
+                cached = result_cache.get(key) if key else None
+                if cached is not None:
+                    ready.append(dict(cached, cached=True, index=index, parameters=overrides))
+                else:
+                    pending[pool.submit(_run_pool_scenario, task)] = key
+
+        while True:
+            fill()
+            if ready:
+                yield ready.popleft()
+                continue
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                result = future.result()
+                if key and result["status"] != "error":
+                    result_cache.put(key, {k: v for k, v in result.items() if k not in ("index", "parameters")})
+                yield result
@@ -0,0 +1,138 @@
+import numpy as np
+from dataclasses import dataclass
+from typing import Dict, Any, Iterator, List, Optional
+
+# Default sensor models, matching the data rates the simulator has always assumed
+CAMERA_RESOLUTION = (1920, 1080)  # width, height
+CAMERA_FPS = 30
+LIDAR_POINTS_PER_FRAME = 100_000  # 1M points/s at 10Hz
+LIDAR_FPS = 10
+RAW_BYTES_PER_SEC = 1024 * 1024
+
+LANE_MARKER_HALF_WIDTH = 2  # pixels
+LIDAR_BACKGROUND_RANGE = (5.0, 100.0)  # meters
+OBSTACLE_START_DISTANCE = 20.0  # meters
+
+DEFAULT_CHUNK_BYTES = 64 * 1024 * 1024
+
+
+@dataclass
+class SensorChunk:
+    """A contiguous run of frames from one sensor"""
+    sensor_type: str
+    sensor_id: int
+    fps: float
+    frame_start: int
+    data: np.ndarray
+    truth: Dict[str, np.ndarray]  # ground truth embedded in the frames (e.g. lane column)
+
+    @property
+    def frames(self) -> int:
+        return self.data.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes
+
+
+class _SensorModel:
+    """Per-sensor generator state; random walks carry over between chunks"""
+
+    def __init__(self, sensor_id: int, spec: Dict[str, Any], rng: np.random.Generator):
+        self.sensor_id = sensor_id
+        self.type = spec.get('type', 'raw')
+        self.rng = rng
+        if self.type == 'camera':
+            self.width, self.height = spec.get('resolution', CAMERA_RESOLUTION)
+            self.fps = spec.get('fps', CAMERA_FPS)
+            self.frame_shape = (self.height, self.width, 3)
+            self.dtype = np.uint8
+            self.lane_col = self.width / 2
+        elif self.type == 'lidar':
+            self.fps = spec.get('fps', LIDAR_FPS)
+            self.frame_shape = (spec.get('points_per_frame', LIDAR_POINTS_PER_FRAME), 4)  # x, y, z, reflectivity
+            self.dtype = np.float32
+            self.obstacle = OBSTACLE_START_DISTANCE
+        else:
+            self.fps = spec.get('fps', 1)
+            self.frame_shape = (spec.get('bytes_per_sec', RAW_BYTES_PER_SEC) // self.fps,)
+            self.dtype = np.uint8
+        self.frame_bytes = int(np.prod(self.frame_shape)) * np.dtype(self.dtype).itemsize
+
+    def generate(self, frame_start: int, n: int) -> SensorChunk:
+        if self.type == 'camera':
+            data, truth = self._camera(n)
+        elif self.type == 'lidar':
+            data, truth = self._lidar(n)
+        else:
+            data, truth = self._raw(n), {}
+        return SensorChunk(self.type, self.sensor_id, self.fps, frame_start, data, truth)
+
+    def _camera(self, n: int):
+        # Sensor noise plus a bright lane marker whose column drifts as a random walk
+        frames = self.rng.integers(0, 256, size=(n,) + self.frame_shape, dtype=np.uint8)
+        cols = self.lane_col + np.cumsum(self.rng.normal(0.0, 2.0, n))
+        cols = np.clip(np.rint(cols), LANE_MARKER_HALF_WIDTH, self.width - LANE_MARKER_HALF_WIDTH - 1).astype(np.int64)
+        self.lane_col = float(cols[-1])
+        offsets = np.arange(-LANE_MARKER_HALF_WIDTH, LANE_MARKER_HALF_WIDTH + 1)
+        frames[np.arange(n)[:, None], :, cols[:, None] + offsets] = 255
+        return frames, {'lane_col': cols}
+
+    def _lidar(self, n: int):
+        # Background returns at uniform ranges plus one obstacle approaching/receding
+        points, _ = self.frame_shape
+        ranges = self.rng.uniform(*LIDAR_BACKGROUND_RANGE, size=(n, points)).astype(np.float32)
+        obstacle = self.obstacle + np.cumsum(self.rng.normal(-0.05, 0.3, n))
+        obstacle = np.clip(obstacle, 0.2, LIDAR_BACKGROUND_RANGE[1])
+        self.obstacle = float(obstacle[-1])
+        ranges[:, 0] = obstacle
+
+        azimuth = self.rng.uniform(-np.pi, np.pi, size=(n, points)).astype(np.float32)
+        elevation = self.rng.uniform(-0.26, 0.26, size=(n, points)).astype(np.float32)
+        cloud = np.empty((n, points, 4), dtype=np.float32)
+        flat = ranges * np.cos(elevation)
+        cloud[..., 0] = flat * np.cos(azimuth)
+        cloud[..., 1] = flat * np.sin(azimuth)
+        cloud[..., 2] = ranges * np.sin(elevation)
+        cloud[..., 3] = self.rng.random((n, points), dtype=np.float32)
+        return cloud, {'obstacle_distance': obstacle}
+
+    def _raw(self, n: int):
+        return self.rng.integers(0, 256, size=(n,) + self.frame_shape, dtype=np.uint8)
+
+
+def stream_sensor_data(
+    sensors: List[Dict[str, Any]],
+    duration_sec: float,
+    seed: Optional[int] = None,
+    chunk_bytes: int = DEFAULT_CHUNK_BYTES
+) -> Iterator[SensorChunk]:
+    """
+    Stream synthetic frames for all sensors in time-aligned windows.
+
+    Each window holds at most ~chunk_bytes across all sensors (and at least one
+    frame per sensor), so peak memory is bounded by the chunk size rather than
+    by duration_sec.
+    """
+    rng = np.random.default_rng(seed)
+    models = []
+    for spec in sensors:
+        for _ in range(spec.get('count', 1)):
+            models.append(_SensorModel(len(models), spec, rng))
+    if not models:
+        return
+
+    bytes_per_sec = sum(m.frame_bytes * m.fps for m in models)
+    window = max(chunk_bytes / bytes_per_sec, max(1.0 / m.fps for m in models))
+    window = min(window, duration_sec)
+
+    emitted = [0] * len(models)
+    t = 0.0
+    while t < duration_sec:
+        t = min(t + window, duration_sec)
+        for i, model in enumerate(models):
+            target = int(round(t * model.fps))
+            n = target - emitted[i]
+            if n > 0:
+                yield model.generate(emitted[i], n)
+                emitted[i] = target
@@ -1,10 +1,15 @@
 import time
 import logging
-import random
-import uuid
-from typing import Dict, Any, List
+import numpy as np
+from dataclasses import dataclass
+from typing import Dict, Any, Callable, List, Iterable, Iterator, Optional
 from prometheus_client import Counter, Histogram, Gauge
 
+from evaluation import EvaluationReport, Rule, RuleResult, evaluate_series
+from result_cache import ResultCache, canonical_spec_hash, create_result_cache
+from scenario_sweep import ScenarioStats, grid_size, run_sweep
+from sensor_data import SensorChunk, stream_sensor_data, DEFAULT_CHUNK_BYTES, LANE_MARKER_HALF_WIDTH
+
 # Metrics
 SIMULATION_SCENARIOS_TOTAL = Counter(
     'simulation_scenarios_total',
@@ -24,56 +29,118 @@ SIMULATION_PASS_RATE = Gauge(
     'simulation_pass_rate',
     'Rolling pass rate of simulations'
 )
+SENSOR_DATA_THROUGHPUT = Gauge(
+    'sensor_data_throughput_bytes_per_second',
+    'Measured sensor data throughput of the last simulation run',
+    ['scenario_type']
+)
+
+# Perception/planning model constants
+LANE_WIDTH_M = 3.5
+COLLISION_DISTANCE_M = 0.5
+NEAR_FIELD_M = 10.0
+CONTROL_LATENCY_S = 0.1
+
+# Bump whenever generation, pipeline or evaluation changes results, invalidates cached results
+WORKER_VERSION = "sim-2"
+
+MAX_REPORTED_FAILURES = 100  # Sweep summaries keep at most this many failing scenarios
+
+@dataclass
+class PipelineOutput:
+    metrics: Dict[str, float]  # scenario-level summary
+    series: Dict[str, np.ndarray]  # per-frame values
+    bytes_processed: int
+    elapsed_sec: float
+
+    @property
+    def bytes_per_sec(self) -> float:
+        return self.bytes_processed / self.elapsed_sec if self.elapsed_sec > 0 else 0.0
 
 class SimulationWorker:
-    def __init__(self):
+    def __init__(self, chunk_bytes: int = DEFAULT_CHUNK_BYTES, result_cache: Optional[ResultCache] = None):
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger("SimulationWorker")
+        self.chunk_bytes = chunk_bytes
+        self.stats = ScenarioStats()
+        self.result_cache = result_cache
         
-    def generate_sensor_data(self, sensors: List[Dict[str, Any]], duration_sec: int) -> int:
-        """Simulate data generation. Returns total bytes generated."""
-        total_bytes = 0
-        for sensor in sensors:
-            sType = sensor.get('type')
-            count = sensor.get('count', 1)
-            
-            # Rough estimation of data rate
-            if sType == 'camera':
-                # 1920x1080 * 3 bytes * 30fps
-                bytes_per_sec = 1920 * 1080 * 3 * 30 * count
-            elif sType == 'lidar':
-                # 1M points * 16 bytes (x,y,z,reflectivity)
-                bytes_per_sec = 1000000 * 16 * count
-            else:
-                bytes_per_sec = 1024 * 1024 # Default 1MB/s
-                
-            total_bytes += bytes_per_sec * duration_sec
-            
-        return total_bytes
-
-    def run_inference_pipeline(self, data_bytes: int) -> Dict[str, float]:
-        """Simulate processing pipeline (Inference + Planning + Control)"""
-        # Simulate CPU/GPU load
-        time.sleep(random.uniform(0.1, 0.5)) 
-        
-        # Simulate meaningful metrics
-        return {
-            "collision_rate": random.uniform(0, 0.05), # Low prob of collision
-            "lane_deviation": random.uniform(0, 0.3),  # Meters
-            "reaction_time": random.uniform(0.1, 0.4)  # Seconds
+    def generate_sensor_data(
+        self,
+        sensors: List[Dict[str, Any]],
+        duration_sec: float,
+        seed: Optional[int] = None
+    ) -> Iterator[SensorChunk]:
+        """Stream synthetic sensor frames in fixed-size chunks"""
+        return stream_sensor_data(sensors, duration_sec, seed=seed, chunk_bytes=self.chunk_bytes)
+
+    def run_inference_pipeline(self, chunks: Iterable[SensorChunk]) -> PipelineOutput:
+        """Perception over the sensor stream: lane detection on camera, obstacle ranging on lidar"""
+        lane_deviation: List[np.ndarray] = []
+        obstacle_distance: List[np.ndarray] = []
+        near_fraction: List[np.ndarray] = []
+        lidar_fps = None
+        bytes_processed = 0
+        start = time.perf_counter()
+
+        for chunk in chunks:
+            data = chunk.data
+            if chunk.sensor_type == 'camera':
+                # Lane marker = brightest marker-wide band of the red channel
+                width = data.shape[2]
+                profile = np.cumsum(data[..., 0].sum(axis=1, dtype=np.int64), axis=1)
+                band = 2 * LANE_MARKER_HALF_WIDTH + 1
+                band_sums = profile[:, band - 1:] - np.pad(profile[:, :-band], ((0, 0), (1, 0)))
+                lane_col = band_sums.argmax(axis=1) + LANE_MARKER_HALF_WIDTH
+                lane_deviation.append(np.abs(lane_col - width / 2) / width * LANE_WIDTH_M)
+            elif chunk.sensor_type == 'lidar':
+                xyz = data[..., :3]
+                ranges = np.sqrt(np.einsum('fpi,fpi->fp', xyz, xyz))
+                obstacle_distance.append(ranges.min(axis=1))
+                near_fraction.append((ranges < NEAR_FIELD_M).mean(axis=1))
+                lidar_fps = chunk.fps
+
+            bytes_processed += chunk.nbytes
+            SENSOR_DATA_BYTES.inc(chunk.nbytes)
+
+        elapsed = time.perf_counter() - start
+
+        series: Dict[str, np.ndarray] = {}
+        if lane_deviation:
+            series['lane_deviation'] = np.concatenate(lane_deviation)
+        if obstacle_distance:
+            distance = np.concatenate(obstacle_distance)
+            series['collision'] = (distance < COLLISION_DISTANCE_M).astype(np.float32)
+            # Detection latency (one sensor frame) + actuation + planning cost of cluttered scenes
+            detection = 1.0 / lidar_fps
+            series['reaction_time'] = detection + CONTROL_LATENCY_S + 0.2 * np.concatenate(near_fraction)
+
+        metrics = {
+            "collision_rate": float(series['collision'].mean()) if 'collision' in series else 0.0,
+            "lane_deviation": float(series['lane_deviation'].mean()) if 'lane_deviation' in series else 0.0,
+            "reaction_time": float(series['reaction_time'].mean()) if 'reaction_time' in series else CONTROL_LATENCY_S
         }
+        return PipelineOutput(metrics, series, bytes_processed, elapsed)
 
-    def evaluate(self, metrics: Dict[str, float], thresholds: Dict[str, float]) -> bool:
-        """Compare metrics against thresholds"""
-        passed = True
+    def evaluate(
+        self,
+        metrics: Dict[str, float],
+        thresholds: Dict[str, float],
+        series: Optional[Dict[str, np.ndarray]] = None,
+        rules: Optional[List[Dict[str, Any]]] = None
+    ) -> EvaluationReport:
+        """Compare scalar metrics against thresholds and per-frame series against rules"""
+        report = evaluate_series(series or {}, [Rule.from_dict(r) for r in rules or []])
+        # Plain thresholds keep their original meaning: summary metric must not exceed them
         for k, v in metrics.items():
             if k in thresholds:
-                if v > thresholds[k]:
-                    passed = False
-                    break
-        return passed
+                passed = v <= thresholds[k]
+                report.rules.append(RuleResult(k, 'value', thresholds[k], v, passed, int(not passed)))
+                report.passed = report.passed and passed
+        return report
 
-    def process_job(self, job_spec: Dict[str, Any]):
+    def run_scenario(self, job_spec: Dict[str, Any]) -> Dict[str, Any]:
+        """Generate, process and evaluate one scenario (no Prometheus bookkeeping besides sensor bytes)"""
         scenario = job_spec.get('scenario', {})
         sensors = job_spec.get('sensors', [])
         eval_config = job_spec.get('evaluation', {})
@@ -84,35 +151,119 @@ class SimulationWorker:
             duration = int(duration_str.replace('s', ''))
         except:
             duration = 10
-            
-        with SIMULATION_DURATION.labels(scenario_type=scen_type).time():
-            self.logger.info(f"Starting simulation: {scen_type} for {duration}s")
-            
-            # 1. Generate Data
-            data_bytes = self.generate_sensor_data(sensors, duration)
-            SENSOR_DATA_BYTES.inc(data_bytes)
-            
-            # 2. Run Pipeline
-            results = self.run_inference_pipeline(data_bytes)
-            
-            # 3. Evaluate results
-            thresholds = eval_config.get('threshold', {})
-            passed = self.evaluate(results, thresholds)
-            
-            status = "passed" if passed else "failed"
-            SIMULATION_SCENARIOS_TOTAL.labels(scenario_type=scen_type, status=status).inc()
-            
-            self.logger.info(f"Simulation {status}. Metrics: {results}")
-            
-            return {
-                "status": status,
-                "metrics": results,
-                "data_processed_mb": data_bytes / (1024*1024)
-            }
+
+        # Unseeded specs get a seed derived from their content, so every run is reproducible
+        seed = job_spec.get('seed')
+        if seed is None:
+            seed = int(self.cache_key(job_spec)[:16], 16)
+
+        start = time.perf_counter()
+        self.logger.info(f"Starting simulation: {scen_type} for {duration}s")
+        
+        # 1. Generate Data (lazily, chunk by chunk)
+        chunks = self.generate_sensor_data(sensors, duration, seed=seed)
+        
+        # 2. Run Pipeline
+        output = self.run_inference_pipeline(chunks)
+        results = output.metrics
+        SENSOR_DATA_THROUGHPUT.labels(scenario_type=scen_type).set(output.bytes_per_sec)
+        
+        # 3. Evaluate results
+        report = self.evaluate(
+            results,
+            eval_config.get('threshold', {}),
+            series=output.series,
+            rules=eval_config.get('rules', [])
+        )
+        
+        status = "passed" if report.passed else "failed"
+        self.logger.info(f"Simulation {status}. Metrics: {results}")
+        
+        return {
+            "status": status,
+            "scenario_type": scen_type,
+            "metrics": results,
+            "evaluation": report.to_dict(),
+            "elapsed_sec": time.perf_counter() - start,
+            "data_processed_mb": output.bytes_processed / (1024*1024),
+            "throughput_mb_per_sec": output.bytes_per_sec / (1024*1024)
+        }
+
+    def cache_key(self, job_spec: Dict[str, Any]) -> str:
+        return canonical_spec_hash(job_spec, WORKER_VERSION)
+
+    def record_result(self, result: Dict[str, Any]):
+        """Update scenario counters, duration histogram and rolling pass rate"""
+        scen_type = result["scenario_type"]
+        SIMULATION_SCENARIOS_TOTAL.labels(scenario_type=scen_type, status=result["status"]).inc()
+        if not result.get("cached"):
+            SIMULATION_DURATION.labels(scenario_type=scen_type).observe(result["elapsed_sec"])
+        self.stats.add(scen_type, result["status"] == "passed", result["elapsed_sec"], result["metrics"])
+        SIMULATION_PASS_RATE.set(self.stats.rolling_pass_rate)
+
+    def run_parameter_sweep(
+        self,
+        job_spec: Dict[str, Any],
+        on_result: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
+        """Run a sweep job across a process pool, streaming each result to on_result"""
+        sweep = job_spec['sweep']
+        total = grid_size(sweep.get('parameters', {})) * sweep.get('repeats', 1)
+        self.logger.info(f"Starting sweep of {total} scenarios")
+
+        sweep_stats = ScenarioStats(window=self.stats.recent.maxlen)
+        failures: List[Dict[str, Any]] = []
+        for result in run_sweep(
+            job_spec,
+            chunk_bytes=self.chunk_bytes,
+            result_cache=self.result_cache,
+            cache_key=self.cache_key
+        ):
+            self.record_result(result)
+            # Pool processes have their own registries, account their bytes here
+            if not result.get("cached"):
+                SENSOR_DATA_BYTES.inc(result["data_processed_mb"] * 1024 * 1024)
+            sweep_stats.add(
+                result["scenario_type"], result["status"] == "passed",
+                result["elapsed_sec"], result["metrics"]
+            )
+            if result["status"] != "passed" and len(failures) < MAX_REPORTED_FAILURES:
+                failures.append(result)
+            if on_result:
+                on_result(result)
+
+        summary = sweep_stats.summary()
+        self.logger.info(f"Sweep finished: {summary['passed']}/{summary['scenarios']} passed")
+        return dict(
+            summary,
+            status="passed" if summary["passed"] == summary["scenarios"] else "failed",
+            failures=failures
+        )
+
+    def process_job(
+        self,
+        job_spec: Dict[str, Any],
+        on_result: Optional[Callable[[Dict[str, Any]], None]] = None
+    ):
+        if 'sweep' in job_spec:
+            return self.run_parameter_sweep(job_spec, on_result=on_result)
+
+        key = self.cache_key(job_spec) if self.result_cache else None
+        cached = self.result_cache.get(key) if key else None
+        if cached is not None:
+            result = dict(cached, cached=True)
+        else:
+            result = self.run_scenario(job_spec)
+            if key:
+                self.result_cache.put(key, result)
+        self.record_result(result)
+        if on_result:
+            on_result(result)
+        return result
 
 if __name__ == "__main__":
     # Test run
-    worker = SimulationWorker()
+    worker = SimulationWorker(result_cache=create_result_cache())
     spec = {
         "scenario": {"type": "driving", "duration": "5s"},
         "sensors": [{"type": "camera", "count": 1}],
@@ -0,0 +1,112 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from inference_worker import InferenceWorker, CPUExecutionConfig
+from cpu_tuning import candidate_configs, tune
+
+INPUT_SHAPE = (3, 16, 16)
+
+
+def save_tiny_model(path: str):
+    model = nn.Sequential(
+        nn.Conv2d(3, 4, 3), nn.ReLU(), nn.AdaptiveAvgPool2d(1), nn.Flatten(), nn.Linear(4, 2)
+    ).eval()
+    torch.jit.save(torch.jit.script(model), path)
+
+
+class TestCPUExecution(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.model_path = os.path.join(self.tmpdir.name, "tiny.pt")
+        save_tiny_model(self.model_path)
+        self.inputs = [np.random.randn(*INPUT_SHAPE).astype(np.float32) for _ in range(3)]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_optimized_matches_plain(self):
+        plain = InferenceWorker(
+            self.model_path, device="cpu", input_shape=INPUT_SHAPE,
+            cpu_config=CPUExecutionConfig(channels_last=False, freeze=False)
+        )
+        tuned = InferenceWorker(
+            self.model_path, device="cpu", input_shape=INPUT_SHAPE,
+            cpu_config=CPUExecutionConfig(num_threads=1, channels_last=True, freeze=True)
+        )
+
+        self.assertEqual(tuned.execution_mode, "cpu")
+        expected = [r["prediction"] for r in plain.predict(self.inputs)]
+        actual = [r["prediction"] for r in tuned.predict(self.inputs)]
+        np.testing.assert_allclose(actual, expected, rtol=1e-4, atol=1e-5)
+
+    def test_config_from_dict_ignores_unknown_keys(self):
+        cfg = CPUExecutionConfig.from_dict({"num_threads": 2, "quantize": True, "unknown": 1})
+        self.assertEqual(cfg, CPUExecutionConfig(num_threads=2, quantize=True))
+
+    def test_quantize_is_skipped_for_torchscript(self):
+        with self.assertLogs(level="WARNING") as logs:
+            worker = InferenceWorker(
+                self.model_path, device="cpu", input_shape=INPUT_SHAPE,
+                cpu_config=CPUExecutionConfig(quantize=True, freeze=False)
+            )
+        self.assertIsInstance(worker.model, torch.jit.ScriptModule)
+        self.assertIn("quantize=True ignored", logs.output[0])
+
+        self.assertFalse(any(c.quantize for c in candidate_configs([1], model_path=self.model_path)))
+        eager_path = os.path.join(self.tmpdir.name, "eager.pt")
+        torch.save(nn.Linear(2, 2), eager_path)
+        self.assertTrue(any(c.quantize for c in candidate_configs([1], model_path=eager_path)))
+
+    def test_tune_orders_by_throughput(self):
+        configs = [
+            CPUExecutionConfig(num_threads=1, freeze=False),
+            CPUExecutionConfig(num_threads=1, freeze=True),
+        ]
+        results = tune(self.model_path, 2, configs=configs, input_shape=INPUT_SHAPE, iterations=3, warmup=1)
+
+        self.assertEqual(len(results), 2)
+        self.assertGreaterEqual(results[0].throughput, results[1].throughput)
+        self.assertTrue(all(r.error is None for r in results))
+
+
+class TestBatchBuckets(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.model_path = os.path.join(self.tmpdir.name, "tiny.pt")
+        save_tiny_model(self.model_path)
+        self.worker = InferenceWorker(
+            self.model_path, device="cpu", input_shape=INPUT_SHAPE,
+            max_batch_size=8, batch_buckets=(1, 2, 4, 8)
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_padding_preserves_results(self):
+        inputs = [np.random.randn(*INPUT_SHAPE).astype(np.float32) for _ in range(3)]
+        padded = [r["prediction"] for r in self.worker.predict(inputs)]
+        self.worker.pad_to_bucket = False
+        unpadded = [r["prediction"] for r in self.worker.predict(inputs)]
+
+        self.assertEqual(self.worker._bucket_for(3), 4)
+        self.assertEqual(len(padded), 3)
+        np.testing.assert_allclose(padded, unpadded, rtol=1e-4, atol=1e-5)
+
+    def test_oversized_batch_is_chunked(self):
+        inputs = [np.zeros(INPUT_SHAPE, dtype=np.float32)] * 11
+        self.assertEqual(len(self.worker.predict(inputs)), 11)
+
+    def test_warmup_times_first_request_per_bucket(self):
+        stats = self.worker.warmup(iterations=1)
+        self.assertEqual(sorted(stats), [1, 2, 4, 8])
+        self.assertTrue(all(v > 0 for v in stats.values()))
+
+if __name__ == '__main__':
+    unittest.main()
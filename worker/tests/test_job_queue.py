@@ -0,0 +1,265 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+import fakeredis
+from prometheus_client import REGISTRY
+
+from ai_jobs.blob_store import LocalBlobStore
+from ai_jobs.fair_share import FAIR_SHARE_KEYS, WorkerResources, resource_class
+from ai_jobs.job_queue import WorkerJobQueue, seconds_between
+
+
+def histogram_count(name, job_type):
+    return REGISTRY.get_sample_value(f"{name}_count", {"job_type": job_type}) or 0.0
+
+
+class TestWorkerJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.queue = WorkerJobQueue(self.redis)
+        # Same layout RedisJobQueue.enqueue writes in the job-service
+        self.redis.hset("ai_jobs:data:job-1", mapping={
+            "job_id": "job-1",
+            "job_type": "inference",
+            "priority": "50",
+            "payload": json.dumps({"image": "img"}),
+            "submitted_at": "2024-01-01 12:00:00",
+            "retry_count": "0",
+            "queued_at": "2024-01-01T12:00:01+00:00",
+            "trace_context": json.dumps({"traceparent": "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"})
+        })
+        self.queue._enqueue_script(
+            keys=FAIR_SHARE_KEYS, args=["default", resource_class("inference"), "job-1", 50, 1, "1"]
+        )
+
+    def test_lifecycle_timestamps_and_histograms(self):
+        before = [histogram_count(n, "inference") for n in
+                  ("job_queue_wait_seconds", "job_execution_seconds", "job_total_latency_seconds")]
+
+        job = self.queue.dequeue()[0]
+        self.assertEqual(job.priority, 50)
+        self.assertEqual(job.payload, {"image": "img"})
+        self.assertIn("traceparent", job.trace_context)
+        self.assertTrue(self.redis.sismember("ai_jobs:processing", "job-1"))
+        self.assertEqual(self.redis.hget("ai_jobs:data:job-1", "status"), b"running")
+
+        self.queue.complete(job, {"ok": True}, metrics={"latency_p50_ms": 5.0})
+        data = self.redis.hgetall("ai_jobs:data:job-1")
+        self.assertEqual(data[b"status"], b"succeeded")
+        self.assertEqual(data[b"started_at"].decode(), job.started_at)
+        self.assertIsNotNone(seconds_between(job.started_at, data[b"completed_at"].decode()))
+        self.assertTrue(self.redis.sismember("ai_jobs:completed", "job-1"))
+        events = [f[b"event"] for _, f in self.redis.xrange("ai_jobs:status_stream")]
+        self.assertEqual(events, [b"job_started", b"job_completed", b"job_metrics"])
+
+        after = [histogram_count(n, "inference") for n in
+                 ("job_queue_wait_seconds", "job_execution_seconds", "job_total_latency_seconds")]
+        self.assertEqual([a - b for a, b in zip(after, before)], [1, 1, 1])
+
+    def test_failure_requeues_then_dead_letters(self):
+        for attempt in range(4):
+            job = self.queue.dequeue()[0]
+            self.queue.fail(job, "boom")
+            if attempt < 3:
+                self.assertFalse(self.redis.sismember("ai_jobs:processing", "job-1"))
+
+        self.assertEqual(self.redis.zcard("ai_jobs:queue:default:inference:g0:c1:m1"), 0)
+        self.assertEqual(self.redis.scard("ai_jobs:fair:class_index"), 0)
+        self.assertEqual(self.redis.lrange("ai_jobs:dlq", 0, -1), [b"job-1"])
+        self.assertEqual(self.redis.hget("ai_jobs:data:job-1", "status"), b"dead_letter")
+
+    def test_worker_only_gets_jobs_that_fit(self):
+        gpu_class = resource_class("inference", gpus=1)
+        self.redis.hset("ai_jobs:data:job-2", mapping={
+            "job_id": "job-2", "job_type": "inference", "priority": "90", "payload": "{}",
+            "submitted_at": "2024-01-01 12:00:00", "resource_class": gpu_class
+        })
+        self.queue._enqueue_script(keys=FAIR_SHARE_KEYS, args=["default", gpu_class, "job-2", 90, 1, "1"])
+
+        cpu_only = WorkerResources(gpus=0, cpu_millis=4000, memory_mb=8192)
+        self.assertEqual([j.job_id for j in self.queue.dequeue(2, resources=cpu_only, worker_id="w1")], ["job-1"])
+        self.assertEqual(self.queue.dequeue(resources=cpu_only, worker_id="w1"), [])
+        self.assertEqual(self.redis.hget("ai_jobs:worker:w1", "gpus"), b"0")
+
+        job = self.queue.dequeue(resources=WorkerResources(gpus=2, cpu_millis=4000, memory_mb=8192))[0]
+        self.assertEqual(job.resource_class, gpu_class)
+
+    def test_array_tasks_finish_the_array(self):
+        job_class = resource_class("inference")
+        self.redis.hset("ai_jobs:data:sweep", mapping={
+            "job_id": "sweep", "job_type": "inference", "priority": "60", "submitted_at": "2024-01-01 12:00:00",
+            "payload": json.dumps({"args": ["--shard={task_index}"]}), "array_size": "3", "resource_class": job_class
+        })
+        self.queue._enqueue_script(keys=FAIR_SHARE_KEYS, args=["default", job_class, "sweep", 60, 1, "1", 3])
+
+        tasks = [t for t in self.queue.dequeue(4) if t.job_id == "sweep"]
+        self.assertEqual([t.payload["args"] for t in tasks], [["--shard=0"], ["--shard=1"], ["--shard=2"]])
+        self.queue.fail(tasks[0], "boom", retry=False)
+        self.queue.complete(tasks[1], {"ok": True})
+        self.assertEqual(self.redis.hget("ai_jobs:data:sweep", "status"), b"running")
+        self.queue.complete(tasks[2], {"ok": True})
+
+        self.assertEqual(self.redis.hget("ai_jobs:data:sweep", "status"), b"failed")
+        self.assertEqual(self.redis.hgetall("ai_jobs:array:sweep:errors"), {b"0": b"boom"})
+        self.assertEqual(self.redis.hlen("ai_jobs:array:sweep:results"), 2)
+        self.assertFalse(self.redis.sismember("ai_jobs:processing", "sweep:2"))
+
+    def test_array_reports_its_start_once(self):
+        job_class = resource_class("inference")
+        self.redis.delete("ai_jobs:data:job-1")
+        self.redis.hset("ai_jobs:data:sweep", mapping={
+            "job_id": "sweep", "job_type": "inference", "priority": "60", "submitted_at": "2024-01-01 12:00:00",
+            "payload": "{}", "array_size": "2", "resource_class": job_class
+        })
+        self.queue._enqueue_script(keys=FAIR_SHARE_KEYS, args=["default", job_class, "sweep", 60, 1, "1", 2])
+
+        first = self.queue.dequeue()[0]
+        self.assertEqual(first.task_index, 0)
+        self.queue.fail(first, "boom")
+        retried, second = sorted(self.queue.dequeue(2), key=lambda t: t.task_index)
+
+        events = [f[b"event"] for _, f in self.redis.xrange("ai_jobs:status_stream")]
+        self.assertEqual(events.count(b"job_started"), 1)
+        self.assertEqual(self.redis.hget("ai_jobs:data:sweep", "started_at").decode(), first.started_at)
+        self.assertEqual((retried.task_index, retried.started_at), (0, first.started_at))
+        self.assertEqual(second.started_at, first.started_at)
+
+    def test_array_task_without_data_leaves_no_processing_member(self):
+        job_class = resource_class("inference")
+        self.redis.delete("ai_jobs:data:job-1")
+        self.redis.hset("ai_jobs:data:sweep", mapping={
+            "job_id": "sweep", "job_type": "inference", "priority": "60", "submitted_at": "2024-01-01 12:00:00",
+            "payload": "{}", "array_size": "2", "resource_class": job_class
+        })
+        self.queue._enqueue_script(keys=FAIR_SHARE_KEYS, args=["default", job_class, "sweep", 60, 1, "1", 2])
+
+        # The hash disappears after the dequeue script claimed a task
+        dequeue_script = self.queue._dequeue_script
+
+        def claim_then_delete(**kwargs):
+            popped = dequeue_script(**kwargs)
+            self.redis.delete("ai_jobs:data:sweep")
+            return popped
+
+        self.queue._dequeue_script = claim_then_delete
+        self.assertEqual(self.queue.dequeue(), [])
+        self.assertEqual(self.redis.scard("ai_jobs:processing"), 0)
+        self.assertEqual(self.redis.zcard("ai_jobs:leases"), 0)
+
+    def test_expired_leases_are_requeued(self):
+        job_class = resource_class("inference")
+        self.redis.hset("ai_jobs:data:sweep", mapping={
+            "job_id": "sweep", "job_type": "inference", "priority": "60", "submitted_at": "2024-01-01 12:00:00",
+            "payload": "{}", "array_size": "2", "resource_class": job_class
+        })
+        self.queue._enqueue_script(keys=FAIR_SHARE_KEYS, args=["default", job_class, "sweep", 60, 1, "1", 2])
+
+        # A worker prefetches a batch and dies without finishing it
+        crashed = WorkerJobQueue(self.redis, lease_seconds=0)
+        prefetched = crashed.dequeue(3, worker_id="w1")
+        self.assertEqual(self.redis.zcard("ai_jobs:leases"), 3)
+        self.assertEqual(self.queue.reap_expired(), 3)
+        self.assertEqual(self.queue.reap_expired(), 0)
+        self.assertEqual(self.redis.scard("ai_jobs:processing"), 0)
+        self.assertEqual(self.redis.hget("ai_jobs:data:job-1", "status"), b"queued")
+        self.assertFalse(crashed.renew(prefetched[0]))
+
+        redelivered = self.queue.dequeue(3)
+        self.assertEqual(
+            sorted((j.job_id, j.task_index) for j in redelivered), [("job-1", -1), ("sweep", 0), ("sweep", 1)]
+        )
+        self.assertEqual(self.redis.hget("ai_jobs:data:job-1", "retry_count"), b"1")
+        for job in redelivered:
+            self.assertTrue(self.queue.renew(job))
+            self.queue.complete(job, {"ok": True})
+        self.assertEqual(self.redis.zcard("ai_jobs:leases"), 0)
+        self.assertEqual(self.redis.hget("ai_jobs:data:sweep", "status"), b"succeeded")
+
+    def test_task_finished_twice_counts_once(self):
+        job_class = resource_class("inference")
+        self.redis.delete("ai_jobs:data:job-1")
+        self.redis.hset("ai_jobs:data:sweep", mapping={
+            "job_id": "sweep", "job_type": "inference", "priority": "60", "submitted_at": "2024-01-01 12:00:00",
+            "payload": "{}", "array_size": "2", "resource_class": job_class
+        })
+        self.queue._enqueue_script(keys=FAIR_SHARE_KEYS, args=["default", job_class, "sweep", 60, 1, "1", 2])
+
+        # Both leases are reaped right after the slow worker's ownership check for task 0
+        slow = WorkerJobQueue(self.redis, lease_seconds=0)
+        first, second = slow.dequeue(2)
+        renew = slow.renew
+
+        def renew_then_reaped(job):
+            owned = renew(job)
+            self.assertEqual(self.queue.reap_expired(), 2)
+            return owned
+
+        slow.renew = renew_then_reaped
+        self.assertTrue(slow.complete(first, {"run": "slow"}))
+        slow.renew = renew
+
+        # The retry of the finished task is dropped, only task 1 runs again
+        (retried,) = self.queue.dequeue(2)
+        self.assertEqual(retried.task_index, 1)
+        self.assertEqual(self.redis.llen("ai_jobs:array:sweep:retry"), 0)
+        self.assertEqual(self.redis.hget("ai_jobs:fair:class_pending", job_class), b"0")
+        self.queue.complete(retried, {"run": "retry"})
+        # Released with its result, a late failure report no longer owns the task
+        self.assertFalse(self.queue.fail(retried, "late duplicate", retry=False))
+
+        data = self.redis.hgetall("ai_jobs:data:sweep")
+        self.assertEqual((data[b"tasks_succeeded"], data.get(b"tasks_failed")), (b"2", None))
+        self.assertEqual(data[b"status"], b"succeeded")
+        self.assertEqual(json.loads(self.redis.hget("ai_jobs:array:sweep:results", "1")), {"run": "retry"})
+        self.assertEqual(self.redis.hlen("ai_jobs:array:sweep:errors"), 0)
+        events = [f[b"event"] for _, f in self.redis.xrange("ai_jobs:status_stream")]
+        self.assertEqual(events.count(b"job_array_finished"), 1)
+
+    def test_lost_lease_discards_the_result(self):
+        stalled = WorkerJobQueue(self.redis, lease_seconds=0)
+        job = stalled.dequeue()[0]
+        self.assertEqual(self.queue.reap_expired(), 1)
+
+        self.assertFalse(stalled.renew(job))
+        self.assertFalse(stalled.complete(job, {"ok": "late"}))
+        self.assertFalse(stalled.fail(job, "late"))
+        data = self.redis.hgetall("ai_jobs:data:job-1")
+        self.assertEqual((data[b"status"], data[b"retry_count"]), (b"queued", b"1"))
+        self.assertNotIn(b"result", data)
+
+        redelivered = self.queue.dequeue()[0]
+        self.assertTrue(self.queue.complete(redelivered, {"ok": True}))
+        self.assertEqual(self.redis.hget("ai_jobs:data:job-1", "status"), b"succeeded")
+        self.assertEqual(self.redis.hlen("ai_jobs:lease_owners"), 0)
+
+    def test_heartbeat_keeps_a_running_job_leased(self):
+        # Deadlines have one-second resolution, so the lease outlives a renewal by at least a second
+        queue = WorkerJobQueue(self.redis, lease_seconds=2)
+        job = queue.dequeue()[0]
+        with queue.keep_lease(job, interval=0.2) as lost:
+            time.sleep(3.5)
+            self.assertEqual(self.queue.reap_expired(), 0)
+        self.assertFalse(lost.is_set())
+        self.assertTrue(queue.complete(job, {"ok": True}))
+
+    def test_large_result_is_offloaded(self):
+        with tempfile.TemporaryDirectory() as root:
+            queue = WorkerJobQueue(self.redis, blob_store=LocalBlobStore(root), offload_threshold=1024)
+            job = queue.dequeue()[0]
+            queue.complete(job, {"predictions": list(range(10000))})
+
+            ref = json.loads(self.redis.hget("ai_jobs:data:job-1", "result"))
+            self.assertEqual(ref["blob_ref"], "results/job-1")
+            self.assertLess(ref["compressed_size"], ref["size"])
+            self.assertTrue(os.path.exists(os.path.join(root, "results", "job-1", "manifest.json")))
+
+    def test_naive_timestamps_are_utc(self):
+        self.assertEqual(seconds_between("2024-01-01 12:00:00", "2024-01-01T12:00:02+00:00"), 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
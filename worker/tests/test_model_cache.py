@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from inference_worker import InferenceWorker, CPUExecutionConfig
+from model_cache import ModelArtifactCache
+
+INPUT_SHAPE = (3, 16, 16)
+
+
+class TestModelArtifactCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmpdir.name, "cache")
+        self.model_path = os.path.join(self.tmpdir.name, "model.pt")
+        model = nn.Sequential(
+            nn.Conv2d(3, 4, 3), nn.ReLU(), nn.AdaptiveAvgPool2d(1), nn.Flatten(), nn.Linear(4, 2)
+        ).eval()
+        torch.save(model, self.model_path)
+        self.inputs = [np.random.randn(*INPUT_SHAPE).astype(np.float32) for _ in range(2)]
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make_worker(self, **config):
+        return InferenceWorker(
+            self.model_path, device="cpu", input_shape=INPUT_SHAPE,
+            cpu_config=CPUExecutionConfig(**config), cache_dir=self.cache_dir
+        )
+
+    def test_second_start_hits_cache(self):
+        cold = self.make_worker()
+        artifacts = [f for f in os.listdir(self.cache_dir) if f.endswith(".ts")]
+        self.assertEqual(len(artifacts), 1)
+
+        with mock.patch("inference_worker.InferenceWorker._load_model") as load_model:
+            warm = self.make_worker()
+            load_model.assert_not_called()
+
+        expected = [r["prediction"] for r in cold.predict(self.inputs)]
+        actual = [r["prediction"] for r in warm.predict(self.inputs)]
+        np.testing.assert_allclose(actual, expected, rtol=1e-5, atol=1e-6)
+        self.assertIn("load", warm.startup_timings)
+        self.assertIn("optimize", warm.startup_timings)
+
+    def test_key_changes_with_config_and_source(self):
+        cache = ModelArtifactCache(self.cache_dir)
+        base = cache.key(self.model_path, {"quantize": False})
+        self.assertNotEqual(base, cache.key(self.model_path, {"quantize": True}))
+
+        with open(self.model_path, "ab") as f:
+            f.write(b"\0")
+        self.assertNotEqual(base, cache.key(self.model_path, {"quantize": False}))
+
+    def test_eager_artifact_round_trip(self):
+        self.make_worker(freeze=False, quantize=True)
+        artifacts = [f for f in os.listdir(self.cache_dir) if f.endswith(".pt")]
+        self.assertEqual(len(artifacts), 1)
+
+        warm = self.make_worker(freeze=False, quantize=True)
+        self.assertEqual(len(warm.predict(self.inputs)), 2)
+
+if __name__ == '__main__':
+    unittest.main()
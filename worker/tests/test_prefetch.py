@@ -0,0 +1,37 @@
+import unittest
+
+from prefetch import AdaptivePrefetch, ServiceTimeEstimator
+
+
+class TestAdaptivePrefetch(unittest.TestCase):
+
+    def test_one_job_at_a_time_until_measured(self):
+        prefetch = AdaptivePrefetch(ServiceTimeEstimator(), latency_target=2.0, job_types=("inference",))
+        self.assertEqual(prefetch.count(), 1)
+
+    def test_batch_fits_the_latency_target(self):
+        estimator = ServiceTimeEstimator(alpha=0.5)
+        prefetch = AdaptivePrefetch(estimator, latency_target=2.0, job_types=("inference", "training"), max_count=32)
+        estimator.observe("inference", 0.1)
+        self.assertEqual(prefetch.count(), 20)
+
+        # The slowest known type bounds the batch
+        estimator.observe("training", 0.5)
+        self.assertEqual(prefetch.count(), 4)
+
+        # EWMA follows a slowdown
+        estimator.observe("training", 1.5)
+        self.assertAlmostEqual(estimator.estimate("training"), 1.0)
+        self.assertEqual(prefetch.count(), 2)
+
+    def test_count_is_clamped(self):
+        estimator = ServiceTimeEstimator()
+        prefetch = AdaptivePrefetch(estimator, latency_target=1.0, max_count=8)
+        estimator.observe("inference", 0.001)
+        self.assertEqual(prefetch.count(), 8)
+        estimator.observe("evaluation", 30.0)
+        self.assertEqual(prefetch.count(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import fakeredis
+
+from result_cache import ResultCache, canonical_spec_hash, create_result_cache
+from simulation_worker import SimulationWorker
+
+SPEC = {
+    "scenario": {"type": "driving", "duration": "1s"},
+    "sensors": [{"type": "camera", "resolution": [64, 48], "fps": 30}, {"type": "lidar", "points_per_frame": 500}],
+    "evaluation": {"threshold": {"collision_rate": 1.0}}
+}
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.redis = fakeredis.FakeRedis()
+        self.cache = ResultCache(self.tmpdir.name, redis_client=self.redis)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_spec_hash_is_canonical(self):
+        reordered = {"evaluation": SPEC["evaluation"], "sensors": SPEC["sensors"], "scenario": SPEC["scenario"]}
+        self.assertEqual(canonical_spec_hash(SPEC, "v1"), canonical_spec_hash(reordered, "v1"))
+        self.assertNotEqual(canonical_spec_hash(SPEC, "v1"), canonical_spec_hash(SPEC, "v2"))
+
+    def test_repeat_scenario_is_served_from_cache(self):
+        worker = SimulationWorker(chunk_bytes=256 * 1024, result_cache=self.cache)
+        first = worker.process_job(SPEC)
+        second = worker.process_job(SPEC)
+
+        self.assertNotIn("cached", first)
+        self.assertTrue(second["cached"])
+        self.assertEqual(first["metrics"], second["metrics"])
+        self.assertEqual(self.cache.hit_ratio, 0.5)
+
+    def test_unseeded_runs_are_deterministic(self):
+        worker = SimulationWorker(chunk_bytes=256 * 1024)
+        self.assertEqual(worker.run_scenario(SPEC)["metrics"], worker.run_scenario(SPEC)["metrics"])
+
+    def test_redis_tier_backfills_disk(self):
+        self.cache.put("abc", {"status": "passed"})
+        os.remove(os.path.join(self.tmpdir.name, "abc.json"))
+
+        self.assertEqual(self.cache.get("abc"), {"status": "passed"})
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, "abc.json")))
+
+    def test_size_based_eviction(self):
+        cache = ResultCache(self.tmpdir.name, redis_client=self.redis, max_disk_bytes=1000, max_redis_bytes=1000)
+        payload = {"blob": "x" * 300}
+        for i in range(5):
+            cache.put(f"k{i}", payload)
+
+        self.assertLessEqual(cache.disk_bytes, 1000)
+        self.assertLessEqual(int(self.redis.get("sim_cache:bytes")), 1000)
+        self.assertIsNotNone(cache.get("k4"))
+        self.assertIsNone(self.redis.get("sim_cache:entry:k0"))
+        # Accounting matches the entries that are left
+        sizes = {k.decode(): int(v) for k, v in self.redis.hgetall("sim_cache:sizes").items()}
+        self.assertEqual(sum(sizes.values()), int(self.redis.get("sim_cache:bytes")))
+        self.assertEqual(set(sizes), {k.decode() for k in self.redis.zrange("sim_cache:lru", 0, -1)})
+
+    def test_cache_is_configured_from_env(self):
+        env = {"SIM_CACHE_DIR": self.tmpdir.name, "SIM_CACHE_REDIS_URL": "", "SIM_CACHE_MAX_DISK_BYTES": "2048"}
+        with mock.patch.dict(os.environ, env):
+            cache = create_result_cache()
+        self.assertEqual((cache.cache_dir, cache.max_disk_bytes, cache.redis), (self.tmpdir.name, 2048, None))
+        with mock.patch.dict(os.environ, {"SIM_CACHE_DIR": ""}):
+            self.assertIsNone(create_result_cache())
+
+if __name__ == '__main__':
+    unittest.main()
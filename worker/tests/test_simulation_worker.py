@@ -0,0 +1,145 @@
+import unittest
+
+import numpy as np
+
+from evaluation import Rule, evaluate_series
+from scenario_sweep import apply_overrides, iter_sweep_tasks
+from sensor_data import stream_sensor_data
+from simulation_worker import SimulationWorker, LANE_WIDTH_M
+
+CAMERA = {"type": "camera", "resolution": [64, 48], "fps": 30}
+LIDAR = {"type": "lidar", "points_per_frame": 500, "fps": 10}
+
+
+class TestSensorStream(unittest.TestCase):
+
+    def test_chunks_are_bounded_and_cover_duration(self):
+        chunk_bytes = 64 * 48 * 3 * 8
+        chunks = list(stream_sensor_data([CAMERA], 2, seed=1, chunk_bytes=chunk_bytes))
+
+        self.assertEqual(sum(c.frames for c in chunks), 60)
+        self.assertTrue(all(c.nbytes <= chunk_bytes for c in chunks))
+        self.assertEqual([c.frame_start for c in chunks[:2]], [0, chunks[0].frames])
+
+    def test_seeded_stream_is_deterministic(self):
+        a = [c.data for c in stream_sensor_data([CAMERA, LIDAR], 1, seed=7)]
+        b = [c.data for c in stream_sensor_data([CAMERA, LIDAR], 1, seed=7)]
+        self.assertEqual(len(a), len(b))
+        for x, y in zip(a, b):
+            np.testing.assert_array_equal(x, y)
+
+
+class TestSimulationPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.worker = SimulationWorker(chunk_bytes=256 * 1024)
+
+    def test_pipeline_recovers_embedded_ground_truth(self):
+        chunks = list(self.worker.generate_sensor_data([CAMERA, LIDAR], 2, seed=3))
+        output = self.worker.run_inference_pipeline(chunks)
+
+        lane_cols = np.concatenate([c.truth['lane_col'] for c in chunks if c.sensor_type == 'camera'])
+        expected = np.abs(lane_cols - 32) / 64 * LANE_WIDTH_M
+        np.testing.assert_allclose(output.series['lane_deviation'], expected)
+        self.assertEqual(len(output.series['collision']), 20)
+        self.assertEqual(output.bytes_processed, sum(c.nbytes for c in chunks))
+
+    def test_process_job_reports_measured_throughput(self):
+        result = self.worker.process_job({
+            "scenario": {"type": "driving", "duration": "1s"},
+            "sensors": [CAMERA, LIDAR],
+            "evaluation": {"threshold": {"collision_rate": 1.0}},
+            "seed": 11
+        })
+        self.assertEqual(result["status"], "passed")
+        self.assertGreater(result["data_processed_mb"], 0)
+        self.assertGreater(result["throughput_mb_per_sec"], 0)
+
+
+class TestParameterSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.spec = {
+            "scenario": {"type": "driving", "duration": "1s"},
+            "sensors": [CAMERA, LIDAR],
+            "evaluation": {"threshold": {"collision_rate": 1.0}},
+            "sweep": {
+                "parameters": {"scenario.type": ["driving", "parking"], "sensors.1.fps": [5, 10]},
+                "seed": 42,
+                "max_workers": 2
+            }
+        }
+
+    def test_overrides_follow_dotted_paths(self):
+        spec = apply_overrides(self.spec, {"sensors.0.fps": 15, "scenario.weather": "rain"})
+        self.assertEqual(spec["sensors"][0]["fps"], 15)
+        self.assertEqual(spec["scenario"]["weather"], "rain")
+        self.assertEqual(CAMERA["fps"], 30)
+
+    def test_tasks_get_distinct_reproducible_seeds(self):
+        seeds = [spec["seed"] for _, _, spec in iter_sweep_tasks(self.spec)]
+        self.assertEqual(len(seeds), 4)
+        self.assertEqual(len(set(seeds)), 4)
+        self.assertEqual(seeds, [spec["seed"] for _, _, spec in iter_sweep_tasks(self.spec)])
+
+    def test_sweep_streams_results_and_aggregates(self):
+        worker = SimulationWorker(chunk_bytes=256 * 1024)
+        streamed = []
+        summary = worker.process_job(self.spec, on_result=streamed.append)
+
+        self.assertEqual(sorted(r["index"] for r in streamed), [0, 1, 2, 3])
+        self.assertEqual(summary["scenarios"], 4)
+        self.assertEqual(summary["status"], "passed")
+        self.assertEqual(summary["by_scenario_type"]["parking"]["count"], 2)
+        self.assertEqual(worker.stats.rolling_pass_rate, 1.0)
+
+
+class TestSeriesEvaluation(unittest.TestCase):
+
+    def setUp(self):
+        self.series = {"lane_deviation": np.zeros(1_000_000), "obstacle": np.full(1_000_000, 5.0)}
+        self.series["lane_deviation"][600_000:600_010] = 1.0
+
+    def test_max_reports_first_violating_frame(self):
+        report = evaluate_series(self.series, [Rule("lane_deviation", 0.5)])
+        self.assertFalse(report.passed)
+        self.assertEqual(report.rules[0].first_violation_frame, 600_000)
+        self.assertEqual(report.rules[0].violations, 10)
+
+    def test_rolling_mean_reports_window_end(self):
+        rules = [
+            Rule("lane_deviation", 0.5, aggregate="rolling_mean", window=10),
+            Rule("lane_deviation", 0.5, aggregate="rolling_mean", window=40),
+        ]
+        short, long = evaluate_series(self.series, rules).rules
+        self.assertFalse(short.passed)
+        self.assertEqual(short.first_violation_frame, 600_005)
+        self.assertEqual(short.violations, 9)
+        self.assertTrue(long.passed)
+        self.assertIsNone(long.first_violation_frame)
+
+    def test_percentiles_and_lower_bounds(self):
+        rules = [
+            Rule("lane_deviation", 0.5, aggregate="p99"),
+            Rule("lane_deviation", 0.5, aggregate="p99.9995"),
+            Rule("obstacle", 1.0, aggregate="min", op="lt"),
+            Rule("missing_metric", 0.0),
+        ]
+        p99, p99_9995, obstacle, missing = evaluate_series(self.series, rules).rules
+        self.assertTrue(p99.passed)
+        self.assertFalse(p99_9995.passed)
+        self.assertTrue(obstacle.passed)
+        self.assertTrue(missing.passed)
+        self.assertIsNone(missing.value)
+
+    def test_unknown_op_is_rejected(self):
+        with self.assertRaises(ValueError):
+            Rule.from_dict({"metric": "lane_deviation", "threshold": 0.5, "op": "ge"})
+
+    def test_plain_thresholds_check_summary_metrics(self):
+        report = SimulationWorker().evaluate({"collision_rate": 0.02}, {"collision_rate": 0.01})
+        self.assertFalse(report.passed)
+        self.assertEqual(report.rules[0].aggregate, "value")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,18 @@
 import unittest
 from unittest.mock import MagicMock, patch
 import numpy as np
+import torch
+import torch.nn as nn
+
+from inference_worker import InferenceWorker
+
+
+class FixedOutput(nn.Module):
+    """Real module (the worker traces and freezes it) that scores every sample [0.25, 0.75]"""
+
+    def forward(self, x):
+        return torch.tensor([0.25, 0.75]).expand(x.shape[0], 2)
 
-# Mock torch before importing worker
-with patch.dict('sys.modules', {'torch': MagicMock(), 'torch.nn': MagicMock()}):
-    from inference_worker import InferenceWorker
 
 class TestInferenceWorker(unittest.TestCase):
     
@@ -19,22 +27,9 @@ class TestInferenceWorker(unittest.TestCase):
         self.assertIsNotNone(worker.model)
         self.assertEqual(worker.model_name, "test_model.pt")
 
-    @patch('inference_worker.torch')
-    def test_predict(self, mock_torch):
-        # Setup mocks
-        mock_model = MagicMock()
-        mock_torch.jit.load.return_value = mock_model
-        
-        # Mock tensor conversion and model output
-        mock_tensor = MagicMock()
-        mock_torch.tensor.return_value = mock_tensor
-        
-        # Mock model output (return a mocked tensor)
-        mock_output = MagicMock()
-        mock_output.cpu().numpy().tolist.return_value = [[0.1, 0.9]]
-        mock_model.return_value = mock_output
-        
-        worker = InferenceWorker(model_path="test.pt", device="cpu")
+    def test_predict(self):
+        with patch.object(InferenceWorker, "_load_model", return_value=FixedOutput()):
+            worker = InferenceWorker(model_path="test.pt", device="cpu")
         
         # Test input
         inputs = [np.zeros((3, 224, 224))]
@@ -43,7 +38,8 @@ class TestInferenceWorker(unittest.TestCase):
         self.assertEqual(len(results), 1)
         self.assertIn("prediction", results[0])
         self.assertIn("latency_ms", results[0])
-        self.assertEqual(results[0]["prediction"], [[0.1, 0.9]])
+        # One row of scores per input sample
+        self.assertEqual(results[0]["prediction"], [0.25, 0.75])
 
 if __name__ == '__main__':
     unittest.main()